@@ -6,10 +6,10 @@ import threading
 import time
 
 from PiGoLib import *
+import PiGoRPC
 
 #TODO Onemogoci resize in maximize
 #TODO Spodaj naj bo logo
-#TODO Arduino
 
 TITLE_FONT = ("Tahoma", 36)
 BTN_FONT = ("Tahoma", 24)
@@ -50,7 +50,7 @@ class App(tk.Frame):
 
         for text, new_frame, (r, c) in zip(["A/D & D/A", "Motor Control", "Arduino", "Buffered I/O"],
                                            [ADDA_Frame(main, self), MotorFrame(main, self),
-                                            None, ExtIOFrame(main, self)],
+                                            ArduinoFrame(main, self), ExtIOFrame(main, self)],
                                            product([2, 3], [1, 2])):
             tk.Button(home, text=text, font = BTN_FONT, width=20, height=5,
                 command=self.replace_frame(new_frame)).grid(row=r, column=c)
@@ -341,6 +341,86 @@ class MotorFrame(ContentFrame):
         ContentFrame.show(self)
 
 
+class ArduinoFrame(ContentFrame):
+    BAUD = 115200
+    BATCH = 32
+
+    class RefreshThread(threading.Thread):
+        def __init__(self, board, ui):
+            threading.Thread.__init__(self)
+            self.ui = ui
+            self.terminated = False
+
+            self.status = "Connecting"
+            self.round_trip = None
+            self.rate = None
+            self.changed = True
+
+            self.board = board
+
+        def terminate(self):
+            self.terminated = True
+
+        def _measure(self, client):
+            start = time.time()
+            client.callSync(PiGoRPC.CMD_PING)
+            self.round_trip = time.time() - start
+
+            start = time.time()
+            with client.batch():
+                futures = [client.call(PiGoRPC.CMD_ECHO, b"PiGo") for i in range(ArduinoFrame.BATCH)]
+            for future in futures:
+                future.result()
+            self.rate = ArduinoFrame.BATCH / (time.time() - start)
+
+        def run(self):
+            self.board.serialOpen(baud=ArduinoFrame.BAUD)
+            client = PiGoRPC.RPCClient(self.board, timeout=0.5)
+            try:
+                while not self.terminated:
+                    try:
+                        self._measure(client)
+                        self.status = "Connected"
+                    except PiGoRPC.RPCError:
+                        self.status = "No response"
+                        self.round_trip = self.rate = None
+                    self.changed = True
+                    time.sleep(0.5)
+            finally:
+                client.close()
+                self.board.serialStopReader()
+
+    def __init__(self, parent, app):
+        ContentFrame.__init__(self, parent, app, "Arduino", module_select=False)
+        PAD = 8
+
+        self.rowconfigure(1, minsize=20)
+        tk.Label(self, text="Status", font=LABEL_FONT).grid(row=2, column=1, padx=20, pady=PAD, sticky="W")
+        tk.Label(self, text="Round trip", font=LABEL_FONT).grid(row=3, column=1, padx=20, pady=PAD, sticky="W")
+        tk.Label(self, text="Pipelined", font=LABEL_FONT).grid(row=4, column=1, padx=20, pady=PAD, sticky="W")
+
+        self.status_text = tk.StringVar()
+        self.round_trip_text = tk.StringVar()
+        self.rate_text = tk.StringVar()
+        for row, text in enumerate([self.status_text, self.round_trip_text, self.rate_text]):
+            tk.Label(self, textvariable=text, font=LABEL_FONT).grid(row=2+row, column=2, padx=20, pady=PAD, sticky="W")
+
+    def update_status(self):
+        if not self.thread:
+            return
+        if self.thread.changed:
+            self.thread.changed = False
+            round_trip, rate = self.thread.round_trip, self.thread.rate
+            self.status_text.set(self.thread.status)
+            self.round_trip_text.set("N/A" if round_trip is None else ("%1.01f ms" % (round_trip*1000)))
+            self.rate_text.set("N/A" if rate is None else ("%d commands/s" % rate))
+        self.after(100, self.update_status)
+
+    def show(self):
+        ContentFrame.show(self)
+        self.update_status()
+
+
 class ExtIOFrame(ContentFrame):
     ELEMENT_WIDTH = 400
 
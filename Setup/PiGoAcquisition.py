@@ -0,0 +1,234 @@
+#       File: PiGoAcquisition.py
+#       Description: Continuous A/D acquisition for PiGo board ADDA modules
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+#  A sampler thread converts the entries of a scan list (PiGoLib.ADDAScanList, one or more channels of
+#  one or more modules) at a fixed rate and stores the samples in a preallocated array('H') ring buffer.
+#  A scan is one sweep of the scan list, scans are stored interleaved (entry order of the scan list).
+#  Every block of blockSize scans gets a timestamp.
+#
+#  Scans are scheduled at start + n / rate. When the sampler falls behind (bus busy, slow
+#  conversions), due scans are taken back to back in one bus transaction, up to blockSize. Scans
+#  more than blockSize behind the schedule are skipped and counted as missed. Scans that do not
+#  fit in the ring buffer because the consumer is too slow are dropped and counted as overruns.
+#  Without a rate limit the sampler waits for the consumer instead.
+#
+#  Usage:
+#    acquisition = adda.startAcquisition([0, 1], rate = 2000.0)
+#    or: acquisition = PiGoLib.ADDAScanList(board, [(addaA, 0), (addaB, 0)]).startAcquisition(2000.0)
+#    for index, samples, timestamps in acquisition:
+#        ...
+#    print(acquisition.report())
+
+import threading
+import time
+from array import array
+
+from PiGoStats import timer
+
+class Acquisition:
+	# Acquisition constructor, the sampler thread is started
+	# Arguments:
+	#   scanList: PiGoLib.ADDAScanList object swept in every scan
+	#   rate: scans per second, None for as fast as possible
+	#   bufferLength: ring buffer size in scans, rounded up to a multiple of blockSize
+	#   blockSize: scans per timestamp, also the maximal number of scans taken in one bus transaction
+	# Returns:
+	#   none
+	def __init__(self, scanList, rate, bufferLength, blockSize):
+		if rate is not None and rate <= 0:
+			raise ValueError("Invalid sample rate: " + str(rate))
+		self.scanList = scanList
+		self.numChannels = len(scanList)
+		self.rate = rate
+		self.blockSize = blockSize
+		self.numBlocks = max(1, (bufferLength + blockSize - 1) // blockSize)
+		self.capacity = self.numBlocks * blockSize
+
+		numChannels = self.numChannels
+		self.samples = array('H', [0]) * (self.capacity * numChannels)
+		# Time of the first scan of every block
+		self.timestamps = array('d', [0.0]) * self.numBlocks
+
+		self.condition = threading.Condition()
+		# Absolute scan indexes: scans stored and scans consumed
+		self.writeIndex = 0
+		self.readIndex = 0
+		self.missed = 0
+		self.overruns = 0
+		self.startTime = None
+		self.stopTime = None
+		self.error = None
+
+		self.running = True
+		self.thread = threading.Thread(target = self.run, name = 'PiGoAcquisition')
+		self.thread.daemon = True
+		self.thread.start()
+
+	def run(self):
+		scanList = self.scanList
+		numChannels = self.numChannels
+		blockSize = self.blockSize
+		scheduled = 0
+
+		self.startTime = timer()
+		try:
+			while self.running:
+				now = timer()
+				if self.rate is None:
+					due = blockSize
+				else:
+					due = int((now - self.startTime) * self.rate) + 1 - scheduled
+					if due <= 0:
+						time.sleep((scheduled / self.rate) - (now - self.startTime))
+						continue
+					if due > blockSize:
+						# Too far behind, restart the schedule
+						self.missed += due - blockSize
+						scheduled += due - blockSize
+						due = blockSize
+
+				# Scans of a burst never cross a block boundary, so the block timestamp is the time of its first scan
+				index = self.writeIndex
+				due = min(due, blockSize - index % blockSize)
+				with self.condition:
+					free = self.capacity - (index - self.readIndex)
+					if self.rate is None:
+						# Not rate limited, wait for the consumer instead of dropping scans
+						if free == 0:
+							self.condition.wait(0.01)
+							continue
+						due = min(due, free)
+				scheduled += due
+				if free < due:
+					self.overruns += due - free
+					due = free
+					if due == 0:
+						# Conversions are skipped, the consumer has to catch up
+						continue
+
+				with scanList.transaction:
+					for n in range(index, index + due):
+						if n % blockSize == 0:
+							self.timestamps[(n // blockSize) % self.numBlocks] = timer()
+						scanList.convert(self.samples, (n % self.capacity) * numChannels)
+
+				with self.condition:
+					self.writeIndex = index + due
+					self.condition.notify_all()
+		except Exception as e:
+			self.error = e
+		finally:
+			with self.condition:
+				self.running = False
+				self.stopTime = timer()
+				self.condition.notify_all()
+
+	# Stop the sampler thread, samples already stored can still be read
+	# Arguments:
+	#   none
+	# Returns:
+	#   none
+	def stop(self):
+		with self.condition:
+			self.running = False
+		if self.thread is not threading.current_thread():
+			self.thread.join()
+
+	# Number of scans available for reading
+	def available(self):
+		with self.condition:
+			return self.writeIndex - self.readIndex
+
+	# Read scans
+	# Arguments:
+	#   numScans: maximal number of scans (default: all available)
+	#   timeout: time in seconds to wait until numScans scans are available, None waits until they are
+	#            available or the acquisition stops, 0 returns immediately (default: None)
+	# Returns:
+	#   (index, samples, timestamps) tuple:
+	#     index: number of the first returned scan since the start of the acquisition
+	#     samples: array('H') of interleaved 10-bit samples, len(scanList) per scan (may be fewer scans than requested)
+	#     timestamps: array of (scan number, time) of the blocks starting within the returned scans,
+	#                 times are PiGoStats.timer() values
+	#   The sampler error is raised when the acquisition stopped with an error and all samples were read
+	def read(self, numScans = None, timeout = None):
+		with self.condition:
+			if numScans is not None and timeout != 0:
+				end = None if timeout is None else timer() + timeout
+				while self.writeIndex - self.readIndex < numScans and self.running:
+					if end is None:
+						self.condition.wait(0.1)
+					else:
+						remaining = end - timer()
+						if remaining <= 0:
+							break
+						self.condition.wait(remaining)
+
+			start = self.readIndex
+			count = self.writeIndex - start
+			if numScans is not None:
+				count = min(count, numScans)
+			if count == 0 and self.error is not None:
+				raise self.error
+
+			numChannels = self.numChannels
+			first = start % self.capacity
+			part = min(count, self.capacity - first)
+			samples = self.samples[first * numChannels:(first + part) * numChannels]
+			if count > part:
+				samples += self.samples[0:(count - part) * numChannels]
+
+			timestamps = []
+			block = (start + self.blockSize - 1) // self.blockSize
+			while block * self.blockSize < start + count:
+				timestamps.append((block * self.blockSize, self.timestamps[block % self.numBlocks]))
+				block += 1
+
+			self.readIndex = start + count
+			return (start, samples, timestamps)
+
+	# Iterate over blocks of blockSize scans (the last one may be shorter) until the acquisition stops
+	def __iter__(self):
+		while True:
+			index, samples, timestamps = self.read(self.blockSize)
+			if len(samples) == 0:
+				return
+			yield (index, samples, timestamps)
+
+	# Acquisition report
+	# Arguments:
+	#   none
+	# Returns:
+	#   dictionary: target_rate (scans/s, None if not limited), achieved_rate (scans/s the sampler kept up with,
+	#   including overruns), scans (stored),
+	#   missed (scans skipped when the sampler fell behind), overruns (scans dropped on full buffer),
+	#   buffered (scans not read yet), running
+	def report(self):
+		with self.condition:
+			end = self.stopTime if self.stopTime is not None else timer()
+			elapsed = end - self.startTime if self.startTime is not None else 0.0
+			scans = self.writeIndex
+			return {
+				'target_rate': self.rate,
+				'achieved_rate': (scans + self.overruns) / elapsed if elapsed > 0 else 0.0,
+				'scans': scans,
+				'missed': self.missed,
+				'overruns': self.overruns,
+				'buffered': scans - self.readIndex,
+				'running': self.running,
+			}
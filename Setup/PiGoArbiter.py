@@ -0,0 +1,149 @@
+#       File: PiGoArbiter.py
+#       Description: Bus arbiter with priority locks for PiGo board
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+#  Every bus has its own lock, so threads using different buses never wait for each other.
+#  A transaction locks one or more buses for a sequence of operations that must not be
+#  interleaved with other threads (e.g. CS assert over I2C, SPI transfer, CS deassert).
+#  Buses of a transaction are always locked in BUS_ORDER, so transactions cannot deadlock.
+#  All buses of a transaction must be requested when it starts: a thread holding only the
+#  SPI bus must not start an I2C operation.
+#
+#  Locks are reentrant. When a lock is released, it is handed over to the waiting thread
+#  with the highest priority (first come, first served among equal priorities), so short
+#  high priority transactions (motor setpoints) are not delayed by queued background
+#  transactions (A/D polling). A running transaction is never interrupted.
+
+import heapq
+import threading
+
+try:
+	from threading import get_ident
+except ImportError:
+	from thread import get_ident
+
+# Transaction priorities
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2
+
+# Buses in locking order
+BUS_ORDER = ('i2c', 'spi', 'gpio')
+
+# Reentrant lock granted by priority
+class PriorityLock:
+	def __init__(self):
+		self.mutex = threading.Lock()
+		self.owner = None
+		self.count = 0
+		self.waiters = []
+		self.sequence = 0
+		self.contentions = 0
+
+	# Acquire the lock
+	# Arguments:
+	#   priority: priority of the waiting thread, higher values are served first
+	# Returns:
+	#   none
+	def acquire(self, priority = PRIORITY_NORMAL):
+		me = get_ident()
+		with self.mutex:
+			if self.owner == me:
+				self.count += 1
+				return
+			if self.owner is None:
+				self.owner = me
+				self.count = 1
+				return
+			# Lock is busy, wait until release() hands it over
+			waiter = threading.Lock()
+			waiter.acquire()
+			heapq.heappush(self.waiters, (-priority, self.sequence, me, waiter))
+			self.sequence += 1
+			self.contentions += 1
+		waiter.acquire()
+
+	# Release the lock
+	# Arguments:
+	#   none
+	# Returns:
+	#   none
+	def release(self):
+		with self.mutex:
+			if self.owner != get_ident():
+				raise RuntimeError("Cannot release un-acquired lock")
+			self.count -= 1
+			if self.count > 0:
+				return
+			if self.waiters:
+				waiter = heapq.heappop(self.waiters)
+				self.owner = waiter[2]
+				self.count = 1
+				waiter[3].release()
+			else:
+				self.owner = None
+
+# Transaction on one or more buses, used as context manager
+# The object holds no per-use state and can be reused by several threads
+class BusTransaction:
+	def __init__(self, locks, priority):
+		self.locks = locks
+		self.priority = priority
+
+	def __enter__(self):
+		for lock in self.locks:
+			lock.acquire(self.priority)
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		for lock in reversed(self.locks):
+			lock.release()
+		return False
+
+# Per-bus locks of a single PiGo board
+class BusArbiter:
+	def __init__(self):
+		self.locks = {}
+		for bus in BUS_ORDER:
+			self.locks[bus] = PriorityLock()
+		self.transactions = {}
+
+	# Get transaction for buses
+	# Arguments:
+	#   buses: bus name ('i2c', 'spi' or 'gpio') or sequence of bus names
+	#   priority: PRIORITY_LOW, PRIORITY_NORMAL (default) or PRIORITY_HIGH
+	# Returns:
+	#   BusTransaction object
+	def transaction(self, buses, priority = PRIORITY_NORMAL):
+		if isinstance(buses, str):
+			buses = (buses,)
+		key = (tuple(buses), priority)
+		transaction = self.transactions.get(key)
+		if transaction is None:
+			for bus in buses:
+				if bus not in self.locks:
+					raise ValueError("Unknown bus: " + str(bus))
+			locks = [self.locks[bus] for bus in BUS_ORDER if bus in buses]
+			transaction = BusTransaction(locks, priority)
+			self.transactions[key] = transaction
+		return transaction
+
+	# Number of times a thread had to wait for each bus
+	# Returns:
+	#   dictionary of per-bus counters
+	def contentions(self):
+		return dict((bus, self.locks[bus].contentions) for bus in BUS_ORDER)
@@ -0,0 +1,369 @@
+#       File: PiGoAsync.py
+#       Description: asyncio front-end for PiGo board
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+#  Dependencies:
+#    Python 3.5 or newer (asyncio)
+#
+#  Every bus has its own worker thread, so blocking I2C syscalls, polled SPI transfers
+#  and serial reads never block the event loop. Operations on the same bus are executed
+#  in the order they were awaited, operations on different buses run concurrently.
+#  The module does not use async/await syntax, so the rest of the library can still be
+#  installed (byte-compiled) with Python 2.
+#
+#  Usage:
+#    board = AsyncPiGoBoard(PiGoBoard(RPi_Rev = 2))
+#    adda = ModuleADDA(board.board, 'A')
+#    value = await board.getAD(adda, 0)
+#    await board.setExtIO(9, 1)
+#    async for chunk in board.serialStream():
+#        ...
+#    async for IONr, level, timestampNs in board.edgeEvents(3, EDGE_BOTH):
+#        ...
+
+import asyncio
+import collections
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import PiGoLib
+import PiGoBoardData
+import PiGoEvents
+
+# Buses with their own worker thread
+# Operations of ADDA modules use the SPI worker, as the whole conversion (CS assert, SPI transfer,
+# CS deassert) must not be interleaved with other SPI transfers
+BUSES = ['i2c', 'spi', 'gpio', 'serial']
+
+# Async iterator over serial port data
+class SerialStream:
+	def __init__(self, asyncBoard, chunkSize):
+		self.asyncBoard = asyncBoard
+		self.chunkSize = chunkSize
+
+	def __aiter__(self):
+		return self
+
+	def __anext__(self):
+		return self.asyncBoard.run('serial', self.readChunk)
+
+	# Read next chunk of data, waits until some data is received (runs on the serial worker)
+	def readChunk(self):
+		board = self.asyncBoard.board
+		while True:
+			if board.serObj is None or not board.serObj.isOpen():
+				raise StopAsyncIteration
+			if board.serialReader is not None:
+				# Take whatever the background reader has received
+				data = board.serialReadAvailable(self.chunkSize, board.serialReader.timeout)
+			else:
+				data = board.serialRead(self.chunkSize)
+			if len(data) > 0:
+				return data
+
+# Async iterator over frames received on the serial port
+class FrameStream:
+	def __init__(self, asyncBoard, timeout):
+		self.asyncBoard = asyncBoard
+		self.timeout = timeout
+		self.frames = collections.deque()
+
+	def __aiter__(self):
+		return self
+
+	def __anext__(self):
+		if self.frames:
+			future = asyncio.get_event_loop().create_future()
+			future.set_result(self.frames.popleft())
+			return future
+		return self.asyncBoard.run('serial', self.readFrame)
+
+	# Read next frame, waits until a complete frame is received (runs on the serial worker)
+	def readFrame(self):
+		board = self.asyncBoard.board
+		while True:
+			if board.serObj is None or not board.serObj.isOpen():
+				raise StopAsyncIteration
+			frames = board.serialReadFrames(self.timeout)
+			if len(frames) > 0:
+				self.frames.extend(frames[1:])
+				return frames[0]
+
+# Async iterator over edges of buffered input
+class EdgeStream:
+	def __init__(self, asyncBoard, IONr, edge, maxsize):
+		self.asyncBoard = asyncBoard
+		self.IONr = IONr
+		self.loop = asyncio.get_event_loop()
+		self.queue = asyncio.Queue(maxsize)
+		asyncBoard.board.onEdge(IONr, edge, self.callback)
+
+	# Edge callback, called from the edge watcher thread
+	def callback(self, IONr, level, timestamp):
+		self.loop.call_soon_threadsafe(self.put, (IONr, level, timestamp))
+
+	def put(self, event):
+		if self.queue.full():
+			# Drop the oldest event
+			self.queue.get_nowait()
+		self.queue.put_nowait(event)
+
+	def close(self):
+		self.asyncBoard.board.removeEdge(self.IONr)
+
+	def __aiter__(self):
+		return self
+
+	def __anext__(self):
+		return self.queue.get()
+
+# asyncio wrapper for PiGoBoard
+class AsyncPiGoBoard:
+	# AsyncPiGoBoard constructor
+	# Arguments:
+	#   board: PiGoBoard object (default: PiGoBoard created with the keyword arguments)
+	#   kwargs: PiGoBoard constructor arguments
+	# Returns:
+	#   none
+	def __init__(self, board = None, **kwargs):
+		if board is None:
+			board = PiGoLib.PiGoBoard(**kwargs)
+		self.board = board
+		self.executors = {}
+		for bus in BUSES:
+			self.executors[bus] = ThreadPoolExecutor(max_workers = 1)
+
+	# Run function on the bus worker thread
+	# Arguments:
+	#   bus: 'i2c', 'spi', 'gpio' or 'serial'
+	#   func: function to be called
+	#   args: function arguments
+	# Returns:
+	#   awaitable future with the function result
+	def run(self, bus, func, *args):
+		loop = asyncio.get_event_loop()
+		return loop.run_in_executor(self.executors[bus], functools.partial(func, *args))
+
+	# Stop the worker threads
+	# Arguments:
+	#   wait: wait for the queued operations to complete (default: True)
+	# Returns:
+	#   none
+	def close(self, wait = True):
+		for executor in self.executors.values():
+			executor.shutdown(wait)
+		self.board.stopEdges()
+
+	# ********************************************
+	# External IO (I2C)
+	# ********************************************
+
+	def setExtIOdir(self, ExtPinNr, PinDir, SetValues = 1):
+		return self.run('i2c', self.board.setExtIOdir, ExtPinNr, PinDir, SetValues)
+
+	def setExtIO(self, ExtPinNr, PinValue, SetValues = 1):
+		return self.run('i2c', self.board.setExtIO, ExtPinNr, PinValue, SetValues)
+
+	def getExtIO(self, ExtPinNr, ReadValues = 1):
+		return self.run('i2c', self.board.getExtIO, ExtPinNr, ReadValues)
+
+	def setExtIOs(self, mask, values, SetValues = 1):
+		return self.run('i2c', self.board.setExtIOs, mask, values, SetValues)
+
+	def getExtIOs(self, ReadValues = 1):
+		return self.run('i2c', self.board.getExtIOs, ReadValues)
+
+	def refreshIstat(self):
+		return self.run('i2c', self.board.refreshIstat)
+
+	def readRegisters(self, addr, reg, numBytes):
+		return self.run('i2c', self.board.readRegisters, addr, reg, numBytes)
+
+	def writeRegisters(self, addr, reg, data):
+		return self.run('i2c', self.board.writeRegisters, addr, reg, data)
+
+	def pollExtEvents(self):
+		return self.run('i2c', self.board.pollExtEvents)
+
+	# ********************************************
+	# Buffered IO and PWM (GPIO)
+	# ********************************************
+
+	def setIOdir(self, IONr, IODir, SetValues = 1):
+		return self.run('i2c', self.board.setIOdir, IONr, IODir, SetValues)
+
+	def setIO(self, IONr, IOvalue):
+		return self.run('gpio', self.board.setIO, IONr, IOvalue)
+
+	def getIO(self, IONr):
+		return self.run('gpio', self.board.getIO, IONr)
+
+	def setIOs(self, mask, values):
+		return self.run('gpio', self.board.setIOs, mask, values)
+
+	def getIOs(self):
+		return self.run('gpio', self.board.getIOs)
+
+	def PWMsetDuty(self, duty):
+		return self.run('gpio', self.board.PWMsetDuty, duty)
+
+	# Wait for edge on buffered input
+	# If the pin is registered already (PiGoBoard.onEdge(), edgeEvents()), the registration is shared and
+	# stays in place, only the edges it detects can be waited for. Otherwise the pin is registered for the
+	# edge until the wait ends.
+	# Arguments:
+	#   IONr: Buffered IO pin (0-7)
+	#   edge: PiGoBoardData.EDGE_RISING, EDGE_FALLING or EDGE_BOTH (default)
+	#   timeout: timeout in seconds, None to wait forever
+	# Returns:
+	#   awaitable (IONr, level, timestampNs) tuple, None on timeout
+	def waitForEdge(self, IONr, edge = PiGoBoardData.EDGE_BOTH, timeout = None):
+		loop = asyncio.get_event_loop()
+		future = loop.create_future()
+		board = self.board
+
+		source = None
+		if board.edgeWatcher is None or not board.edgeWatcher.watching(IONr):
+			board.onEdge(IONr, edge)
+			source = board.edgeWatcher.source(IONr)
+		watcher = board.edgeWatcher
+		handle = None
+
+		def listener(IONr, level, timestamp):
+			if PiGoEvents.edgeMatches(edge, level):
+				loop.call_soon_threadsafe(finish, (IONr, level, timestamp))
+
+		def finish(event):
+			if not future.done():
+				future.set_result(event)
+
+		# Called when the wait ends, also if the future is cancelled
+		def cleanup(future):
+			if handle is not None:
+				handle.cancel()
+			watcher.removeListener(IONr, listener)
+			# Remove the registration made for this wait, unless it was replaced or the watcher stopped
+			if source is not None and board.edgeWatcher is watcher:
+				watcher.remove(IONr, source)
+
+		watcher.addListener(IONr, listener)
+		future.add_done_callback(cleanup)
+		if timeout is not None:
+			handle = loop.call_later(timeout, finish, None)
+		return future
+
+	# Stream of edges on buffered input
+	# Arguments:
+	#   IONr: Buffered IO pin (0-7)
+	#   edge: PiGoBoardData.EDGE_RISING, EDGE_FALLING or EDGE_BOTH (default)
+	#   maxsize: number of queued events, the oldest events are dropped when the queue is full (default: 256)
+	# Returns:
+	#   async iterator of (IONr, level, timestampNs) tuples
+	def edgeEvents(self, IONr, edge = PiGoBoardData.EDGE_BOTH, maxsize = 256):
+		return EdgeStream(self, IONr, edge, maxsize)
+
+	# ********************************************
+	# SPI and modules
+	# ********************************************
+
+	def SPItransfer(self, data):
+		return self.run('spi', self.board.SPItransfer, data)
+
+	def SPItransfer_bytes(self, data):
+		return self.run('spi', self.board.SPItransfer_bytes, data)
+
+	# Read A/D of ADDA module
+	# Arguments:
+	#   module: ModuleADDA object
+	#   channel: A/D channel (0-1)
+	# Returns:
+	#   awaitable 10-bit analog input value
+	def getAD(self, module, channel):
+		return self.run('spi', module.getAD, channel)
+
+	# Set D/A of ADDA module
+	# Arguments:
+	#   module: ModuleADDA object
+	#   channel: D/A channel (0-1)
+	#   value: 10-bit D/A value
+	# Returns:
+	#   awaitable none
+	def setDA(self, module, channel, value):
+		return self.run('spi', module.setDA, channel, value)
+
+	# Set motor power
+	# Arguments:
+	#   module: ModuleMotor object
+	#   power: motor power (-1 to 1)
+	# Returns:
+	#   awaitable none
+	def setOutput(self, module, power):
+		if module.mode == 0:
+			return self.run('i2c', module.setOutput, power)
+		return self.run('gpio', module.setOutput, power)
+
+	# ********************************************
+	# Serial port
+	# ********************************************
+
+	def serialOpen(self, *args, **kwargs):
+		return self.run('serial', functools.partial(self.board.serialOpen, *args, **kwargs))
+
+	def serialClose(self):
+		return self.run('serial', self.board.serialClose)
+
+	def serialWrite(self, data):
+		return self.run('serial', self.board.serialWrite, data)
+
+	def serialRead(self, length):
+		return self.run('serial', self.board.serialRead, length)
+
+	def serialReadAvailable(self, maxBytes = None, timeout = 0):
+		return self.run('serial', self.board.serialReadAvailable, maxBytes, timeout)
+
+	def serialReadUntil(self, delimiter = b'\n', timeout = -1, maxBytes = None):
+		return self.run('serial', self.board.serialReadUntil, delimiter, timeout, maxBytes)
+
+	def serialWriteFrame(self, payload):
+		return self.run('serial', self.board.serialWriteFrame, payload)
+
+	def serialReadFrames(self, timeout = 0):
+		return self.run('serial', self.board.serialReadFrames, timeout)
+
+	# Stream of frames received on the serial port (see PiGoBoard.serialReadFrames())
+	# Arguments:
+	#   timeout: time in seconds to wait for data between checks of the port state (default: 0.1)
+	# Returns:
+	#   async iterator of frame payloads, ends when the serial port is closed
+	def serialFrameStream(self, timeout = 0.1):
+		return FrameStream(self, timeout)
+
+	# Stream of data received on the serial port
+	# Arguments:
+	#   chunkSize: maximal size of the chunks (default: 256)
+	# Returns:
+	#   async iterator of received data chunks, ends when the serial port is closed
+	def serialStream(self, chunkSize = 256):
+		return SerialStream(self, chunkSize)
+
+	# Non-blocking delay
+	# Arguments:
+	#   time_ms: delay in milliseconds
+	# Returns:
+	#   awaitable none
+	def delay(self, time_ms):
+		return asyncio.sleep(time_ms / 1000.0)
@@ -0,0 +1,114 @@
+#       File: PiGoBCM.py
+#       Description: Typed ctypes bindings of libBCM.so for PiGo board
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+#  Prototypes mirror bcm2835.h and bcm2835_add.h (BCMLibrary.zip). They are declared once
+#  when the library is loaded, so return values have their C types instead of int.
+#  Argument types are always declared for functions taking buffers (any ctypes array or
+#  pointer is passed as void *). Checking the integer arguments of the other functions
+#  roughly doubles the ctypes overhead of a call, so it is only enabled on request.
+
+import os
+from ctypes import *
+
+# Default library, can be overridden with PIGO_LIBBCM environment variable
+LIBRARY_NAME = "libBCM.so"
+
+# Function prototypes: (name, restype, argtypes)
+PROTOTYPES = [
+	# bcm2835.h
+	("bcm2835_init", c_int, []),
+	("bcm2835_close", c_int, []),
+	("bcm2835_set_debug", None, [c_uint8]),
+	("bcm2835_gpio_fsel", None, [c_uint8, c_uint8]),
+	("bcm2835_gpio_set", None, [c_uint8]),
+	("bcm2835_gpio_clr", None, [c_uint8]),
+	("bcm2835_gpio_lev", c_uint8, [c_uint8]),
+	("bcm2835_gpio_eds", c_uint8, [c_uint8]),
+	("bcm2835_gpio_set_eds", None, [c_uint8]),
+	("bcm2835_gpio_pud", None, [c_uint8]),
+	("bcm2835_gpio_pudclk", None, [c_uint8, c_uint8]),
+	("bcm2835_gpio_pad", c_uint32, [c_uint8]),
+	("bcm2835_gpio_set_pad", None, [c_uint8, c_uint32]),
+	("bcm2835_delay", None, [c_uint]),
+	("bcm2835_delayMicroseconds", None, [c_uint]),
+	("bcm2835_gpio_write", None, [c_uint8, c_uint8]),
+	("bcm2835_gpio_set_pud", None, [c_uint8, c_uint8]),
+	("bcm2835_spi_begin", None, []),
+	("bcm2835_spi_end", None, []),
+	("bcm2835_spi_setBitOrder", None, [c_uint8]),
+	("bcm2835_spi_setClockDivider", None, [c_uint16]),
+	("bcm2835_spi_setDataMode", None, [c_uint8]),
+	("bcm2835_spi_chipSelect", None, [c_uint8]),
+	("bcm2835_spi_setChipSelectPolarity", None, [c_uint8, c_uint8]),
+	("bcm2835_spi_transfer", c_uint8, [c_uint8]),
+	("bcm2835_spi_transfernb", None, [c_void_p, c_void_p, c_uint32]),
+	("bcm2835_spi_transfern", None, [c_void_p, c_uint32]),
+	# bcm2835_add.h
+	("bcm2835_add_init", c_int, [c_int]),
+	("bcm2835_add_close", c_int, []),
+	("bcm2835_spi_transfernFIFO", None, [c_void_p, c_uint32]),
+	("bcm2835_spi_transfernFIFO_part", None, [c_void_p, c_uint32, c_uint8, c_uint8]),
+	("bcm2835_pwm_init", None, [c_uint32, c_uint16]),
+	("bcm2835_pwm0_setRange", None, [c_uint32]),
+	("bcm2835_pwm0_setData", None, [c_uint32]),
+	("bcm2835_pwm_getStatus", c_uint32, []),
+	("bcm2835_gpio_set_multi", None, [c_uint32]),
+	("bcm2835_gpio_clr_multi", None, [c_uint32]),
+	("bcm2835_gpio_lev_multi", c_uint32, []),
+	("bcm2835_i2c_setAddr", c_uint32, [c_uint8]),
+	("bcm2835_i2c_write", c_uint32, [c_void_p, c_uint8]),
+	("bcm2835_i2c_read", c_uint32, [c_void_p, c_uint8]),
+]
+
+# Library path
+# Arguments:
+#   path: library path or name, None for PIGO_LIBBCM environment variable or LIBRARY_NAME
+# Returns:
+#   library path or name
+def libraryPath(path = None):
+	if path is None:
+		path = os.environ.get("PIGO_LIBBCM", LIBRARY_NAME)
+	return path
+
+# Declare prototypes of library functions
+# Functions missing in the library (e.g. GPIO bank functions in older builds) are skipped
+# Arguments:
+#   lib: ctypes library object
+#   checkArgs: declare the argument types of all functions, not only of functions taking buffers (default: False)
+# Returns:
+#   lib
+def declare(lib, checkArgs = False):
+	for name, restype, argtypes in PROTOTYPES:
+		try:
+			func = getattr(lib, name)
+		except AttributeError:
+			continue
+		func.restype = restype
+		if checkArgs or c_void_p in argtypes:
+			func.argtypes = argtypes
+	return lib
+
+# Load libBCM.so and declare its prototypes
+# Arguments:
+#   path: library path or name (default: see libraryPath())
+#   checkArgs: see declare()
+# Returns:
+#   ctypes library object
+# Raises OSError if the library cannot be loaded
+def load(path = None, checkArgs = False):
+	return declare(CDLL(libraryPath(path)), checkArgs)
@@ -0,0 +1,285 @@
+#       File: PiGoBench.py
+#       Description: Microbenchmarks for the PiGo board IO hot paths
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+#  Every benchmark calls one high-level PiGoLib function repeatedly and reports
+#  calls per second, p50/p99 latency and bus transactions, syscalls and bytes per call
+#  (counted by the board bus statistics, see PiGoBoard.stats()).
+#
+#  Usage:
+#    python PiGoBench.py                                   # simulated backend, no bus latency
+#    python PiGoBench.py --latency i2c=0.0002,spi=0.00002  # simulated backend with bus latencies
+#    python PiGoBench.py --hardware --rev 2                # real PiGo board
+#    python PiGoBench.py --hardware --rev 2 --direct-io    # real PiGo board, memory-mapped GPIO and PWM
+#    python PiGoBench.py --hardware --library ./libBCM.so  # real PiGo board, libBCM.so from the given path
+#    python PiGoBench.py --output new.json --compare old.json
+
+import argparse
+import ctypes
+import json
+import platform
+import sys
+import time
+import timeit
+
+import PiGoBCM
+import PiGoFraming
+import PiGoLib
+import PiGoRPC
+import PiGoSim
+
+# Bus transactions, syscalls and bytes from the board statistics
+# I2C transactions, I2C address switches and serial accesses are kernel calls,
+# SPI, GPIO and PWM registers are memory mapped
+# Arguments:
+#   stats: statistics (see PiGoBoard.stats())
+# Returns:
+#   (transactions, syscalls, bytes) tuple, transactions and bytes are per-bus dictionaries
+def busCounters(stats):
+	transactions = {
+		'i2c': stats['i2c']['transactions'],
+		'spi': stats['spi']['transfers'],
+		'gpio': stats['gpio']['reads'] + stats['gpio']['writes'],
+		'pwm': stats['pwm']['writes'],
+		'serial': stats['serial']['latency']['count'],
+	}
+	syscalls = stats['i2c']['transactions'] + stats['i2c']['address_switches'] + stats['serial']['latency']['count']
+	numBytes = {
+		'i2c': stats['i2c']['bytes_written'] + stats['i2c']['bytes_read'],
+		'spi': stats['spi']['bytes'],
+		'serial': stats['serial']['bytes_out'] + stats['serial']['bytes_in'],
+	}
+	return (transactions, syscalls, numBytes)
+
+# Percentile of sorted samples
+def percentile(samples, p):
+	if len(samples) == 0:
+		return 0.0
+	index = int(round(p / 100.0 * (len(samples) - 1)))
+	return samples[index]
+
+# Run a single benchmark
+# Arguments:
+#   board: PiGoBoard object
+#   func: function to be benchmarked, called with the call index
+#   calls: number of calls
+# Returns:
+#   dictionary with the results
+def runBenchmark(board, func, calls):
+	timer = timeit.default_timer
+
+	# Warm up
+	for i in range(0, min(calls, 100)):
+		func(i)
+
+	durations = [0.0] * calls
+	statsStart = board.stats()
+	start = timer()
+	for i in range(0, calls):
+		t = timer()
+		func(i)
+		durations[i] = timer() - t
+	total = timer() - start
+	transactions, syscalls, numBytes = busCounters(board.statsDelta(statsStart))
+
+	durations.sort()
+	result = {
+		'calls': calls,
+		'total_s': total,
+		'calls_per_s': calls / total if total > 0 else 0.0,
+		'p50_us': percentile(durations, 50) * 1e6,
+		'p99_us': percentile(durations, 99) * 1e6,
+	}
+
+	result['transactions_per_call'] = dict((bus, transactions[bus] / float(calls)) for bus in transactions)
+	result['bytes_per_call'] = dict((bus, numBytes[bus] / float(calls)) for bus in numBytes)
+	result['syscalls_per_call'] = syscalls / float(calls)
+
+	return result
+
+# Build the list of benchmarks
+# Arguments:
+#   board: PiGoBoard object
+#   libraryPath: path of libBCM.so loaded by the board, None on the simulator
+#   rpcClient: PiGoRPC.RPCClient connected to a peer on the serial port (default: no RPC benchmarks)
+# Returns:
+#   array of (name, function) tuples
+def benchmarks(board, libraryPath = None, rpcClient = None):
+	adda = PiGoLib.ModuleADDA(board, 'A')
+	addaB = PiGoLib.ModuleADDA(board, 'B')
+	scanList = PiGoLib.ADDAScanList(board, [(adda, 0), (adda, 1), (addaB, 0), (addaB, 1)])
+	motorDigital = PiGoLib.ModuleMotor(board, 'C', 0)
+	motorPWM = PiGoLib.ModuleMotor(board, 'D', 1)
+	board.setExtIOdir(15, 1)
+	board.setIOdir(2, 0)
+	board.setIOdir(3, 1)
+	bulk = bytearray(4096)
+	payload = bytes(bytearray(range(64)))
+	frames = PiGoFraming.encodeFrame(payload) * 16
+	decoder = PiGoFraming.FrameDecoder()
+
+	tests = [
+		('setExtIO', lambda i: board.setExtIO(9, i & 1)),
+		('getExtIO', lambda i: board.getExtIO(15)),
+		('setExtIOs', lambda i: board.setExtIOs(0xFF00, i << 8)),
+		('getExtIOs', lambda i: board.getExtIOs()),
+		('setIO', lambda i: board.setIO(2, i & 1)),
+		('getIO', lambda i: board.getIO(3)),
+		('setIOs', lambda i: board.setIOs(0x0C, i << 2)),
+		('getIOs', lambda i: board.getIOs()),
+		('SPItransfer_2B', lambda i: board.SPItransfer([0x68, 0x00])),
+		('SPItransfer_bytes_4kB', lambda i: board.SPItransfer_bytes(bulk)),
+		('SPItransfer_into_4kB', lambda i: board.SPItransfer_into(bulk)),
+		('SPIwriteStream_4kB', lambda i: board.SPIwriteStream(bulk, 1024)),
+		('ModuleADDA.getAD', lambda i: adda.getAD(i & 1)),
+		('ModuleADDA.setDA', lambda i: adda.setDA(i & 1, i & 0x3FF)),
+		('ModuleADDA.getAD_4ch', lambda i: [adda.getAD(0), adda.getAD(1), addaB.getAD(0), addaB.getAD(1)]),
+		('ADDAScanList.sweep_4ch', lambda i: scanList.sweep()),
+		('ModuleMotor.setOutput_digital', lambda i: motorDigital.setOutput((i % 3) - 1)),
+		('ModuleMotor.setOutput_PWM', lambda i: motorPWM.setOutput(((i % 200) - 100) / 100.0)),
+		('encodeFrame_64B', lambda i: PiGoFraming.encodeFrame(payload)),
+		('FrameDecoder.feed_16x64B', lambda i: decoder.feed(frames)),
+	]
+
+	if libraryPath is not None:
+		# Per-call overhead of libBCM.so calls: function looked up on an untyped library handle
+		# (arguments and result converted by guessing) vs. typed function pointer bound by the board
+		untyped = ctypes.CDLL(PiGoBCM.libraryPath(libraryPath))
+		pin = board.IOpins[3]
+		tests += [
+			('libBCM.gpio_lev_untyped', lambda i: untyped.bcm2835_gpio_lev(pin)),
+			('libBCM.gpio_lev_bound', lambda i: board.BCMgpioLev(pin)),
+			('libBCM.spi_transfern_untyped_2B', lambda i: untyped.bcm2835_spi_transfern((ctypes.c_ubyte * 2).from_buffer(board.SPIbuffer), 2)),
+			('libBCM.spi_transfern_bound_2B', lambda i: board.BCMspiTransfern(board.SPIbufferC, 2)),
+		]
+
+	if rpcClient is not None:
+		# Strict request-reply vs. 16 requests in flight, sent in one frame
+		def pipelined(i):
+			with rpcClient.batch():
+				futures = [rpcClient.call(PiGoRPC.CMD_PING) for j in range(0, 16)]
+			for future in futures:
+				future.result()
+		tests += [
+			('RPC.callSync_ping', lambda i: rpcClient.callSync(PiGoRPC.CMD_PING)),
+			('RPC.pipelined_16x_ping', pipelined),
+		]
+
+	return tests
+
+# Parse latency option ("i2c=0.0002,spi=0.00002")
+def parseLatency(text):
+	latency = {}
+	if text:
+		for item in text.split(','):
+			bus, value = item.split('=')
+			latency[bus.strip()] = float(value)
+	return latency
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(description = 'PiGo board IO microbenchmarks')
+	parser.add_argument('--hardware', action = 'store_true', help = 'run on the real PiGo board instead of the simulator')
+	parser.add_argument('--rev', type = int, default = 1, help = 'Raspberry Pi board revision (default: 1)')
+	parser.add_argument('--calls', type = int, default = 2000, help = 'calls per benchmark (default: 2000)')
+	parser.add_argument('--latency', default = '', help = 'simulated per-transaction bus latency in seconds, e.g. i2c=0.0002,spi=0.00002')
+	parser.add_argument('--direct-io', nargs = '?', const = '', default = None, metavar = 'FILE',
+		help = 'access GPIO and PWM registers through a memory mapping (hardware: /dev/gpiomem and /dev/mem, '
+		'simulator: FILE, GPIO block at offset 0 and PWM block at offset 4096)')
+	parser.add_argument('--library', default = None, metavar = 'PATH',
+		help = 'libBCM.so used on the real PiGo board (default: PIGO_LIBBCM environment variable or libBCM.so)')
+	parser.add_argument('--filter', default = '', help = 'run only benchmarks containing this text')
+	parser.add_argument('--output', default = '', help = 'save results to JSON file')
+	parser.add_argument('--compare', default = '', help = 'compare calls/s with results from JSON file')
+	args = parser.parse_args(argv)
+
+	latency = parseLatency(args.latency)
+	rpcClient = None
+	if args.hardware:
+		board = PiGoLib.PiGoBoard(RPi_Rev = args.rev, LibraryPath = args.library)
+		backendName = 'hardware'
+	else:
+		sim = PiGoSim.SimBackend(latency = latency)
+		board = PiGoLib.PiGoBoard(RPi_Rev = args.rev, Backend = sim)
+		backendName = 'simulator'
+		if not args.filter or 'RPC' in args.filter:
+			# Simulated coprocessor on the serial port
+			sim.connectSerial(PiGoRPC.RPCPeer())
+			board.serialOpen()
+			rpcClient = PiGoRPC.RPCClient(board)
+
+	if args.direct_io is not None:
+		if args.hardware:
+			mapped = board.enableDirectIO()
+		elif args.direct_io:
+			mapped = board.enableDirectIO(args.direct_io, args.direct_io, 0, 4096)
+		else:
+			parser.error('--direct-io needs a FILE to map on the simulator')
+		if not mapped:
+			parser.error('cannot map GPIO registers')
+		backendName += ' (direct IO)'
+
+	previous = {}
+	if args.compare:
+		with open(args.compare) as f:
+			previous = json.load(f)['results']
+
+	tests = benchmarks(board, PiGoBCM.libraryPath(args.library) if args.hardware else None, rpcClient)
+
+	# Subsystems are started by the benchmark setup
+	startup = board.startupReport()
+	print('Startup: ' + ', '.join(['%s %.2f ms' % (phase, startup[phase] * 1e3) for phase in startup]))
+
+	results = {}
+	for name, func in tests:
+		if args.filter and args.filter not in name:
+			continue
+		result = runBenchmark(board, func, args.calls)
+		results[name] = result
+
+		line = '%-32s %12.0f calls/s   p50 %9.1f us   p99 %9.1f us' % (name, result['calls_per_s'], result['p50_us'], result['p99_us'])
+		transactions = result['transactions_per_call']
+		line += '   i2c %4.1f  spi %4.1f  syscalls %4.1f  bytes %7.1f' % (transactions['i2c'], transactions['spi'],
+			result['syscalls_per_call'], sum(result['bytes_per_call'].values()))
+		if name in previous and previous[name]['calls_per_s'] > 0:
+			line += '   x%.2f' % (result['calls_per_s'] / previous[name]['calls_per_s'])
+		print(line)
+
+	if 'ModuleADDA.getAD' in results:
+		print('ADDA module A/D throughput: %.0f samples/s' % results['ModuleADDA.getAD']['calls_per_s'])
+
+	if rpcClient is not None:
+		rpcClient.close()
+		board.serialClose()
+
+	if args.output:
+		report = {
+			'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+			'python': platform.python_version(),
+			'machine': platform.machine(),
+			'backend': backendName,
+			'latency': latency,
+			'calls': args.calls,
+			'results': results,
+			'startup_s': startup,
+		}
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent = 2, sort_keys = True)
+
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
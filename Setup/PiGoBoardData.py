@@ -133,4 +133,94 @@ BCM2835_SPI_CLOCK_DIVIDER_8     = 8       # 8 = 32ns = 31.25MHz
 BCM2835_SPI_CLOCK_DIVIDER_4     = 4       # 4 = 16ns = 62.5MHz
 BCM2835_SPI_CLOCK_DIVIDER_2     = 2       # 2 = 8ns = 125MHz fastest you can get
 BCM2835_SPI_CLOCK_DIVIDER_1     = 1       # 0 = 262.144us = 3.814697260kHz same as 0/65536
-  
\ No newline at end of file
+
+# Core clock the SPI clock is divided from (Hz), highest core_freq of the SoC with default firmware settings
+BCM2835_CORE_CLOCK = 250000000 # Raspberry Pi 1, 2 and Zero
+BCM2837_CORE_CLOCK = 400000000 # Raspberry Pi 3 and Zero 2
+BCM2711_CORE_CLOCK = 500000000 # Raspberry Pi 4
+# Core clock assumed when the SoC cannot be determined (the highest one, so converter clocks stay within limits)
+CORE_CLOCK_DEFAULT = BCM2711_CORE_CLOCK
+
+# Maximal SPI clock of the ADDA module converters (Hz), from the datasheets
+MCP3002_MAX_CLOCK = 1200000  # At VDD = 2.7 V (3.2 MHz at 5 V)
+MCP4802_MAX_CLOCK = 20000000
+# Run converters at the maximal clock of their datasheet (see PiGoLib.ModuleADDA)
+SPI_CLOCK_MAX = 'max'
+  
+# MCP23017 IO expanders on PiGo board
+# Expander at 0x20 holds ports 0 (A) and 1 (B), expander at 0x24 holds ports 2 (A) and 3 (B)
+PIGO_EXPANDER_ADDR = [0x20, 0x24]
+
+# MCP23017 register addresses (IOCON.BANK = 0, registers of port A and B are paired)
+# With IOCON.SEQOP = 0 (default) the address pointer increments after each byte,
+# so a register pair can be written or read in a single sequential transfer
+MCP23017_IODIRA   = 0x00 # IO direction A
+MCP23017_IODIRB   = 0x01 # IO direction B
+MCP23017_IPOLA    = 0x02 # Input polarity A
+MCP23017_IPOLB    = 0x03 # Input polarity B
+MCP23017_GPINTENA = 0x04 # Interrupt-on-change enable A
+MCP23017_GPINTENB = 0x05 # Interrupt-on-change enable B
+MCP23017_DEFVALA  = 0x06 # Default compare value A
+MCP23017_DEFVALB  = 0x07 # Default compare value B
+MCP23017_INTCONA  = 0x08 # Interrupt control A
+MCP23017_INTCONB  = 0x09 # Interrupt control B
+MCP23017_IOCON    = 0x0A # Configuration
+MCP23017_GPPUA    = 0x0C # Pull-up resistors A
+MCP23017_GPPUB    = 0x0D # Pull-up resistors B
+MCP23017_INTFA    = 0x0E # Interrupt flags A
+MCP23017_INTFB    = 0x0F # Interrupt flags B
+MCP23017_INTCAPA  = 0x10 # Interrupt captured value A
+MCP23017_INTCAPB  = 0x11 # Interrupt captured value B
+MCP23017_GPIOA    = 0x12 # Port A
+MCP23017_GPIOB    = 0x13 # Port B
+MCP23017_OLATA    = 0x14 # Output latch A
+MCP23017_OLATB    = 0x15 # Output latch B
+
+# Linux i2c-dev ioctl requests (linux/i2c-dev.h)
+I2C_SLAVE = 0x0703 # Change slave address
+I2C_RDWR  = 0x0707 # Combined read/write transfer (one STOP only)
+I2C_M_RD  = 0x0001 # Read message flag (struct i2c_msg)
+
+# GPIO edge detection (values match the sysfs GPIO "edge" attribute)
+EDGE_RISING  = 'rising'  # Low to high transition
+EDGE_FALLING = 'falling' # High to low transition
+EDGE_BOTH    = 'both'    # Any transition
+
+# MCP23017 IOCON register bits
+MCP23017_IOCON_BANK   = 0x80 # Registers of each port in separate banks
+MCP23017_IOCON_MIRROR = 0x40 # INTA and INTB pins are internally connected
+MCP23017_IOCON_SEQOP  = 0x20 # Sequential operation disabled
+MCP23017_IOCON_DISSLW = 0x10 # Slew rate control disabled
+MCP23017_IOCON_ODR    = 0x04 # INT pins are open-drain outputs
+MCP23017_IOCON_INTPOL = 0x02 # INT pins are active-high
+
+# BCM2835 peripheral register blocks (physical addresses of Raspberry Pi 1, see PiGoMmap.peripheralBase)
+BCM2835_PERI_BASE   = 0x20000000
+BCM2835_GPIO_OFFSET = 0x200000 # GPIO block offset from the peripheral base
+BCM2835_PWM_OFFSET  = 0x20C000 # PWM block offset from the peripheral base
+BCM2835_BLOCK_SIZE  = 4096
+
+# GPIO register word offsets (byte offset / 4)
+BCM2835_GPFSEL0_WORD = 0  # 0x00
+BCM2835_GPSET0_WORD  = 7  # 0x1C
+BCM2835_GPCLR0_WORD  = 10 # 0x28
+BCM2835_GPLEV0_WORD  = 13 # 0x34
+
+# PWM register word offsets
+BCM2835_PWM_CONTROL_WORD = 0
+BCM2835_PWM0_RANGE_WORD  = 4
+BCM2835_PWM0_DATA_WORD   = 5
+
+# Expander start modes (see PiGoBoard WarmStart argument)
+START_COLD     = 0 # Write all IODIR and OLAT registers (all pins inputs, outputs low)
+START_READBACK = 1 # Read IODIR and OLAT back from the expanders, write only registers that differ
+START_SNAPSHOT = 2 # Trust the shadow snapshot (see PiGoBoard.saveShadow), no expander access
+
+# Serial port frame encodings (see PiGoFraming)
+FRAMING_COBS = 'cobs' # Consistent overhead byte stuffing, frames end with 0x00
+FRAMING_SLIP = 'slip' # RFC 1055 SLIP, frames end with 0xC0
+
+# SPI chip-select strategies of modules (see PiGoLib.ModuleADDA)
+CS_EXPANDER = 'expander' # External IO pin of the expanders, asserted with an I2C write
+CS_NATIVE = 'native'     # SPI block chip select CE0 or CE1, asserted by the hardware during transfers
+CS_GPIO = 'gpio'         # Buffered IO pin, asserted with a GPIO register write
@@ -0,0 +1,118 @@
+#       File: PiGoCheck.py
+#       Description: Behaviour checks of the PiGo board library on the simulated backend
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+#  Every check builds a PiGoBoard on a fresh PiGoSim.SimBackend and compares the shadow registers
+#  and the simulated expander registers with the expected values.
+#
+#  Usage:
+#    python PiGoCheck.py                 # run all checks
+#    python PiGoCheck.py --filter warm   # run only checks containing this text
+
+from __future__ import print_function
+
+import argparse
+import sys
+
+import PiGoBoardData
+import PiGoLib
+import PiGoSim
+
+# Start modes of the warm start checks
+WARM_START_MODES = [('cold', PiGoBoardData.START_COLD), ('readback', PiGoBoardData.START_READBACK)]
+
+# Simulated expander register
+# Arguments:
+#   sim: PiGoSim.SimBackend
+#   port: expander port (0-3)
+#   reg: port A register address (e.g. PiGoBoardData.MCP23017_OLATA)
+# Returns:
+#   register value
+def expanderRegister(sim, port, reg):
+	expander = sim.i2cDevices[PiGoBoardData.PIGO_EXPANDER_ADDR[port // 2]]
+	return expander.registers[reg + port % 2]
+
+# Buffered IO direction is written to the expander on the first setIOdir call
+def checkSetIOdir(mode):
+	sim = PiGoSim.SimBackend()
+	board = PiGoLib.PiGoBoard(Backend = sim, WarmStart = mode)
+	board.setIOdir(2, 1)
+	return [
+		('portStat[0]', board.portStat[0], 0x04),
+		('portDir[0]', board.portDir[0], 0xFB),
+		('OLATA', expanderRegister(sim, 0, PiGoBoardData.MCP23017_OLATA), 0x04),
+		('IODIRA', expanderRegister(sim, 0, PiGoBoardData.MCP23017_IODIRA), 0xFB),
+	]
+
+# Buffered IO direction set inside a batch is written at the end of the batch
+def checkSetIOdirBatch(mode):
+	sim = PiGoSim.SimBackend()
+	board = PiGoLib.PiGoBoard(Backend = sim, WarmStart = mode)
+	with board.batch():
+		board.setIOdir(2, 1)
+		board.setIOdir(3, 0)
+	return [
+		('portStat[0]', board.portStat[0], 0x04),
+		('portDir[0]', board.portDir[0], 0xF3),
+		('OLATA', expanderRegister(sim, 0, PiGoBoardData.MCP23017_OLATA), 0x04),
+		('IODIRA', expanderRegister(sim, 0, PiGoBoardData.MCP23017_IODIRA), 0xF3),
+	]
+
+# Motor module turns the buffers of its pins to outputs
+def checkModuleMotor(mode):
+	sim = PiGoSim.SimBackend()
+	board = PiGoLib.PiGoBoard(Backend = sim, WarmStart = mode)
+	PiGoLib.ModuleMotor(board, 'A', 1)
+	return [
+		('portDir[0]', board.portDir[0], 0xFC),
+		('IODIRA', expanderRegister(sim, 0, PiGoBoardData.MCP23017_IODIRA), 0xFC),
+	]
+
+# List of checks
+# Returns:
+#   list of (name, function) tuples, function returns a list of (value name, value, expected value) tuples
+def checks():
+	result = []
+	for modeName, mode in WARM_START_MODES:
+		result.append(('setIOdir ' + modeName, (lambda mode: lambda: checkSetIOdir(mode))(mode)))
+		result.append(('setIOdir batch ' + modeName, (lambda mode: lambda: checkSetIOdirBatch(mode))(mode)))
+		result.append(('ModuleMotor ' + modeName, (lambda mode: lambda: checkModuleMotor(mode))(mode)))
+	return result
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(description = 'PiGo board library checks on the simulator')
+	parser.add_argument('--filter', default = '', help = 'run only checks containing this text')
+	args = parser.parse_args(argv)
+
+	failed = 0
+	for name, func in checks():
+		if args.filter not in name:
+			continue
+		errors = []
+		for valueName, value, expected in func():
+			if value != expected:
+				errors.append(valueName + ' = ' + hex(value) + ', expected ' + hex(expected))
+		if errors:
+			failed += 1
+			print('FAIL ' + name + ': ' + '; '.join(errors))
+		else:
+			print('ok   ' + name)
+
+	return 1 if failed else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,266 @@
+#       File: PiGoEvents.py
+#       Description: Edge detection on Raspberry Pi GPIO inputs for PiGo board
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+#  Edges are detected by the kernel (sysfs GPIO interface) and waited for with poll(),
+#  so no CPU time is spent while the inputs are idle. A single watcher thread serves
+#  all pins of the board and calls the registered callbacks with the pin level and
+#  a monotonic timestamp in nanoseconds.
+
+import collections
+import os
+import select
+import threading
+import time
+import traceback
+
+import PiGoBoardData
+
+# Monotonic timestamp in nanoseconds
+# Falls back to wall clock time on Python versions without monotonic clock
+def monotonicNs():
+	if hasattr(time, 'monotonic_ns'):
+		return time.monotonic_ns()
+	if hasattr(time, 'monotonic'):
+		return int(time.monotonic() * 1000000000)
+	return int(time.time() * 1000000000)
+
+# Check if pin level after the event matches the requested edge
+def edgeMatches(edge, level):
+	if edge == PiGoBoardData.EDGE_RISING:
+		return level == 1
+	if edge == PiGoBoardData.EDGE_FALLING:
+		return level == 0
+	return True
+
+# Edge source using sysfs GPIO interface (/sys/class/gpio)
+class SysfsEdgeSource:
+	# SysfsEdgeSource constructor
+	# Arguments:
+	#   pin: Raspberry Pi GPIO number
+	#   edge: PiGoBoardData.EDGE_RISING, EDGE_FALLING or EDGE_BOTH
+	#   path: sysfs GPIO directory (default: /sys/class/gpio)
+	# Returns:
+	#   none
+	def __init__(self, pin, edge, path = '/sys/class/gpio'):
+		self.pin = pin
+		self.path = path
+		self.pinPath = os.path.join(path, 'gpio' + str(pin))
+		self.pollEvents = select.POLLPRI | select.POLLERR
+
+		self.exported = False
+		if not os.path.exists(self.pinPath):
+			self.writeFile(os.path.join(path, 'export'), str(pin))
+			self.exported = True
+
+		self.writeFile(os.path.join(self.pinPath, 'edge'), edge)
+		self.fd = os.open(os.path.join(self.pinPath, 'value'), os.O_RDONLY | os.O_NONBLOCK)
+		# Clear the pending event
+		self.read()
+
+	def writeFile(self, fileName, value):
+		f = open(fileName, 'w')
+		try:
+			f.write(value)
+		finally:
+			f.close()
+
+	def fileno(self):
+		return self.fd
+
+	# Read the pin level
+	# Returns:
+	#   pin level (0 or 1)
+	def read(self):
+		os.lseek(self.fd, 0, os.SEEK_SET)
+		value = os.read(self.fd, 2)
+		return int(value[0:1] == b'1')
+
+	def close(self):
+		if self.fd is None:
+			return
+		os.close(self.fd)
+		self.fd = None
+		try:
+			self.writeFile(os.path.join(self.pinPath, 'edge'), 'none')
+			if self.exported:
+				self.writeFile(os.path.join(self.path, 'unexport'), str(self.pin))
+		except (IOError, OSError):
+			pass
+
+# Edge watcher thread
+class EdgeWatcher:
+	# EdgeWatcher constructor
+	# Arguments:
+	#   history: number of events kept for waitForEdge (default: 256)
+	# Returns:
+	#   none
+	def __init__(self, history = 256):
+		self.sources = {}
+		# Functions called for every event of a key besides its callback: key -> array of functions
+		self.listeners = {}
+		self.condition = threading.Condition()
+		self.events = collections.deque(maxlen = history)
+		self.eventCount = 0
+
+		# Pipe used to wake the thread when the set of sources changes
+		self.wakeRead, self.wakeWrite = os.pipe()
+		self.poller = select.poll()
+		self.poller.register(self.wakeRead, select.POLLIN)
+
+		self.running = True
+		self.thread = threading.Thread(target = self.run, name = 'PiGoEdgeWatcher')
+		self.thread.daemon = True
+		self.thread.start()
+
+	# Add edge source
+	# Arguments:
+	#   key: value reported with the events (e.g. buffered IO number)
+	#   source: edge source object (fileno(), read(), close() and pollEvents), signalling only the edges
+	#           requested from it (like the sysfs edge attribute)
+	#   edge: PiGoBoardData.EDGE_RISING, EDGE_FALLING or EDGE_BOTH
+	#   callback: function called as callback(key, level, timestampNs) from the watcher thread, or None
+	#             Exceptions raised by the callback are printed, the watcher keeps running
+	#   record: if False, the events are not kept for wait() (default: True)
+	# Returns:
+	#   none
+	def add(self, key, source, edge, callback, record = True):
+		self.remove(key)
+		with self.condition:
+			self.sources[source.fileno()] = (key, source, edge, callback, record)
+			self.poller.register(source.fileno(), source.pollEvents)
+		self.wake()
+
+	# Remove edge source
+	# Arguments:
+	#   key: key of the source
+	#   source: remove the source only if it is still registered for the key (default: None, any source)
+	# Returns:
+	#   none
+	def remove(self, key, source = None):
+		with self.condition:
+			for fd, entry in list(self.sources.items()):
+				if entry[0] == key and (source is None or entry[1] is source):
+					self.poller.unregister(fd)
+					del self.sources[fd]
+					entry[1].close()
+		self.wake()
+
+	# Check if a source is registered for the key
+	def watching(self, key):
+		return self.source(key) is not None
+
+	# Get the source registered for the key, None if there is none
+	def source(self, key):
+		with self.condition:
+			for entry in self.sources.values():
+				if entry[0] == key:
+					return entry[1]
+		return None
+
+	# Add listener for the events of a key
+	# Listeners stay registered when the source of the key is replaced or removed
+	# Arguments:
+	#   key: key of the source
+	#   listener: function called as listener(key, level, timestampNs) from the watcher thread
+	# Returns:
+	#   none
+	def addListener(self, key, listener):
+		with self.condition:
+			self.listeners.setdefault(key, []).append(listener)
+
+	# Remove listener added with addListener()
+	def removeListener(self, key, listener):
+		with self.condition:
+			listeners = self.listeners.get(key, [])
+			if listener in listeners:
+				listeners.remove(listener)
+			if not listeners:
+				self.listeners.pop(key, None)
+
+	def wake(self):
+		os.write(self.wakeWrite, b'x')
+
+	# Stop the watcher thread and close all sources
+	def stop(self):
+		self.running = False
+		self.wake()
+		self.thread.join()
+		with self.condition:
+			for fd, entry in self.sources.items():
+				entry[1].close()
+			self.sources = {}
+		os.close(self.wakeRead)
+		os.close(self.wakeWrite)
+
+	def run(self):
+		while self.running:
+			for fd, mask in self.poller.poll():
+				if fd == self.wakeRead:
+					os.read(self.wakeRead, 64)
+					continue
+				timestamp = monotonicNs()
+
+				with self.condition:
+					entry = self.sources.get(fd)
+					if entry is None:
+						continue
+					key, source, edge, callback, record = entry
+					# Reading clears the event. The level may have changed again since a short pulse,
+					# the level after a single edge is known
+					level = source.read()
+					if edge == PiGoBoardData.EDGE_RISING:
+						level = 1
+					elif edge == PiGoBoardData.EDGE_FALLING:
+						level = 0
+					if record:
+						self.eventCount += 1
+						self.events.append((self.eventCount, (key, level, timestamp)))
+						self.condition.notify_all()
+					functions = list(self.listeners.get(key, []))
+
+				if callback is not None:
+					functions.insert(0, callback)
+				for function in functions:
+					try:
+						function(key, level, timestamp)
+					except Exception:
+						traceback.print_exc()
+
+	# Wait for the next edge
+	# Arguments:
+	#   timeout: timeout in seconds, None to wait forever
+	#   key: wait for the edge of this source only (default: any source)
+	# Returns:
+	#   (key, level, timestampNs) tuple, None on timeout
+	def wait(self, timeout = None, key = None):
+		if timeout is not None:
+			deadline = time.time() + timeout
+		with self.condition:
+			seen = self.eventCount
+			while True:
+				for count, event in self.events:
+					if count > seen and (key is None or event[0] == key):
+						return event
+				seen = self.eventCount
+				if timeout is None:
+					self.condition.wait()
+				else:
+					remaining = deadline - time.time()
+					if remaining <= 0:
+						return None
+					self.condition.wait(remaining)
@@ -0,0 +1,243 @@
+#       File: PiGoFraming.py
+#       Description: Framed binary protocol codec (COBS/SLIP with CRC16) for PiGo board serial port
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+#  Frame on the wire: encoded(payload + CRC16) + delimiter
+#    COBS: consistent overhead byte stuffing, frames end with 0x00 (at most 1 byte overhead per 254 bytes)
+#    SLIP: RFC 1055, frames end with 0xC0, 0xC0 and 0xDB in the data are escaped
+#  CRC16 is CRC-16/CCITT-FALSE (polynomial 0x1021, initial value 0xFFFF), sent big-endian.
+#
+#  The decoder is incremental: received data of any size is appended to one buffer, frame
+#  delimiters are found with bytearray.find() and frames are decoded block by block (COBS)
+#  or with bytes.replace() (SLIP), so no Python code runs per received byte.
+
+import binascii
+
+import PiGoBoardData
+
+# CRC16 lookup table (polynomial 0x1021), used when binascii has no crc_hqx
+CRC16_TABLE = []
+for i in range(0, 256):
+	crc = i << 8
+	for bit in range(0, 8):
+		if crc & 0x8000:
+			crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+		else:
+			crc = (crc << 1) & 0xFFFF
+	CRC16_TABLE.append(crc)
+
+# CRC-16/CCITT-FALSE
+# binascii.crc_hqx implements the same table-driven CRC in C
+# Arguments:
+#   data: bytes-like object
+#   crc: initial value, or CRC of the preceding data (default: 0xFFFF)
+# Returns:
+#   CRC16 value
+def crc16(data, crc = 0xFFFF):
+	if hasattr(binascii, 'crc_hqx'):
+		return binascii.crc_hqx(data, crc)
+	for byte in bytearray(data):
+		crc = ((crc << 8) & 0xFFFF) ^ CRC16_TABLE[(crc >> 8) ^ byte]
+	return crc
+
+SLIP_END = 0xC0
+SLIP_ESC = 0xDB
+SLIP_ESC_END = 0xDC
+SLIP_ESC_ESC = 0xDD
+
+# COBS encoding (without the frame delimiter)
+# Arguments:
+#   data: bytes-like object
+# Returns:
+#   bytearray with no zero bytes
+def cobsEncode(data):
+	out = bytearray()
+	for part in bytes(data).split(b'\x00'):
+		view = memoryview(part)
+		# Blocks of 254 non-zero bytes have code 0xFF and no implied zero
+		start = 0
+		while len(part) - start >= 254:
+			out.append(0xFF)
+			out += view[start:start + 254]
+			start += 254
+		out.append(len(part) - start + 1)
+		out += view[start:]
+	return out
+
+# COBS decoding of buffer[start:end]
+# Arguments:
+#   buffer: bytearray holding the encoded data
+#   start, end: encoded data range (without the frame delimiter)
+# Returns:
+#   decoded bytearray, None if the data is not valid COBS
+def cobsDecode(buffer, start, end):
+	out = bytearray()
+	view = memoryview(buffer)
+	try:
+		index = start
+		while index < end:
+			code = buffer[index]
+			blockEnd = index + code
+			if code == 0 or blockEnd > end:
+				return None
+			out += view[index + 1:blockEnd]
+			index = blockEnd
+			if code < 0xFF and index < end:
+				out.append(0)
+	finally:
+		# Release the export, so the buffer can be resized again
+		if hasattr(view, 'release'):
+			view.release()
+	return out
+
+# SLIP encoding (without the frame delimiter)
+def slipEncode(data):
+	data = bytes(data)
+	data = data.replace(b'\xdb', b'\xdb\xdd')
+	return bytearray(data.replace(b'\xc0', b'\xdb\xdc'))
+
+# SLIP decoding
+# Returns:
+#   decoded bytearray, None if the data contains an invalid escape sequence
+def slipDecode(buffer, start, end):
+	data = bytes(buffer[start:end])
+	if data.count(b'\xdb') != data.count(b'\xdb\xdc') + data.count(b'\xdb\xdd'):
+		return None
+	data = data.replace(b'\xdb\xdc', b'\xc0')
+	return bytearray(data.replace(b'\xdb\xdd', b'\xdb'))
+
+# Encode frame
+# Arguments:
+#   payload: bytes-like object
+#   framing: PiGoBoardData.FRAMING_COBS (default) or FRAMING_SLIP
+# Returns:
+#   bytes to send, including CRC16 and frame delimiter
+def encodeFrame(payload, framing = PiGoBoardData.FRAMING_COBS):
+	crc = crc16(payload)
+	data = bytearray(payload)
+	data.append(crc >> 8)
+	data.append(crc & 0xFF)
+	if framing == PiGoBoardData.FRAMING_SLIP:
+		out = slipEncode(data)
+		out.append(SLIP_END)
+	else:
+		out = cobsEncode(data)
+		out.append(0)
+	return bytes(out)
+
+# Incremental frame decoder
+class FrameDecoder:
+	# FrameDecoder constructor
+	# Arguments:
+	#   framing: PiGoBoardData.FRAMING_COBS (default) or FRAMING_SLIP
+	#   maxFrameSize: maximal payload size, longer frames are dropped (default: 1024)
+	# Returns:
+	#   none
+	def __init__(self, framing = PiGoBoardData.FRAMING_COBS, maxFrameSize = 1024):
+		if framing == PiGoBoardData.FRAMING_SLIP:
+			self.delimiter = b'\xc0'
+			self.decode = slipDecode
+			# Every byte may be escaped
+			self.maxEncodedSize = 2 * (maxFrameSize + 2)
+		elif framing == PiGoBoardData.FRAMING_COBS:
+			self.delimiter = b'\x00'
+			self.decode = cobsDecode
+			self.maxEncodedSize = maxFrameSize + 2 + (maxFrameSize + 2) // 254 + 1
+		else:
+			raise ValueError("Unknown framing: " + str(framing))
+		self.framing = framing
+		self.maxFrameSize = maxFrameSize
+
+		self.buffer = bytearray()
+		# Bytes of the buffer already searched for the delimiter
+		self.scanned = 0
+		# Data is skipped until the next delimiter after an oversized frame
+		self.skipping = False
+
+		self.frames = 0
+		self.crcErrors = 0
+		self.framingErrors = 0
+		self.oversized = 0
+
+	# Feed received data
+	# Arguments:
+	#   data: bytes-like object of any size
+	# Returns:
+	#   array of complete frame payloads (bytes) with valid CRC, in the order received
+	def feed(self, data):
+		buffer = self.buffer
+		buffer += data
+		frames = []
+		start = 0
+		index = buffer.find(self.delimiter, self.scanned)
+		while index >= 0:
+			if self.skipping:
+				self.skipping = False
+			elif index > start:
+				self.frame(start, index, frames)
+			start = index + 1
+			index = buffer.find(self.delimiter, start)
+
+		del buffer[0:start]
+		self.scanned = len(buffer)
+		if self.scanned > self.maxEncodedSize:
+			# Frame too long, drop it and wait for the next delimiter
+			del buffer[:]
+			self.scanned = 0
+			if not self.skipping:
+				self.oversized += 1
+				self.skipping = True
+		return frames
+
+	# Decode frame buffer[start:end] and append its payload to frames
+	def frame(self, start, end, frames):
+		if end - start > self.maxEncodedSize:
+			self.oversized += 1
+			return
+		data = self.decode(self.buffer, start, end)
+		if data is None or len(data) < 2:
+			self.framingErrors += 1
+			return
+		if crc16(data) != 0:
+			# CRC over payload and its big-endian CRC is zero for valid frames
+			self.crcErrors += 1
+			return
+		if len(data) - 2 > self.maxFrameSize:
+			self.oversized += 1
+			return
+		del data[-2:]
+		self.frames += 1
+		frames.append(bytes(data))
+
+	# Drop partially received frame
+	def reset(self):
+		del self.buffer[:]
+		self.scanned = 0
+		self.skipping = False
+
+	# Decoder counters
+	# Returns:
+	#   dictionary of counters: frames (valid frames), crc_errors, framing_errors, oversized (dropped long frames),
+	#   pending (bytes of the partially received frame)
+	def counters(self):
+		return {
+			'frames': self.frames,
+			'crc_errors': self.crcErrors,
+			'framing_errors': self.framingErrors,
+			'oversized': self.oversized,
+			'pending': len(self.buffer),
+		}
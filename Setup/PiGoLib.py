@@ -24,21 +24,226 @@
 #       Dependencies:
 #         Raspberry Pi and PiGo board: obviously...
 #         bcm2835.so: shared library for the peripherals support, provided with this library
-#         pyserial-2.6: library for serial (UART) communication
+#         pyserial-2.6: library for serial (UART) communication, imported on first serialOpen()
 #
 #  CHANGELOG:
 #  	February 2 (v1.00):
 #     - initial release
 
 from ctypes import *
-import serial
+import collections
+import errno
+import os
+import threading
+import fcntl
 import PiGoBoardData
+import PiGoStats
+import PiGoArbiter
+import PiGoBCM
+from PiGoStats import timer
+
+# Linux i2c-dev combined transfer structures (struct i2c_msg, struct i2c_rdwr_ioctl_data)
+class I2CMessage(Structure):
+	_fields_ = [("addr", c_uint16), ("flags", c_uint16), ("len", c_uint16), ("buf", POINTER(c_ubyte))]
+
+class I2CRdwrData(Structure):
+	_fields_ = [("msgs", POINTER(I2CMessage)), ("nmsgs", c_uint32)]
+
+# SPI clock divider for a maximal clock
+# The divider is the smallest even divider that keeps the SPI clock at or below maxClock (CDIV must be even, odd values are rounded down)
+# Arguments:
+#   maxClock: maximal SPI clock in Hz
+#   coreClock: core clock in Hz (default: PiGoBoardData.CORE_CLOCK_DEFAULT)
+# Returns:
+#   clock divider (2 to 65534, or BCM2835_SPI_CLOCK_DIVIDER_65536)
+def SPIdivider(maxClock, coreClock = PiGoBoardData.CORE_CLOCK_DEFAULT):
+	divider = int(-(-coreClock // maxClock))
+	divider += divider % 2
+	if divider < 2:
+		return 2
+	if divider >= 65536:
+		return PiGoBoardData.BCM2835_SPI_CLOCK_DIVIDER_65536
+	return divider
+
+# SPI settings of a device on the bus (see PiGoBoard.SPIaddProfile())
+class SPIProfile:
+	# SPIProfile constructor
+	# Arguments:
+	#   mode: data mode (default: PiGoBoardData.BCM2835_SPI_MODE0)
+	#   divider: clock divider (default: PiGoBoardData.BCM2835_SPI_CLOCK_DIVIDER_1024, 244 kHz)
+	#   bitOrder: bit order (default: PiGoBoardData.BCM2835_SPI_BIT_ORDER_MSBFIRST)
+	#   chipSelect: native chip select (BCM2835_SPI_CS0, BCM2835_SPI_CS1 or BCM2835_SPI_CS_NONE),
+	#               None if the chip select is driven by the module (default: None)
+	#   polarity: active level of the native chip select (default: 0, active low)
+	# Returns:
+	#   none
+	def __init__(self, mode = PiGoBoardData.BCM2835_SPI_MODE0, divider = PiGoBoardData.BCM2835_SPI_CLOCK_DIVIDER_1024,
+								bitOrder = PiGoBoardData.BCM2835_SPI_BIT_ORDER_MSBFIRST, chipSelect = None, polarity = 0):
+		self.mode = mode
+		self.divider = divider
+		self.bitOrder = bitOrder
+		self.chipSelect = chipSelect
+		self.polarity = polarity
+
+# I2C device handle
+# Each handle owns a /dev/i2c-N file descriptor bound to a single slave address once,
+# so reads and writes never have to switch the target address
+class I2CDevice:
+	# I2CDevice constructor
+	# Arguments:
+	#   bus: I2C bus number (0 for Raspberry Pi revision 1, 1 for revision 2)
+	#   addr: I2C device address (in the range from 0 to 127)
+	# Returns:
+	#   none
+	def __init__(self, bus, addr):
+		self.bus = bus
+		self.addr = addr
+		self.fd = os.open("/dev/i2c-" + str(bus), os.O_RDWR)
+		try:
+			fcntl.ioctl(self.fd, PiGoBoardData.I2C_SLAVE, addr)
+		except (IOError, OSError):
+			os.close(self.fd)
+			self.fd = None
+			raise
+
+	# Write to I2C device
+	# Arguments:
+	#   data: data to be written to I2C device
+	# Returns:
+	#   True if data was acknowledged, False otherwise
+	def write(self, data):
+		if isinstance(data, int):
+			data = [data]
+		try:
+			return os.write(self.fd, bytes(bytearray(data))) == len(data)
+		except (IOError, OSError):
+			return False
+
+	# Read from I2C device
+	# Arguments:
+	#   numBytes: number of bytes to be read from I2C device
+	# Returns:
+	#   Array of data if data was send by the device, empty array otherwise
+	def read(self, numBytes):
+		try:
+			return list(bytearray(os.read(self.fd, numBytes)))
+		except (IOError, OSError):
+			return []
+
+	# Combined write-then-read transfer (I2C_RDWR)
+	# All segments are executed in a single ioctl with repeated START conditions between
+	# the messages, segments may address other devices on the same bus
+	# Arguments:
+	#   segments: array of (addr, writeData, readLength) tuples
+	# Returns:
+	#   Array of read data arrays (one per segment), None if the bus driver does not support the transfer,
+	#   IOError is raised if it failed otherwise (e.g. a device did not respond)
+	def transfer(self, segments):
+		msgs = (I2CMessage * (2 * len(segments)))()
+		buffers = []
+		n = 0
+		for addr, writeData, readLength in segments:
+			if len(writeData) > 0:
+				wbuf = (c_ubyte * len(writeData))(*writeData)
+				msgs[n].addr = addr
+				msgs[n].flags = 0
+				msgs[n].len = len(writeData)
+				msgs[n].buf = cast(wbuf, POINTER(c_ubyte))
+				buffers.append(wbuf)
+				n += 1
+
+			rbuf = (c_ubyte * readLength)()
+			msgs[n].addr = addr
+			msgs[n].flags = PiGoBoardData.I2C_M_RD
+			msgs[n].len = readLength
+			msgs[n].buf = cast(rbuf, POINTER(c_ubyte))
+			buffers.append(rbuf)
+			n += 1
+
+		data = I2CRdwrData(cast(msgs, POINTER(I2CMessage)), n)
+		try:
+			fcntl.ioctl(self.fd, PiGoBoardData.I2C_RDWR, data)
+		except (IOError, OSError) as e:
+			if e.errno in (errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY):
+				return None
+			raise
+
+		# Read buffers are the messages with I2C_M_RD flag set
+		return [list(bytearray(msgs[i].buf[0:msgs[i].len])) for i in range(0, n) if msgs[i].flags & PiGoBoardData.I2C_M_RD]
+
+	# Close the device file descriptor
+	# Arguments:
+	#   none
+	# Returns:
+	#   none
+	def close(self):
+		if self.fd is not None:
+			os.close(self.fd)
+			self.fd = None
+
+# Open serial port with pySerial
+# pySerial is imported on first use, programs not using the serial port do not load it
+# Arguments:
+#   port: serial port name
+#   baud: baudrate
+#   **kwargs: other serial.Serial arguments
+# Returns:
+#   serial.Serial object
+def openSerial(port, baud, **kwargs):
+	import serial
+	return serial.Serial(port, baud, **kwargs)
+
+# Open sysfs GPIO edge source (see PiGoEvents.SysfsEdgeSource)
+# Arguments:
+#   pin: Raspberry IO pin index
+#   edge: PiGoBoardData.EDGE_RISING, EDGE_FALLING or EDGE_BOTH
+# Returns:
+#   PiGoEvents.SysfsEdgeSource object
+def openEdgeSource(pin, edge):
+	import PiGoEvents
+	return PiGoEvents.SysfsEdgeSource(pin, edge)
+
+# Deferred changes of the batch of a thread (see PiGoBoard.batch())
+class BoardBatchState(threading.local):
+	def __init__(self):
+		self.depth = 0
+		# Buffered outputs to set and to clear (GPIO bank masks)
+		self.setMask = 0
+		self.clrMask = 0
+		# Pin function changes
+		self.fsel = {}
+		self.interrupts = False
+		# Operations deferred with batchDefer()
+		self.deferred = collections.OrderedDict()
+
+# Batch context returned by PiGoBoard.batch()
+class BoardBatch:
+	def __init__(self, board):
+		self.board = board
+		self.transaction = board.busTransaction(['i2c', 'spi', 'gpio'])
+
+	def __enter__(self):
+		self.transaction.__enter__()
+		self.board.batchState.depth += 1
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		try:
+			state = self.board.batchState
+			state.depth -= 1
+			if state.depth == 0 and self.board.libInitialized:
+				# Shadow registers were already changed, write them even if the batch failed
+				self.board.batchFlush()
+		finally:
+			self.transaction.__exit__(excType, excValue, traceback)
+		return False
 
 class PiGoBoard:
 
 	# Initialize SPI interface
 	# Arguments:
-	#   SPIdivider: a constant that is used to divide the original 250 MHz clock for SPI, default value is 1024, giving 244 kHz SPI clock
+	#   SPIdivider: a constant that is used to divide the core clock for SPI (250 MHz on Raspberry Pi 1 and 2, see PiGoBoardData.BCM2835_CORE_CLOCK),
+	#     default value is 1024, giving 244 kHz SPI clock on Raspberry Pi 1 and 2
 	def SPIinit(self, SPIdivider = PiGoBoardData.BCM2835_SPI_CLOCK_DIVIDER_1024):
 		# Check if library was initialized successfully, if not, raise the exception
 		if self.libInitialized == False:
@@ -46,29 +251,105 @@ class PiGoBoard:
 			
 		# Save some space and bring the libObj to function space
 		libObj = self.libObj
-		
-		# Initialize SPI pins
-		libObj.bcm2835_spi_begin()
-		# Set mode 0 (CPOL = 0, CPHA = 0: Rest state of clock is low, first CLK transition at middle of data bit)
-		libObj.bcm2835_spi_setDataMode(PiGoBoardData.BCM2835_SPI_MODE0)        
-		# Set clock divider (250 kHz SPI clock)        
-		libObj.bcm2835_spi_setClockDivider(SPIdivider)
-		
-		# Set default chip select and polarity
-		self.SPIsetCS()
+
+		with self.SPIlock:
+			start = timer()
+			# Initialize SPI pins
+			libObj.bcm2835_spi_begin()
+			# Set mode 0 (CPOL = 0, CPHA = 0: Rest state of clock is low, first CLK transition at middle of data bit)
+			libObj.bcm2835_spi_setDataMode(PiGoBoardData.BCM2835_SPI_MODE0)
+			# Set clock divider (250 kHz SPI clock)
+			libObj.bcm2835_spi_setClockDivider(SPIdivider)
+
+			# Live settings, the bit order was not set
+			self.SPIsettings = {'mode': PiGoBoardData.BCM2835_SPI_MODE0, 'divider': SPIdivider, 'bitOrder': None}
+
+			# Restore selected chip select (default: CS0), spi_begin resets it
+			self.SPIsetCS(self.SPIcs)
+			self.SPIready = True
+			self.startupRecord('spi', start)
+
+	# Register SPI device profile
+	# Arguments:
+	#   name: profile name
+	#   mode, divider, bitOrder, chipSelect, polarity: SPI settings of the device (see SPIProfile)
+	# Returns:
+	#   SPIProfile object
+	def SPIaddProfile(self, name, mode = PiGoBoardData.BCM2835_SPI_MODE0, divider = PiGoBoardData.BCM2835_SPI_CLOCK_DIVIDER_1024,
+								bitOrder = PiGoBoardData.BCM2835_SPI_BIT_ORDER_MSBFIRST, chipSelect = None, polarity = 0):
+		profile = SPIProfile(mode, divider, bitOrder, chipSelect, polarity)
+		self.SPIprofiles[name] = profile
+		return profile
+
+	# Switch SPI bus to the settings of a device
+	# Only the settings that differ from the live ones are written, nothing is done if the profile is active.
+	# Call it before the transfers to the device, with the SPI bus locked.
+	# Arguments:
+	#   profile: SPIProfile object or name of a registered profile
+	# Returns:
+	#   none
+	def SPIuseProfile(self, profile):
+		if self.libInitialized == False or self.SPIprofile is profile:
+			return
+		if not isinstance(profile, SPIProfile):
+			profile = self.SPIprofiles[profile]
+			if self.SPIprofile is profile:
+				return
+		if self.SPIready == False:
+			self.SPIinit()
+
+		libObj = self.libObj
+		with self.SPIlock:
+			live = self.SPIsettings
+			if live['mode'] != profile.mode:
+				libObj.bcm2835_spi_setDataMode(profile.mode)
+				live['mode'] = profile.mode
+			if live['divider'] != profile.divider:
+				libObj.bcm2835_spi_setClockDivider(profile.divider)
+				live['divider'] = profile.divider
+			if live['bitOrder'] != profile.bitOrder:
+				libObj.bcm2835_spi_setBitOrder(profile.bitOrder)
+				live['bitOrder'] = profile.bitOrder
+			if profile.chipSelect is not None:
+				key = ('polarity', profile.chipSelect)
+				if profile.chipSelect != PiGoBoardData.BCM2835_SPI_CS_NONE and live.get(key) != profile.polarity:
+					libObj.bcm2835_spi_setChipSelectPolarity(profile.chipSelect, profile.polarity)
+					live[key] = profile.polarity
+				self.SPIselect(profile.chipSelect)
+			self.SPIprofile = profile
 
 	# Set chip select and polarity of it
 	# Arguments:
-	#   CS: chip select constant (BCM2835_SPI_CS0 for the primary chip select, BCM2835_SPI_CS1 for the secondary chip select)
+	#   CS: chip select constant (BCM2835_SPI_CS0 for the primary chip select, BCM2835_SPI_CS1 for the secondary chip select,
+	#       BCM2835_SPI_CS_NONE for no chip select)
+	#   polarity: active level of the chip select (default: 0, active low)
 	def SPIsetCS(self, CS = PiGoBoardData.BCM2835_SPI_CS0, polarity = 0):
 		# Check if library was initialized successfully, if not, raise the exception
 		if self.libInitialized == False:
 			return
 
-		# Set chip select
-		self.libObj.bcm2835_spi_chipSelect(CS)
-		# Set chip select polarity
-		self.libObj.bcm2835_spi_setChipSelectPolarity(PiGoBoardData.BCM2835_SPI_CS0, polarity)      
+		with self.SPIlock:
+			# Set chip select
+			self.libObj.bcm2835_spi_chipSelect(CS)
+			self.SPIcs = CS
+			# Set chip select polarity
+			if CS != PiGoBoardData.BCM2835_SPI_CS_NONE:
+				self.libObj.bcm2835_spi_setChipSelectPolarity(CS, polarity)
+				self.SPIsettings[('polarity', CS)] = polarity
+			self.SPIprofile = None
+
+	# Select chip select for the following transfers, the library is only called when it changes
+	# Arguments:
+	#   CS: chip select constant (BCM2835_SPI_CS0, BCM2835_SPI_CS1 or BCM2835_SPI_CS_NONE)
+	# Returns:
+	#   none
+	def SPIselect(self, CS):
+		if self.libInitialized == False or self.SPIcs == CS:
+			return
+
+		with self.SPIlock:
+			self.libObj.bcm2835_spi_chipSelect(CS)
+			self.SPIcs = CS
 
 
 	# SPI transfer data
@@ -80,28 +361,26 @@ class PiGoBoard:
 		# Check if library was initialized successfully, if not, raise the exception
 		if self.libInitialized == False:
 			return []
+		if self.SPIready == False:
+			self.SPIinit()
 
 		# If user provided only single integer, transfer it...
 		if isinstance(data, int):
-			numBytes = 1
-			SPIdata = c_ubyte * 1
-			buf = SPIdata(data)
-			
-		else:
-			# Construct a c_byte array of numBytes bytes
+			data = [data]
+
+		with self.SPIlock:
+			# Copy the Python array to the preallocated transfer buffer
 			numBytes = len(data)
-			SPIdata = c_ubyte * numBytes
-			
-			# Copy the Python array to c_byte array
-			buf = SPIdata()
-			for i in range(0, numBytes):
-				buf[i] = data[i]
+			buf = self.SPIgetBuffer(numBytes)
+			buf[0:numBytes] = bytearray(data)
 
-		# Transfer the data to SPI device and read it back
-		self.libObj.bcm2835_spi_transfern(buf, numBytes)	
-		
-		# Return the array with the results
-		return [buf[i] for i in range(0, numBytes)]
+			# Transfer the data to SPI device and read it back
+			start = timer()
+			self.BCMspiTransfern(self.SPIbufferC, numBytes)
+			self.statsObj.spi(start, numBytes)
+
+			# Return the array with the results
+			return list(buf[0:numBytes])
 		
 	# SPI read data
 	# Arguments:
@@ -112,15 +391,183 @@ class PiGoBoard:
 		# Check if library was initialized successfully, if not, raise the exception
 		if self.libInitialized == False:
 			return []
+		if self.SPIready == False:
+			self.SPIinit()
 		
-		# Construct the c_byte array of numBytes bytes
-		SPIdata = c_ubyte * numBytes
-		buf = SPIdata()
-		
-		# Read the data from SPI device
-		self.libObj.bcm2835_spi_transfern(buf, numBytes)
-		
-		return [buf[i] for i in range(0, numBytes)]		
+		with self.SPIlock:
+			# Clear the preallocated transfer buffer, zeros are sent to the device
+			buf = self.SPIgetBuffer(numBytes)
+			buf[0:numBytes] = bytearray(numBytes)
+
+			# Read the data from SPI device
+			start = timer()
+			self.BCMspiTransfern(self.SPIbufferC, numBytes)
+			self.statsObj.spi(start, numBytes)
+
+			return list(buf[0:numBytes])
+
+	# SPI transfer data in place, without copying
+	# Arguments:
+	#   buf: writable buffer (bytearray, memoryview, array('B'), numpy uint8 array...) with the data to
+	#        be written to target SPI device, received bytes replace the contents of the buffer
+	#   numBytes: number of bytes to transfer from the start of the buffer (default: whole buffer)
+	# Returns:
+	#   memoryview of the transferred part of the buffer
+	def SPItransfer_into(self, buf, numBytes = None):
+		if self.libInitialized == False:
+			return memoryview(bytearray(0))
+		if self.SPIready == False:
+			self.SPIinit()
+
+		if numBytes is None:
+			numBytes = getattr(buf, 'nbytes', None)
+			if numBytes is None:
+				numBytes = len(buf) * getattr(buf, 'itemsize', 1)
+
+		# Pass the buffer memory straight to the library
+		SPIdata = (c_ubyte * numBytes).from_buffer(buf)
+		with self.SPIlock:
+			start = timer()
+			self.BCMspiTransfern(SPIdata, numBytes)
+			self.statsObj.spi(start, numBytes)
+
+		try:
+			view = memoryview(buf)
+		except TypeError:
+			# Python 2 arrays have no memoryview support, return the ctypes view of the buffer instead
+			return SPIdata
+		if hasattr(view, 'cast'):
+			view = view.cast('B')
+		return view[0:numBytes]
+
+	# SPI transfer data using the preallocated transfer buffer
+	# Arguments:
+	#   data: bytes-like object (bytes, bytearray, memoryview...) to be written to target SPI device
+	# Returns:
+	#   bytes returned by the SPI device, with the same size as provided in data
+	def SPItransfer_bytes(self, data):
+		if self.libInitialized == False:
+			return b""
+		if self.SPIready == False:
+			self.SPIinit()
+
+		with self.SPIlock:
+			numBytes = len(data)
+			buf = self.SPIgetBuffer(numBytes)
+			buf[0:numBytes] = data
+			start = timer()
+			self.BCMspiTransfern(self.SPIbufferC, numBytes)
+			self.statsObj.spi(start, numBytes)
+
+			return memoryview(buf)[0:numBytes].tobytes()
+
+	# Stream SPI transfer
+	# The data is transferred in chunks of at most chunkSize bytes through a fixed buffer, so memory use does not
+	# depend on the length of the stream. The SPI bus and the chip select are held from the first to the last byte,
+	# the native chip select (chipSelect None or CS_NATIVE) needs bcm2835_spi_transfernFIFO_part in libBCM.so and
+	# raises EnvironmentError without it. Iterate over the generator to the end or close it, the bus stays locked until then.
+	# Arguments:
+	#   buffers: bytes-like object, or iterable (e.g. generator) of bytes-like objects of any sizes to be written
+	#   chunkSize: maximal number of bytes per library call (default: 4096)
+	#   chipSelect: chip select held during the stream, chip select object (e.g. ModuleADDA.ADcs) or (strategy, pin)
+	#               tuple (see makeChipSelect()), None for the selected native chip select (default: None)
+	#   profile: SPI profile applied before the stream (see SPIuseProfile(), default: None, settings are kept)
+	# Returns:
+	#   generator of received chunks (bytes), with the length of the transferred chunks
+	def SPIstream(self, buffers, chunkSize = 4096, chipSelect = None, profile = None):
+		if self.libInitialized == False:
+			return
+		if isinstance(buffers, (bytes, bytearray, memoryview)):
+			buffers = [buffers]
+		if chipSelect is not None and not hasattr(chipSelect, 'select'):
+			chipSelect = makeChipSelect(self, chipSelect)
+
+		transferPart = self.BCMspiTransfernPart
+		if transferPart is None and (chipSelect is None or chipSelect.kind == PiGoBoardData.CS_NATIVE):
+			# Every transfern call deasserts the native chip select at its end
+			raise EnvironmentError("Native chip select cannot be held, libBCM.so has no bcm2835_spi_transfernFIFO_part")
+
+		buses = set(['spi'])
+		if chipSelect is not None:
+			buses.update(chipSelect.buses)
+		transaction = self.busTransaction([bus for bus in PiGoArbiter.BUS_ORDER if bus in buses])
+
+		buf = bytearray(chunkSize)
+		bufC = (c_ubyte * chunkSize).from_buffer(buf)
+		with transaction:
+			if profile is not None:
+				self.SPIuseProfile(profile)
+			elif self.SPIready == False:
+				self.SPIinit()
+			if chipSelect is not None:
+				chipSelect.select()
+
+			# Transfer active between the first and the last part
+			active = False
+			try:
+				fill = 0
+				for data in buffers:
+					view = memoryview(data)
+					if hasattr(view, 'cast') and view.itemsize != 1:
+						view = view.cast('B')
+					offset = 0
+					numBytes = len(view)
+					while offset < numBytes:
+						if fill == chunkSize:
+							# Full chunk is sent when more data follows, the last chunk ends the transfer
+							start = timer()
+							if transferPart is not None:
+								transferPart(bufC, fill, not active, 0)
+								active = True
+							else:
+								self.BCMspiTransfern(bufC, fill)
+							self.statsObj.spi(start, fill)
+							fill = 0
+							yield bytes(buf)
+						n = min(chunkSize - fill, numBytes - offset)
+						buf[fill:fill + n] = view[offset:offset + n]
+						fill += n
+						offset += n
+
+				if fill > 0:
+					start = timer()
+					if transferPart is not None:
+						transferPart(bufC, fill, not active, 1)
+						active = False
+					else:
+						self.BCMspiTransfern(bufC, fill)
+					self.statsObj.spi(start, fill)
+					yield bytes(buf[0:fill])
+			finally:
+				if active:
+					# Stream closed early, end the transfer
+					transferPart(bufC, 0, 0, 1)
+				if chipSelect is not None:
+					chipSelect.release()
+
+	# Write SPI stream, received data is dropped
+	# Arguments:
+	#   buffers, chunkSize, chipSelect, profile: see SPIstream()
+	# Returns:
+	#   number of bytes transferred
+	def SPIwriteStream(self, buffers, chunkSize = 4096, chipSelect = None, profile = None):
+		numBytes = 0
+		for chunk in self.SPIstream(buffers, chunkSize, chipSelect, profile):
+			numBytes += len(chunk)
+		return numBytes
+
+	# Get the preallocated SPI transfer buffer
+	# The buffer is reused by all SPI transfers of the board and grows when needed,
+	# it may only be used while SPI bus is locked
+	# Arguments:
+	#   numBytes: minimal size of the buffer
+	# Returns:
+	#   bytearray transfer buffer, SPIbufferC is the ctypes view of it passed to the library
+	def SPIgetBuffer(self, numBytes):
+		if len(self.SPIbuffer) < numBytes:
+			self.SPIbuffer = bytearray(max(numBytes, 2 * len(self.SPIbuffer)))
+			self.SPIbufferC = (c_ubyte * len(self.SPIbuffer)).from_buffer(self.SPIbuffer)
+		return self.SPIbuffer
 	
 	# Initialize PWM module
 	# Arguments:
@@ -134,10 +581,21 @@ class PiGoBoard:
 			
 		# Save some space and bring the libObj to function space
 		libObj = self.libObj
-		
-		libObj.bcm2835_gpio_fsel(PiGoBoardData.RPI_GPIO_P1_12, PiGoBoardData.BCM2835_GPIO_FSEL_ALT5)
-		# User fixed 32 for clock divider
-		libObj.bcm2835_pwm_init(PiGoBoardData.BCM2835_PWM0_ENABLE | PiGoBoardData.BCM2835_PWM0_MS_MODE, 32)
+
+		with self.GPIOlock:
+			if self.batchState.depth > 0:
+				# Pin function changes of the batch are applied on its end, this one must not be overridden by them
+				self.batchState.fsel[PiGoBoardData.RPI_GPIO_P1_12] = PiGoBoardData.BCM2835_GPIO_FSEL_ALT5
+			else:
+				start = timer()
+				libObj.bcm2835_gpio_fsel(PiGoBoardData.RPI_GPIO_P1_12, PiGoBoardData.BCM2835_GPIO_FSEL_ALT5)
+				self.statsObj.gpio(start, True)
+			# User fixed 32 for clock divider
+			start = timer()
+			libObj.bcm2835_pwm_init(PiGoBoardData.BCM2835_PWM0_ENABLE | PiGoBoardData.BCM2835_PWM0_MS_MODE, 32)
+			self.statsObj.pwm(start)
+			self.PWMready = True
+			self.startupRecord('pwm', start)
 		
   # Setup PWM period
 	# Arguments:
@@ -148,10 +606,17 @@ class PiGoBoard:
 		# Check if library was initialized successfully, if not, raise the exception
 		if self.libInitialized == False:
 			return
+		if self.PWMready == False:
+			self.PWMinit()
 		
-		libObj = self.libObj
-		self.PWMperiod = period * 4800000 
-		libObj.bcm2835_pwm0_setRange(int(self.PWMperiod))
+		with self.GPIOlock:
+			self.PWMperiod = period * 4800000
+			start = timer()
+			if self.directIO is not None and self.directIO.pwm is not None:
+				self.directIO.pwmSetRange(int(self.PWMperiod))
+			else:
+				self.BCMpwmSetRange(int(self.PWMperiod))
+			self.statsObj.pwm(start)
 		
   # Setup PWM duty cycle
 	# Arguments:
@@ -162,14 +627,21 @@ class PiGoBoard:
 		# Check if library was initialized successfully, if not, raise the exception
 		if self.libInitialized == False:
 			return
+		if self.PWMready == False:
+			self.PWMinit()
 		
 		if duty > 1:
 			duty = 1
 		elif duty < 0:
 			duty = 0
 
-		libObj = self.libObj
-		libObj.bcm2835_pwm0_setData(int(duty * self.PWMperiod))
+		with self.GPIOlock:
+			start = timer()
+			if self.directIO is not None and self.directIO.pwm is not None:
+				self.directIO.pwmSetData(int(duty * self.PWMperiod))
+			else:
+				self.BCMpwmSetData(int(duty * self.PWMperiod))
+			self.statsObj.pwm(start)
 			
 	
 	# Set target I2C device address
@@ -181,8 +653,10 @@ class PiGoBoard:
 		if self.libInitialized == False:
 			return
 		
-		libObj = self.libObj
-		libObj.bcm2835_i2c_setAddr(addr)
+		with self.I2Clock:
+			self.BCMi2cSetAddr(addr)
+			self.I2Caddr = addr
+			self.statsObj.i2cAddressSwitch()
 
 	# Write to I2C device
 	# Arguments:
@@ -212,10 +686,11 @@ class PiGoBoard:
 				buf[i] = data[i]
 
 		# Write the data to I2C device
-		if self.libObj.bcm2835_i2c_write(buf, numBytes) < numBytes:
-			return False
-		else:
-			return True
+		with self.I2Clock:
+			start = timer()
+			ack = self.BCMi2cWrite(buf, numBytes) >= numBytes
+			self.statsObj.i2c(self.I2Caddr, start, numBytes, 0, ack)
+		return ack
 		
 	# Read from I2C device
 	# Arguments:
@@ -232,38 +707,171 @@ class PiGoBoard:
 		buf = I2Cdata()
 		
 		# Read the data from I2C device
-		if self.libObj.bcm2835_i2c_read(buf, numBytes) < 0:
+		with self.I2Clock:
+			start = timer()
+			result = self.BCMi2cRead(buf, numBytes)
+			self.statsObj.i2c(self.I2Caddr, start, 0, numBytes)
+		if result < 0:
 			return []
 		else:
 			# Return the array with the results
 			return [buf[i] for i in range(0, numBytes)]
-					
-			
+
+	# Get I2C device handle from the connection pool
+	# The device file is opened and bound to the address on first use only,
+	# the handle may only be used while I2C bus is locked
+	# Arguments:
+	#   addr: I2C device address (in the range from 0 to 127)
+	# Returns:
+	#   I2CDevice object
+	def I2CgetDevice(self, addr):
+		device = self.I2Cdevices.get(addr)
+		if device is None:
+			device = self.I2CdeviceFactory(self.i2cBus, addr)
+			self.I2Cdevices[addr] = device
+			self.statsObj.i2cAddressSwitch()
+		return device
+
+	# Close all I2C device handles in the connection pool
+	# Arguments:
+	#   none
+	# Returns:
+	#   none
+	def I2CclosePool(self):
+		with self.I2Clock:
+			for device in self.I2Cdevices.values():
+				device.close()
+			self.I2Cdevices = {}
+
+	# Read consecutive registers of I2C device
+	# Register address is written and data read back in a single combined transfer
+	# Arguments:
+	#   addr: I2C device address (in the range from 0 to 127)
+	#   reg: address of the first register
+	#   numBytes: number of registers to read
+	# Returns:
+	#   Array of register values, empty array if the device did not respond
+	def readRegisters(self, addr, reg, numBytes):
+		if self.libInitialized == False:
+			return []
+
+		return self.readRegistersMulti([(addr, reg, numBytes)])[0]
+
+	# Read consecutive registers of several I2C devices
+	# All reads are combined into a single I2C_RDWR ioctl. If the bus driver refuses
+	# transfers with several messages, reads fall back to one combined transfer per device,
+	# or to a plain write followed by a read if I2C_RDWR is not supported at all. If a device
+	# does not respond, the devices of the failed transfer are read one by one
+	# Arguments:
+	#   requests: array of (addr, reg, numBytes) tuples
+	# Returns:
+	#   Array of register value arrays (one per request), empty array for devices that did not respond
+	def readRegistersMulti(self, requests):
+		if self.libInitialized == False:
+			return [[] for request in requests]
+
+		with self.I2Clock:
+			segments = [(addr, [reg], numBytes) for addr, reg, numBytes in requests]
+
+			if self.I2CcombinedReads > 1 or (self.I2CcombinedReads == 1 and len(segments) == 1):
+				device = self.I2CgetDevice(requests[0][0])
+				start = timer()
+				try:
+					result = device.transfer(segments)
+				except (IOError, OSError):
+					# A device did not respond
+					self.statsObj.i2c([request[0] for request in requests], start, len(segments), 0, False)
+					if len(segments) == 1:
+						return [[]]
+				else:
+					if result is not None:
+						self.statsObj.i2c([request[0] for request in requests], start, len(segments), sum([request[2] for request in requests]))
+						return result
+					# Driver does not accept this many messages, try with fewer
+					if len(segments) > 1:
+						self.I2CcombinedReads = 1
+					else:
+						self.I2CcombinedReads = 0
+
+			result = []
+			for segment in segments:
+				device = self.I2CgetDevice(segment[0])
+				data = None
+				if self.I2CcombinedReads > 0:
+					start = timer()
+					try:
+						data = device.transfer([segment])
+					except (IOError, OSError):
+						self.statsObj.i2c(segment[0], start, 1, 0, False)
+						result.append([])
+						continue
+					if data is None:
+						self.I2CcombinedReads = 0
+					else:
+						self.statsObj.i2c(segment[0], start, 1, segment[2])
+						data = data[0]
+				if data is None:
+					start = timer()
+					ack = device.write(segment[1])
+					self.statsObj.i2c(segment[0], start, 1, 0, ack)
+					if ack:
+						start = timer()
+						data = device.read(segment[2])
+						self.statsObj.i2c(segment[0], start, 0, len(data))
+					else:
+						data = []
+				result.append(data)
+			return result
+
+	# Write consecutive registers of I2C device in a single transfer
+	# The device must auto-increment its register pointer (e.g. MCP23017 in sequential mode)
+	# Arguments:
+	#   addr: I2C device address (in the range from 0 to 127)
+	#   reg: address of the first register
+	#   data: array of register values, written to reg, reg + 1, ...
+	# Returns:
+	#   True if data was acknowledged, False otherwise
+	def writeRegisters(self, addr, reg, data):
+		if self.libInitialized == False:
+			return False
+
+		with self.I2Clock:
+			data = [reg] + list(data)
+			device = self.I2CgetDevice(addr)
+			start = timer()
+			ack = device.write(data)
+			self.statsObj.i2c(addr, start, len(data), 0, ack)
+			return ack
+
+
 	# Open serial port using pySerial module
 	# Arguments:
 	#   baud: baudrate (default: 9600)
 	#   port: serial port name (default: '/dev/ttyAMA0')
 	#   timeoutValue: read timeout in seconds (default: 1s)
-	#   bytesizeValue: length of the data byte (default: serial.EIGHTBITS)
+	#   bytesizeValue: length of the data byte (default: serial.EIGHTBITS = 8)
 	#       possible values: serial.FIVEBITS, serial.SIXBITS, serial.SEVENBITS, serial.EIGHTBITS
-	#   parityValue: parity check (default: PARITY_NONE)
+	#   parityValue: parity check (default: serial.PARITY_NONE = 'N')
 	#       possible values: serial.PARITY_NONE, serial.PARITY_EVEN, serial.PARITY_ODD, 
 	#												 serial.PARITY_MARK, serial.PARITY_SPACE)
-	#   stopbitsValue: number of stop bits (default: serial.STOPBITS_ONE)
+	#   stopbitsValue: number of stop bits (default: serial.STOPBITS_ONE = 1)
 	#       possible values: serial.STOPBITS_ONE, serial.STOPBITS_ONE_POINT_FIVE, serial.STOPBITS_TWO
 	# Returns:
 	#   none
-	def serialOpen(self, baud = 9600, port = '/dev/ttyAMA0', timeoutValue = 1, parityValue = serial.PARITY_NONE,
-								bytesizeValue = serial.EIGHTBITS, stopbitsValue = serial.STOPBITS_ONE):
+	def serialOpen(self, baud = 9600, port = '/dev/ttyAMA0', timeoutValue = 1, parityValue = 'N',
+								bytesizeValue = 8, stopbitsValue = 1):
 		if self.libInitialized == False:
 			return
 			
 		if self.serObj is not None:
-			if serlf.serObj.isOpen():
+			self.serialStopReader()
+			if self.serObj.isOpen():
 				self.serObj.close()
 		
-		self.serObj = serial.Serial(port, baud, timeout=timeoutValue, bytesize = bytesizeValue, stopbits = stopbitsValue)
+		start = timer()
+		self.serObj = self.serialFactory(port, baud, timeout = timeoutValue, parity = parityValue, bytesize = bytesizeValue, stopbits = stopbitsValue)
 		self.serObj.flush()
+		self.startupRecord('serial', start)
 		
 	# Close serial port
 	# Arguments:
@@ -274,12 +882,15 @@ class PiGoBoard:
 		if self.libInitialized == False:
 			return
 		if self.serObj is not None:
+			self.serialStopReader()
 			if self.serObj.isOpen():
 				self.serObj.close()
 			
 		self.serObj = None
 		
 	# Write to serial port
+	# While the background reader is running, data is queued and written by the writer thread.
+	# IOError is raised if the reader stopped because the port was closed or kept failing (see serialStopReader())
 	# Arguments:
 	#   data: data to write to serial port
 	# Returns:
@@ -287,9 +898,13 @@ class PiGoBoard:
 	def serialWrite(self, data):
 		if self.libInitialized == False:
 			return
-		if self.serObj is not None:
+		if self.serialReader is not None:
+			self.serialReader.write(data)
+		elif self.serObj is not None:
 			if self.serObj.isOpen():
+				start = timer()
 				self.serObj.write(data)
+				self.statsObj.serial(start, len(data), 0)
 			
 	# Check serial port input buffer
 	# Arguments:
@@ -299,6 +914,8 @@ class PiGoBoard:
 	def serialkbhit(self):
 		if self.libInitialized == False:
 			return False
+		if self.serialReader is not None:
+			return self.serialReader.available() > 0
 		if self.serObj is not None:
 			if self.serObj.isOpen():
 				return (self.serObj.inWaiting() > 0)
@@ -315,11 +932,192 @@ class PiGoBoard:
 	def serialRead(self, length):
 		if self.libInitialized == False:
 			return ""
+		if self.serialReader is not None:
+			return self.serialReader.read(length)
 		if self.serObj is not None:
 			if self.serObj.isOpen():
-				return self.serObj.read(length)
+				start = timer()
+				data = self.serObj.read(length)
+				self.statsObj.serial(start, 0, len(data))
+				return data
 		
 		return ""
+
+	# Start background reader of the open serial port
+	# A reader thread drains the port into a ring buffer, so no data is lost while the program is busy,
+	# and a writer thread sends the data queued by serialWrite(), combining small writes
+	# Arguments:
+	#   bufferSize: size of the receive buffer in bytes, received bytes not fitting in it are dropped (default: 4096)
+	#   writeDelay: time in seconds small writes are held back to be combined (default: 0.001)
+	#   writeChunk: queued data is written immediately when this many bytes are waiting (default: 256)
+	# Returns:
+	#   none
+	def serialStartReader(self, bufferSize = 4096, writeDelay = 0.001, writeChunk = 256):
+		if self.libInitialized == False or self.serObj is None:
+			return
+		if self.serialReader is not None:
+			return
+
+		import PiGoSerial
+		self.serialReader = PiGoSerial.SerialReader(self.serObj, bufferSize, writeDelay, writeChunk, statsObj = self.statsObj)
+
+	# Stop background reader of the serial port, queued data is written first
+	# Arguments:
+	#   none
+	# Returns:
+	#   none
+	def serialStopReader(self):
+		if self.serialReader is not None:
+			self.serialReader.stop()
+			self.serialReader = None
+
+	# Read data received on serial port without waiting
+	# Arguments:
+	#   maxBytes: maximal number of bytes to read (default: all received data)
+	#   timeout: time in seconds to wait for data if none was received (default: 0, no waiting),
+	#            used only while the background reader is running
+	# Returns:
+	#   bytes, empty if no data was received
+	def serialReadAvailable(self, maxBytes = None, timeout = 0):
+		if self.libInitialized == False:
+			return b""
+		if self.serialReader is not None:
+			return self.serialReader.readAvailable(maxBytes, timeout)
+		if self.serObj is not None and self.serObj.isOpen():
+			numBytes = self.serObj.inWaiting()
+			if maxBytes is not None:
+				numBytes = min(numBytes, maxBytes)
+			if numBytes > 0:
+				return self.serialRead(numBytes)
+		return b""
+
+	# Read data from serial port up to and including the delimiter
+	# Arguments:
+	#   delimiter: bytes ending the data (default: b'\n')
+	#   timeout: time in seconds to wait for the delimiter, None to wait forever (default: port read timeout)
+	#   maxBytes: data is returned without delimiter when this many bytes are received (default: receive buffer size)
+	# Returns:
+	#   bytes, empty on timeout. While the background reader is running, data received before the timeout
+	#   stays in the receive buffer, otherwise it is lost.
+	def serialReadUntil(self, delimiter = b'\n', timeout = -1, maxBytes = None):
+		if self.libInitialized == False:
+			return b""
+		if self.serialReader is not None:
+			return self.serialReader.readUntil(delimiter, timeout, maxBytes)
+		if self.serObj is None or not self.serObj.isOpen():
+			return b""
+
+		# No reader, read byte by byte with the port read timeout
+		if isinstance(delimiter, str) and not isinstance(delimiter, bytes):
+			delimiter = delimiter.encode('latin-1')
+		if timeout is not None and timeout != -1:
+			end = timer() + timeout
+		data = bytearray()
+		while maxBytes is None or len(data) < maxBytes:
+			byte = self.serialRead(1)
+			if len(byte) == 0:
+				if timeout == -1 or (timeout is not None and timer() >= end):
+					return b""
+				continue
+			data += byte
+			if data.endswith(delimiter):
+				break
+		return bytes(data)
+
+	# Set high watermark callback of the receive buffer (background reader must be running)
+	# Arguments:
+	#   high: buffer level in bytes triggering the callback, None to remove the callback
+	#   callback: function called as callback(level) from the reader thread when the level reaches high,
+	#             it is called again only after the level fell below low
+	#   low: level re-arming the callback (default: high / 2)
+	# Returns:
+	#   none
+	def serialSetWatermark(self, high, callback, low = None):
+		if self.serialReader is not None:
+			self.serialReader.setWatermark(high, callback, low)
+
+	# Background reader counters (see PiGoSerial.SerialReader.counters())
+	# Arguments:
+	#   none
+	# Returns:
+	#   dictionary of counters (bytes_in, bytes_out, reads, writes, overflows, dropped_bytes, read_errors,
+	#   write_errors, unsent_bytes, watermark_hits, max_level, level, queued), None if the reader is not running
+	def serialCounters(self):
+		if self.serialReader is None:
+			return None
+		return self.serialReader.counters()
+
+	# Set frame encoding of serial port frames (see serialWriteFrame() and serialReadFrames())
+	# A partially received frame is dropped
+	# Arguments:
+	#   framing: PiGoBoardData.FRAMING_COBS (default) or FRAMING_SLIP
+	#   maxFrameSize: maximal payload size of received frames, longer frames are dropped (default: 1024)
+	# Returns:
+	#   none
+	def serialSetFraming(self, framing = PiGoBoardData.FRAMING_COBS, maxFrameSize = 1024):
+		import PiGoFraming
+		self.frameDecoder = PiGoFraming.FrameDecoder(framing, maxFrameSize)
+
+	# Write frame to serial port
+	# The payload is sent with CRC16, encoded and delimited (see PiGoFraming)
+	# Arguments:
+	#   payload: bytes-like object
+	# Returns:
+	#   none
+	def serialWriteFrame(self, payload):
+		if self.libInitialized == False:
+			return
+		if self.frameDecoder is None:
+			self.serialSetFraming()
+
+		import PiGoFraming
+		self.serialWrite(PiGoFraming.encodeFrame(payload, self.frameDecoder.framing))
+
+	# Read complete frames received on serial port
+	# Frames with invalid encoding or CRC are dropped and counted (see serialFrameCounters())
+	# Arguments:
+	#   timeout: time in seconds to wait for data if none was received (default: 0, no waiting),
+	#            without background reader the port read timeout is used instead
+	# Returns:
+	#   array of frame payloads (bytes), empty if no complete frame was received
+	def serialReadFrames(self, timeout = 0):
+		if self.libInitialized == False:
+			return []
+		if self.frameDecoder is None:
+			self.serialSetFraming()
+
+		if self.serialReader is not None:
+			data = self.serialReader.readAvailable(None, timeout)
+		else:
+			data = self.serialReadAvailable()
+			if len(data) == 0 and timeout != 0:
+				# Wait for the first byte with the port read timeout
+				data = self.serialRead(1)
+				if len(data) > 0:
+					data += self.serialReadAvailable()
+		if len(data) == 0:
+			return []
+		return self.frameDecoder.feed(data)
+
+	# Iterate over frames received on serial port, ends when the serial port is closed
+	# Arguments:
+	#   timeout: time in seconds to wait for data between checks of the port state (default: 0.1)
+	# Returns:
+	#   generator of frame payloads (bytes)
+	def serialFrames(self, timeout = 0.1):
+		while self.serObj is not None and self.serObj.isOpen():
+			for frame in self.serialReadFrames(timeout):
+				yield frame
+
+	# Frame decoder counters (see PiGoFraming.FrameDecoder.counters())
+	# Arguments:
+	#   none
+	# Returns:
+	#   dictionary of counters (frames, crc_errors, framing_errors, oversized, pending), None if no framing is set
+	def serialFrameCounters(self):
+		if self.frameDecoder is None:
+			return None
+		return self.frameDecoder.counters()
 		
 
 		
@@ -327,29 +1125,186 @@ class PiGoBoard:
 	# *********************************
 	#       HIGH-LEVEL commands 
 	# *********************************
-	
+
+	# Flush changed port shadow registers to the expanders
+	# Changed ports are grouped per expander: if both ports of the expander have changed,
+	# A and B registers are written in a single sequential (auto-increment) transfer
+	# Arguments:
+	#   reg: register of port A (MCP23017_IODIRA or MCP23017_OLATA), port B register follows it
+	#   shadow: port shadow registers (4 bytes, see PIGO_EXPANDER_ADDR)
+	#   shadowPrev: last values written to the expanders, updated by this function
+	# Returns:
+	#   True if all writes were acknowledged, False otherwise
+	def flushPorts(self, reg, shadow, shadowPrev):
+		if self.libInitialized == False:
+			return False
+
+		with self.I2Clock:
+			result = True
+			for i in range(0, 2):
+				portA = 2 * i
+				portB = portA + 1
+				dirtyA = shadowPrev[portA] != shadow[portA]
+				dirtyB = shadowPrev[portB] != shadow[portB]
+
+				if dirtyA and dirtyB:
+					ack = self.writeRegisters(PiGoBoardData.PIGO_EXPANDER_ADDR[i], reg, [shadow[portA], shadow[portB]])
+				elif dirtyA:
+					ack = self.writeRegisters(PiGoBoardData.PIGO_EXPANDER_ADDR[i], reg, [shadow[portA]])
+				elif dirtyB:
+					ack = self.writeRegisters(PiGoBoardData.PIGO_EXPANDER_ADDR[i], reg + 1, [shadow[portB]])
+				else:
+					continue
+
+				if ack == False:
+					result = False
+
+				shadowPrev[portA] = shadow[portA]
+				shadowPrev[portB] = shadow[portB]
+
+			return result
+
+	# Start the expanders: load the shadow registers (see WarmStart argument of the constructor)
+	# and write the registers that differ, output latches first, so pins turned into outputs
+	# drive the right level at once
+	# Called on first external IO access, can be called earlier to start the expanders at a known time
+	# Arguments:
+	#   none
+	# Returns:
+	#   none
+	def startExpanders(self):
+		if self.libInitialized == False:
+			return
+
+		with self.I2Clock:
+			if self.expanderReady:
+				return
+			start = timer()
+			self.expanderReady = True
+			self.startShadow(self.warmStart, self.shadowFile)
+			self.refreshOstat()
+			self.refreshIOdir()
+			self.startupRecord('expanders', start)
+
+	# Load expander shadow registers at start (see WarmStart argument of the constructor)
+	# Arguments:
+	#   mode: PiGoBoardData.START_COLD, START_READBACK or START_SNAPSHOT
+	#   fileName: shadow snapshot file written by saveShadow(), None if there is none
+	# Returns:
+	#   none
+	def startShadow(self, mode, fileName):
+		if self.libInitialized == False:
+			return
+
+		snapshot = None
+		if fileName is not None:
+			snapshot = self.loadShadow(fileName)
+
+		if mode == PiGoBoardData.START_SNAPSHOT and snapshot is not None:
+			# Registers not known to be written when the snapshot was saved are written
+			self.portDirPrev[:] = snapshot['portDir']
+			self.portStatPrev[:] = snapshot['portStat']
+			self.applyShadow(snapshot)
+			return
+
+		if mode != PiGoBoardData.START_COLD:
+			# IODIRA/B and OLATA/B of both expanders in a single combined transfer
+			requests = []
+			for addr in PiGoBoardData.PIGO_EXPANDER_ADDR:
+				requests.append((addr, PiGoBoardData.MCP23017_IODIRA, 2))
+				requests.append((addr, PiGoBoardData.MCP23017_OLATA, 2))
+			result = self.readRegistersMulti(requests)
+			for i in range(0, 2):
+				iodir = result[2 * i]
+				olat = result[2 * i + 1]
+				if len(iodir) < 2 or len(olat) < 2:
+					# Expander did not respond, its registers are written
+					continue
+				self.portDirPrev[2 * i:2 * i + 2] = iodir
+				self.portStatPrev[2 * i:2 * i + 2] = olat
+				self.portDir[2 * i:2 * i + 2] = iodir
+				self.portStat[2 * i:2 * i + 2] = olat
+
+		if snapshot is not None:
+			self.applyShadow(snapshot)
+
+	# Set shadow registers to the known values of a snapshot
+	# Arguments:
+	#   snapshot: dictionary returned by loadShadow()
+	# Returns:
+	#   none
+	def applyShadow(self, snapshot):
+		for i in range(0, 4):
+			if snapshot['portDir'][i] is not None:
+				self.portDir[i] = snapshot['portDir'][i]
+			if snapshot['portStat'][i] is not None:
+				self.portStat[i] = snapshot['portStat'][i]
+
+	# Load shadow snapshot
+	# Arguments:
+	#   fileName: file written by saveShadow()
+	# Returns:
+	#   dictionary with portDir (IODIR) and portStat (OLAT) arrays, None for registers with unknown value,
+	#   None if the file cannot be read or is not valid
+	def loadShadow(self, fileName):
+		import json
+		try:
+			with open(fileName) as f:
+				snapshot = json.load(f)
+		except (IOError, OSError, ValueError):
+			return None
+
+		try:
+			for name in ('portDir', 'portStat'):
+				values = [None if value is None else int(value) & 0xFF for value in snapshot[name]]
+				if len(values) != 4:
+					return None
+				snapshot[name] = values
+		except (KeyError, TypeError, ValueError):
+			return None
+		return snapshot
+
+	# Save expander shadow registers, so a restarted program can continue without rewriting them
+	# (see WarmStart and ShadowFile arguments of the constructor)
+	# The values last written to the IODIR and OLAT registers are saved: changes not written yet
+	# (SetValues = 0, batch) are not in the expanders
+	# The file is replaced atomically, a program killed while saving leaves the previous snapshot
+	# Arguments:
+	#   fileName: snapshot file
+	# Returns:
+	#   none
+	def saveShadow(self, fileName):
+		if self.libInitialized == False:
+			return
+		if self.expanderReady == False:
+			self.startExpanders()
+
+		with self.I2Clock:
+			snapshot = {'portDir': list(self.portDirPrev), 'portStat': list(self.portStatPrev)}
+
+		import json
+		tempName = fileName + '.tmp'
+		with open(tempName, 'w') as f:
+			json.dump(snapshot, f)
+			f.flush()
+			os.fsync(f.fileno())
+		os.rename(tempName, fileName)
+
 	# Refresh extended IOs directions
 	# Arguments:
 	#   none
 	# Returns:
 	#   none
 	def refreshIOdir(self):
-		if self.libInitialized == False:
+		if self.libInitialized == False or self.batchState.depth > 0:
 			return
+		if self.expanderReady == False:
+			self.startExpanders()
 
-		# Refresh only the IO register that has changed
-		for i in range(0,4):
-			if self.portDirPrev[i] != self.portDir[i]:
-				#print("refreshing..." + str(i) + ": " + str(self.portDir[i]))
-				if i < 2:
-					self.I2CsetTargetAddress(0x20)
-				else:
-					self.I2CsetTargetAddress(0x24)
-				# Set IODIR register
-				if self.I2CWrite([0x01 * int(i % 2), self.portDir[i]]) == False:
-					print("Error writing to I2C")
-						
-			self.portDirPrev[i] = self.portDir[i];
+		with self.I2Clock:
+			# Refresh only the IODIR registers that have changed
+			if self.flushPorts(PiGoBoardData.MCP23017_IODIRA, self.portDir, self.portDirPrev) == False:
+				print("Error writing to I2C")
 
 	# Refresh extended IO - outputs' states
 	# Arguments:
@@ -357,24 +1312,17 @@ class PiGoBoard:
 	# Returns:
 	#   none
 	def refreshOstat(self):
-		if self.libInitialized == False:
+		if self.libInitialized == False or self.batchState.depth > 0:
 			return
+		if self.expanderReady == False:
+			self.startExpanders()
 
-		# Refresh only the IOLAT registers that have changed
-		for i in range(0,4):
-			if self.portStatPrev[i] != self.portStat[i]:
-				#print("refreshing..." + str(i))
-				if i < 2:
-					self.I2CsetTargetAddress(0x20)
-				else:
-					self.I2CsetTargetAddress(0x24)
-
-				# Set IOLAT register
-				self.I2CWrite([0x14 + 0x01 * int(i % 2), self.portStat[i]])
-							
-			self.portStatPrev[i] = self.portStat[i];
+		with self.I2Clock:
+			# Refresh only the IOLAT registers that have changed
+			self.flushPorts(PiGoBoardData.MCP23017_OLATA, self.portStat, self.portStatPrev)
 			
 	# Refresh extended IO - inputs' states
+	# The readings are stored in portIn, output latch shadow registers are not changed
 	# Arguments:
 	#   none
 	# Returns:
@@ -382,19 +1330,16 @@ class PiGoBoard:
 	def refreshIstat(self):
 		if self.libInitialized == False:
 			return
-
-		# Refresh all GPIO registers
-		self.I2CsetTargetAddress(0x20)
-		self.I2CWrite([0x12])
-		iostat = self.I2CRead(2)
-		self.portStat[0] = iostat[0]
-		self.portStat[1] = iostat[1]
-
-		self.I2CsetTargetAddress(0x24)
-		self.I2CWrite([0x12])
-		iostat = self.I2CRead(2)
-		self.portStat[2] = iostat[0]
-		self.portStat[3] = iostat[1]    
+		if self.expanderReady == False:
+			self.startExpanders()
+
+		with self.I2Clock:
+			# Refresh all GPIO registers, GPIOA and GPIOB of both expanders in one transfer
+			iostat = self.readGPIO([0, 1], PiGoBoardData.MCP23017_GPIOA, 2)
+			for i in range(0, 2):
+				if len(iostat[i]) == 2:
+					self.portIn[2 * i] = iostat[i][0]
+					self.portIn[2 * i + 1] = iostat[i][1]
 					
 
 	# ********************************************
@@ -410,12 +1355,23 @@ class PiGoBoard:
 	def RaspSetIOdir(self, raspIOpin, IODir):
 		if self.libInitialized == False:
 			return
-		
-		if IODir:
-			self.libObj.bcm2835_gpio_fsel(raspIOpin, PiGoBoardData.BCM2835_GPIO_FSEL_INPT)
-			self.libObj.bcm2835_gpio_set_pud(raspIOpin, PiGoBoardData.BCM2835_GPIO_PUD_UP)
-		else:
-			self.libObj.bcm2835_gpio_fsel(raspIOpin, PiGoBoardData.BCM2835_GPIO_FSEL_OUTP)
+
+		if self.batchState.depth > 0:
+			if IODir:
+				self.batchState.fsel[raspIOpin] = PiGoBoardData.BCM2835_GPIO_FSEL_INPT
+			else:
+				self.batchState.fsel[raspIOpin] = PiGoBoardData.BCM2835_GPIO_FSEL_OUTP
+			return
+
+		# Function select registers are shared by 10 pins and written with read-modify-write
+		with self.GPIOlock:
+			start = timer()
+			if IODir:
+				self.BCMgpioFsel(raspIOpin, PiGoBoardData.BCM2835_GPIO_FSEL_INPT)
+				self.BCMgpioSetPud(raspIOpin, PiGoBoardData.BCM2835_GPIO_PUD_UP)
+			else:
+				self.BCMgpioFsel(raspIOpin, PiGoBoardData.BCM2835_GPIO_FSEL_OUTP)
+			self.statsObj.gpio(start, True)
 
 	# Set Raspberry digital output state
 	# Arguments:
@@ -427,7 +1383,44 @@ class PiGoBoard:
 		if self.libInitialized == False:
 			return
 
-		self.libObj.bcm2835_gpio_write(raspIOpin, IOvalue)
+		# GPSET/GPCLR registers are written atomically, no locking is needed
+		start = timer()
+		if self.directIO is not None:
+			self.directIO.write(raspIOpin, IOvalue)
+		else:
+			self.BCMgpioWrite(raspIOpin, IOvalue)
+		self.statsObj.gpio(start, True)
+
+	# Set several Raspberry digital outputs
+	# Pins 0-31 are set and cleared with a single GPSET0 and GPCLR0 write each
+	# Arguments:
+	#   setMask: bit mask of the pins to set (bit N is Raspberry IO pin N)
+	#   clrMask: bit mask of the pins to clear
+	# Returns:
+	#   none
+	def RaspSetOutputs(self, setMask, clrMask):
+		if self.libInitialized == False:
+			return
+
+		start = timer()
+		if self.directIO is not None:
+			if setMask:
+				self.directIO.setMulti(setMask)
+			if clrMask:
+				self.directIO.clrMulti(clrMask)
+		elif self.GPIOmulti:
+			if setMask:
+				self.BCMgpioSetMulti(setMask)
+			if clrMask:
+				self.BCMgpioClrMulti(clrMask)
+		else:
+			# libBCM.so without bank functions
+			for pin in range(0, 32):
+				if setMask & (1 << pin):
+					self.BCMgpioWrite(pin, 1)
+				elif clrMask & (1 << pin):
+					self.BCMgpioWrite(pin, 0)
+		self.statsObj.gpio(start, True)
 
 	# Get Raspberry digital input state
 	# Arguments:
@@ -438,32 +1431,97 @@ class PiGoBoard:
 		if self.libInitialized == False:
 			return 0
 
-		return self.libObj.bcm2835_gpio_lev(raspIOpin)
-		
-
-	# ********************************************
-	# Buffered IO
-	# ********************************************    
+		start = timer()
+		if self.directIO is not None:
+			level = self.directIO.level(raspIOpin)
+		else:
+			level = self.BCMgpioLev(raspIOpin)
+		self.statsObj.gpio(start, False)
+		return level
 
-	# Set buffered IO direction
+	# Get Raspberry digital input states of pins 0-31 with a single GPLEV0 read
 	# Arguments:
-	#   IONr: Buffered IO pin (0-7)
-	#		IODir: Buffered IO direction (0 for output, 1 for input)
+	#   none
+	# Returns:
+	#   pin levels, bit N is the level of Raspberry IO pin N
+	#   (only the buffered IO pins are read if libBCM.so has no GPIO bank functions)
+	def RaspGetInputs(self):
+		if self.libInitialized == False:
+			return 0
+
+		start = timer()
+		if self.directIO is not None:
+			levels = self.directIO.levels()
+		elif self.GPIOmulti:
+			levels = self.BCMgpioLevMulti()
+		else:
+			levels = 0
+			for pin in self.IOpins:
+				if self.BCMgpioLev(pin):
+					levels |= 1 << pin
+		self.statsObj.gpio(start, False)
+		return levels & 0xFFFFFFFF
+
+	# Access GPIO and PWM registers directly through a memory mapping instead of libBCM.so
+	# Used by RaspSetOutput(s), RaspGetInput(s), PWMsetPeriod and PWMsetDuty (and the buffered IO
+	# functions built on them), other functions still use libBCM.so
+	# Arguments:
+	#   gpioFile: file mapped for the GPIO block (default: /dev/gpiomem)
+	#   pwmFile: file mapped for the PWM block, None to keep PWM on libBCM.so (default: /dev/mem, root only)
+	#   gpioOffset: offset of the GPIO block in gpioFile (default: 0 for /dev/gpiomem, physical address otherwise)
+	#   pwmOffset: offset of the PWM block in pwmFile (default: physical address)
+	# Returns:
+	#   True if at least the GPIO block was mapped, False otherwise
+	def enableDirectIO(self, gpioFile = '/dev/gpiomem', pwmFile = '/dev/mem', gpioOffset = None, pwmOffset = None):
+		if self.libInitialized == False:
+			return False
+
+		self.disableDirectIO()
+		try:
+			import PiGoMmap
+			self.directIO = PiGoMmap.DirectIO(gpioFile, pwmFile, gpioOffset, pwmOffset)
+		except (IOError, OSError, ValueError):
+			return False
+		return True
+
+	# Go back to register access through libBCM.so
+	# Arguments:
+	#   none
+	# Returns:
+	#   none
+	def disableDirectIO(self):
+		if self.directIO is not None:
+			directIO = self.directIO
+			self.directIO = None
+			directIO.close()
+
+
+	# ********************************************
+	# Buffered IO
+	# ********************************************    
+
+	# Set buffered IO direction
+	# Arguments:
+	#   IONr: Buffered IO pin (0-7)
+	#		IODir: Buffered IO direction (0 for output, 1 for input)
 	#		SetValues: if 0, no I2C operation is executed (default: 1)
 	# Returns:
 	#   none
 	def setIOdir(self, IONr, IODir, SetValues = 1):
 		if self.libInitialized == False:
 			return
+		if self.expanderReady == False:
+			self.startExpanders()
 
-		self.portDir[0] &= ~(1 << int(IONr % 8))
-		if IODir:
-				self.portStat[0] |= (1 << int(IONr % 8))
-		else:
-				self.portStat[0] &= ~(1 << int(IONr % 8))            
-		if SetValues:
-				self.refreshIOdir()
-				self.refreshOstat()
+		with self.I2Clock:
+			self.portDir[0] &= ~(1 << int(IONr % 8))
+			if IODir:
+					self.portStat[0] |= (1 << int(IONr % 8))
+			else:
+					self.portStat[0] &= ~(1 << int(IONr % 8))
+			if SetValues:
+					self.refreshIOdir()
+					self.refreshOstat()
 
 		self.RaspSetIOdir(self.IOpins[IONr], IODir) 
 
@@ -490,6 +1548,16 @@ class PiGoBoard:
 	def setIO(self, IONr, IOvalue):
 		if self.libInitialized == False:
 			return
+		state = self.batchState
+		if state.depth > 0:
+			mask = 1 << self.IOpins[IONr]
+			if IOvalue:
+				state.setMask |= mask
+				state.clrMask &= ~mask
+			else:
+				state.clrMask |= mask
+				state.setMask &= ~mask
+			return
 		self.RaspSetOutput(self.IOpins[IONr], IOvalue)
 
 	# Return buffered IO value
@@ -502,6 +1570,97 @@ class PiGoBoard:
 			return 0
 		return self.RaspGetInput(self.IOpins[IONr])
 
+	# Set several buffered IO states
+	# All pins are changed with one GPSET0 and one GPCLR0 write
+	# Arguments:
+	#   mask: bit mask of the buffered IO pins to change (bit N is buffered IO N)
+	#   values: new pin states (bit N is the state of buffered IO N)
+	# Returns:
+	#   none
+	def setIOs(self, mask, values):
+		if self.libInitialized == False:
+			return
+		setMask = self.IObankMasks[mask & values & 0xFF]
+		clrMask = self.IObankMasks[mask & ~values & 0xFF]
+		state = self.batchState
+		if state.depth > 0:
+			state.setMask = (state.setMask & ~clrMask) | setMask
+			state.clrMask = (state.clrMask & ~setMask) | clrMask
+			return
+		self.RaspSetOutputs(setMask, clrMask)
+
+	# Return all buffered IO values
+	# All pins are read with a single GPLEV0 read
+	# Arguments:
+	#   none
+	# Returns:
+	#   8-bit word of pin states (bit N is the state of buffered IO N)
+	def getIOs(self):
+		if self.libInitialized == False:
+			return 0
+		levels = self.RaspGetInputs()
+		values = 0
+		for bit, pinMask in self.IOpinMasks:
+			if levels & pinMask:
+				values |= bit
+		return values
+
+
+	# Register callback for edges on buffered input
+	# Edges are detected by the kernel and delivered by a watcher thread, no polling is done
+	# Arguments:
+	#   IONr: Buffered IO pin (0-7), must be set as input
+	#   edge: PiGoBoardData.EDGE_RISING, EDGE_FALLING or EDGE_BOTH
+	#   callback: function called as callback(IONr, level, timestampNs) from the watcher thread,
+	#             None to only record the edges for waitForEdge()
+	#             timestampNs is monotonic time of the edge in nanoseconds
+	# Returns:
+	#   none
+	def onEdge(self, IONr, edge, callback = None):
+		if self.libInitialized == False:
+			return
+
+		if self.edgeWatcher is None:
+			import PiGoEvents
+			self.edgeWatcher = PiGoEvents.EdgeWatcher()
+		source = self.edgeSourceFactory(self.IOpins[IONr], edge)
+		self.edgeWatcher.add(IONr, source, edge, callback)
+
+	# Stop edge detection on buffered input
+	# Arguments:
+	#   IONr: Buffered IO pin (0-7)
+	# Returns:
+	#   none
+	def removeEdge(self, IONr):
+		if self.edgeWatcher is not None:
+			self.edgeWatcher.remove(IONr)
+
+	# Wait for edge on buffered inputs
+	# Arguments:
+	#   timeout: timeout in seconds, None to wait forever
+	#   IONr: Buffered IO pin (0-7) to wait for, None for any pin registered with onEdge()
+	#         The pin is registered for both edges if it was not registered before
+	# Returns:
+	#   (IONr, level, timestampNs) tuple, None on timeout
+	def waitForEdge(self, timeout = None, IONr = None):
+		if self.libInitialized == False:
+			return None
+
+		if IONr is not None and (self.edgeWatcher is None or not self.edgeWatcher.watching(IONr)):
+			self.onEdge(IONr, PiGoBoardData.EDGE_BOTH)
+		if self.edgeWatcher is None:
+			return None
+		return self.edgeWatcher.wait(timeout, IONr)
+
+	# Stop edge detection on all buffered inputs and the watcher thread
+	# Arguments:
+	#   none
+	# Returns:
+	#   none
+	def stopEdges(self):
+		if self.edgeWatcher is not None:
+			self.edgeWatcher.stop()
+			self.edgeWatcher = None
 
 	# ********************************************
 	# External IO
@@ -517,12 +1676,15 @@ class PiGoBoard:
 	def setExtIOdir(self, ExtPinNr, PinDir, SetValues = 1):
 		if self.libInitialized == False:
 			return
-		if PinDir:
-			self.portDir[1 + 2 * int(ExtPinNr / 8)] |= (1 << int(ExtPinNr % 8))
-		else:
-			self.portDir[1 + 2 * int(ExtPinNr / 8)] &= ~(1 << int(ExtPinNr % 8))
-		if SetValues:
-			self.refreshIOdir()
+		if self.expanderReady == False:
+			self.startExpanders()
+		with self.I2Clock:
+			if PinDir:
+				self.portDir[1 + 2 * int(ExtPinNr / 8)] |= (1 << int(ExtPinNr % 8))
+			else:
+				self.portDir[1 + 2 * int(ExtPinNr / 8)] &= ~(1 << int(ExtPinNr % 8))
+			if SetValues:
+				self.refreshIOdir()
 
 	# Return external IO direction   
 	# Arguments:
@@ -532,6 +1694,8 @@ class PiGoBoard:
 	def getExtIOdir(self, ExtPinNr):
 		if self.libInitialized == False:
 			return 0
+		if self.expanderReady == False:
+			self.startExpanders()
 			
 		if self.portDir[1 + 2 * int(ExtPinNr / 8)] & (1 << int(ExtPinNr % 8)):
 			return 1
@@ -548,37 +1712,464 @@ class PiGoBoard:
 	def setExtIO(self, ExtPinNr, PinValue, SetValues = 1):
 		if self.libInitialized == False:
 			return
+		if self.expanderReady == False:
+			self.startExpanders()
 			
-		if PinValue:
-			self.portStat[1 + 2 * int(ExtPinNr / 8)] |= (1 << int(ExtPinNr % 8))
-		else:
-			self.portStat[1 + 2 * int(ExtPinNr / 8)] &= ~(1 << int(ExtPinNr % 8))
-
-		self.refreshOstat()
+		with self.I2Clock:
+			if PinValue:
+				self.portStat[1 + 2 * int(ExtPinNr / 8)] |= (1 << int(ExtPinNr % 8))
+			else:
+				self.portStat[1 + 2 * int(ExtPinNr / 8)] &= ~(1 << int(ExtPinNr % 8))
+			if SetValues:
+				self.refreshOstat()
 
 	# Get external IO value
 	# Arguments:
 	#   ExtPinNr: External IO number (0-15)
 	#		ReadValues: if 0, no I2C refresh operation is executed (default: 1)
 	# Returns:
-	#   State of the input pin
+	#   State of the pin, with ReadValues 0 the last read state of an input or the output latch value of an output
 	def getExtIO(self, ExtPinNr, ReadValues = 1):
 		if self.libInitialized == False:
 			return 0
-		if ReadValues == 1:
-			self.refreshIstat()
-		
-		if self.portStat[1 + 2 * int(ExtPinNr / 8)] & (1 << int(ExtPinNr % 8)):
-			return 1
+		if self.expanderReady == False:
+			self.startExpanders()
+		with self.I2Clock:
+			port = 1 + 2 * int(ExtPinNr / 8)
+			if ReadValues == 1:
+				# Only GPIOB register of the expander holding the pin has to be read
+				iostat = self.readGPIO([int(port / 2)], PiGoBoardData.MCP23017_GPIOB, 1)[0]
+				if len(iostat) == 1:
+					self.portIn[port] = iostat[0]
+				levels = self.portIn[port]
+			else:
+				levels = self.portLevels(port)
+
+			if levels & (1 << int(ExtPinNr % 8)):
+				return 1
+			else:
+				return 0
+
+	# Read GPIO registers of the expanders
+	# Reading GPIO clears the pending interrupt of an expander. If interrupt-on-change is enabled on it, INTF and
+	# INTCAP registers, which precede GPIO, are read in the same transfer and their events are kept for pollExtEvents()
+	# Arguments:
+	#   expanders: array of expander indexes (see PIGO_EXPANDER_ADDR)
+	#   reg: first GPIO register (MCP23017_GPIOA or MCP23017_GPIOB)
+	#   numBytes: number of GPIO registers
+	# Returns:
+	#   Array of register value arrays (one per expander), empty array for expanders that did not respond
+	def readGPIO(self, expanders, reg, numBytes):
+		requests = []
+		for i in expanders:
+			addr = PiGoBoardData.PIGO_EXPANDER_ADDR[i]
+			if self.intEnable[2 * i] or self.intEnable[2 * i + 1]:
+				requests.append((addr, PiGoBoardData.MCP23017_INTFA, reg + numBytes - PiGoBoardData.MCP23017_INTFA))
+			else:
+				requests.append((addr, reg, numBytes))
+
+		with self.I2Clock:
+			result = self.readRegistersMulti(requests)
+			for n in range(0, len(expanders)):
+				if requests[n][1] != PiGoBoardData.MCP23017_INTFA:
+					continue
+				data = result[n]
+				if len(data) == requests[n][2]:
+					import PiGoEvents
+					self.captureExtEvents(expanders[n], data, PiGoEvents.monotonicNs())
+					data = data[reg - PiGoBoardData.MCP23017_INTFA:]
+				else:
+					data = []
+				result[n] = data
+			return result
+
+	# Expander port state known without reading it: last read state of the inputs, output latch values of the outputs
+	# Arguments:
+	#   port: port index (see PIGO_EXPANDER_ADDR)
+	# Returns:
+	#   8-bit port state
+	def portLevels(self, port):
+		inputs = self.portDir[port]
+		return (self.portIn[port] & inputs) | (self.portStat[port] & ~inputs & 0xFF)
+
+	# Set several external IO values
+	# Arguments:
+	#   mask: bit mask of the external IOs to change (bit N is external IO N)
+	#   values: new output states (bit N is the state of external IO N)
+	#   SetValues: if 0, no I2C refresh operation is executed (default: 1)
+	# Returns:
+	#   none
+	def setExtIOs(self, mask, values, SetValues = 1):
+		if self.libInitialized == False:
+			return
+		if self.expanderReady == False:
+			self.startExpanders()
+		with self.I2Clock:
+			for i in range(0, 2):
+				portMask = (mask >> (8 * i)) & 0xFF
+				portValues = (values >> (8 * i)) & 0xFF
+				self.portStat[1 + 2 * i] = (self.portStat[1 + 2 * i] & ~portMask) | (portValues & portMask)
+			if SetValues:
+				self.refreshOstat()
+
+	# Get all external IO values
+	# GPIOB registers of both expanders are read in a single transfer
+	# Arguments:
+	#   ReadValues: if 0, no I2C refresh operation is executed (default: 1)
+	# Returns:
+	#   16-bit word of pin states (bit N is the state of external IO N), with ReadValues 0 the last read
+	#   states of the inputs and the output latch values of the outputs
+	def getExtIOs(self, ReadValues = 1):
+		if self.libInitialized == False:
+			return 0
+		if self.expanderReady == False:
+			self.startExpanders()
+		with self.I2Clock:
+			if ReadValues == 1:
+				iostat = self.readGPIO([0, 1], PiGoBoardData.MCP23017_GPIOB, 1)
+				for i in range(0, 2):
+					if len(iostat[i]) == 1:
+						self.portIn[1 + 2 * i] = iostat[i][0]
+				return self.portIn[1] | (self.portIn[3] << 8)
+
+			return self.portLevels(1) | (self.portLevels(3) << 8)
+
+
+	# ********************************************
+	# External IO interrupt-on-change
+	# ********************************************
+
+	# Configure interrupt-on-change of external IO
+	# Arguments:
+	#   ExtPinNr: External IO number (0-15), should be set as input
+	#   enable: 1 to enable the interrupt, 0 to disable it
+	#   compare: None for interrupt on every change, 0 or 1 for interrupt while the pin differs from this value
+	#   SetValues: if 0, no I2C refresh operation is executed (default: 1)
+	# Returns:
+	#   none
+	def setExtIOinterrupt(self, ExtPinNr, enable, compare = None, SetValues = 1):
+		if self.libInitialized == False:
+			return
+		if self.expanderReady == False:
+			self.startExpanders()
+
+		with self.I2Clock:
+			port = 1 + 2 * int(ExtPinNr / 8)
+			mask = 1 << int(ExtPinNr % 8)
+			if enable:
+				self.intEnable[port] |= mask
+			else:
+				self.intEnable[port] &= ~mask
+			if compare is None:
+				self.intControl[port] &= ~mask
+			else:
+				self.intControl[port] |= mask
+				if compare:
+					self.intDefval[port] |= mask
+				else:
+					self.intDefval[port] &= ~mask
+
+			if SetValues:
+				self.refreshInterrupts()
+
+	# Write changed interrupt configuration to the expanders
+	# GPINTENA..INTCONB registers of each changed expander are written in a single sequential transfer
+	# Arguments:
+	#   none
+	# Returns:
+	#   none
+	def refreshInterrupts(self):
+		if self.libInitialized == False:
+			return
+		if self.batchState.depth > 0:
+			self.batchState.interrupts = True
+			return
+
+		with self.I2Clock:
+			config = [self.intEnable, self.intDefval, self.intControl]
+			for i in range(0, 2):
+				data = []
+				for registers in config:
+					data += [registers[2 * i], registers[2 * i + 1]]
+				if data == self.intConfigPrev[i]:
+					continue
+
+				addr = PiGoBoardData.PIGO_EXPANDER_ADDR[i]
+				if self.intConfigPrev[i] is None:
+					# Mirror INTA/INTB and use open-drain outputs, so INT pins of both expanders can be wired together
+					self.writeRegisters(addr, PiGoBoardData.MCP23017_IOCON, [PiGoBoardData.MCP23017_IOCON_MIRROR | PiGoBoardData.MCP23017_IOCON_ODR])
+				if self.writeRegisters(addr, PiGoBoardData.MCP23017_GPINTENA, data) == False:
+					print("Error writing to I2C")
+				self.intConfigPrev[i] = data
+
+	# Register callback for external IO changes
+	# Arguments:
+	#   ExtPinNr: External IO number (0-15)
+	#   callback: function called as callback(ExtPinNr, level, timestampNs), None to remove the callback
+	#   edge: PiGoBoardData.EDGE_RISING, EDGE_FALLING or EDGE_BOTH (default)
+	# Returns:
+	#   none
+	def onExtEdge(self, ExtPinNr, callback, edge = PiGoBoardData.EDGE_BOTH):
+		if callback is None:
+			self.extEdgeCallbacks.pop(ExtPinNr, None)
 		else:
-			return 0				
-			
-			
+			self.extEdgeCallbacks[ExtPinNr] = (edge, callback)
+
+	# Poll interrupt flags of the expanders
+	# INTF and INTCAP registers of both expanders are read in a single transfer, reading INTCAP
+	# clears the interrupt. Pin level reported is the level captured at the time of the interrupt.
+	# Events captured by external IO reads since the last poll (see readGPIO()) are returned first,
+	# with the time of that read, at most 256 of them are kept.
+	# Arguments:
+	#   none
+	# Returns:
+	#   array of (ExtPinNr, level, timestampNs) events, callbacks registered with onExtEdge are called for them
+	def pollExtEvents(self):
+		if self.libInitialized == False:
+			return []
+
+		import PiGoEvents
+		timestamp = PiGoEvents.monotonicNs()
+		with self.I2Clock:
+			addr = PiGoBoardData.PIGO_EXPANDER_ADDR
+			result = self.readRegistersMulti([(addr[0], PiGoBoardData.MCP23017_INTFA, 4),
+				(addr[1], PiGoBoardData.MCP23017_INTFA, 4)])
+			for i in range(0, 2):
+				if len(result[i]) == 4:
+					self.captureExtEvents(i, result[i], timestamp)
+			events = list(self.extEventsPending)
+			self.extEventsPending.clear()
+
+		for ExtPinNr, level, timestamp in events:
+			entry = self.extEdgeCallbacks.get(ExtPinNr)
+			if entry is not None and PiGoEvents.edgeMatches(entry[0], level):
+				entry[1](ExtPinNr, level, timestamp)
+
+		return events
+
+	# Keep interrupt events of an expander for pollExtEvents()
+	# Arguments:
+	#   expander: expander index (see PIGO_EXPANDER_ADDR)
+	#   registers: INTFA, INTFB, INTCAPA and INTCAPB register values
+	#   timestamp: monotonic time of the read in nanoseconds
+	# Returns:
+	#   none
+	def captureExtEvents(self, expander, registers, timestamp):
+		# External IOs are on port B: INTFB and INTCAPB
+		flags = registers[1]
+		captured = registers[3]
+		for bit in range(0, 8):
+			if flags & (1 << bit):
+				self.extEventsPending.append((8 * expander + bit, (captured >> bit) & 1, timestamp))
+
+	# Watch expander INT outputs on Raspberry Pi GPIO
+	# When the INT line is asserted (low), interrupt flags are read by the edge watcher thread
+	# and the callbacks registered with onExtEdge are called
+	# Arguments:
+	#   raspIOpin: Raspberry IO pin index the INT outputs of the expanders are connected to, None to stop watching
+	# Returns:
+	#   none
+	def watchExtInterrupts(self, raspIOpin):
+		if self.libInitialized == False:
+			return
+
+		if self.edgeWatcher is None:
+			if raspIOpin is None:
+				return
+			import PiGoEvents
+			self.edgeWatcher = PiGoEvents.EdgeWatcher()
+		if raspIOpin is None:
+			self.edgeWatcher.remove('extint')
+			return
+
+		# INT outputs are open-drain, enable pull-up
+		self.RaspSetIOdir(raspIOpin, 1)
+		source = self.edgeSourceFactory(raspIOpin, PiGoBoardData.EDGE_FALLING)
+		self.edgeWatcher.add('extint', source, PiGoBoardData.EDGE_FALLING, lambda key, level, timestamp: self.pollExtEvents(), False)
+		# Clear interrupts pending before the line was watched
+		self.pollExtEvents()
+
+	# ********************************************
+	# Bus statistics
+	# ********************************************
+
+	# Get bus statistics
+	# Arguments:
+	#   none
+	# Returns:
+	#   dictionary of per-bus counters ('i2c', 'spi', 'gpio', 'pwm', 'serial'), each with a latency histogram
+	#   i2c: transactions, addresses (transactions per slave address), address_switches, bytes_written,
+	#        bytes_read, write_errors
+	#   spi: transfers, bytes
+	#   gpio: reads, writes
+	#   pwm: writes
+	#   serial: bytes_out, bytes_in
+	def stats(self):
+		return self.statsObj.snapshot()
+
+	# Reset bus statistics
+	# Arguments:
+	#   none
+	# Returns:
+	#   none
+	def statsReset(self):
+		self.statsObj.reset()
+
+	# Get bus statistics since an earlier snapshot
+	# Arguments:
+	#   snapshot: statistics returned by stats()
+	# Returns:
+	#   statistics counted from the snapshot until now
+	def statsDelta(self, snapshot):
+		return PiGoStats.delta(snapshot, self.statsObj.snapshot())
+
+	# ********************************************
+	# Bus arbitration
+	# ********************************************
+
+	# Get bus transaction
+	# Operations executed inside the transaction ("with board.busTransaction(['i2c', 'spi']): ...")
+	# are not interleaved with operations of other threads on the same buses. All buses used by
+	# the transaction must be listed.
+	# Arguments:
+	#   buses: bus name ('i2c', 'spi' or 'gpio') or list of bus names
+	#   priority: PiGoArbiter.PRIORITY_LOW, PRIORITY_NORMAL (default) or PRIORITY_HIGH,
+	#             waiting transactions with higher priority get the bus first
+	# Returns:
+	#   transaction object (context manager)
+	def busTransaction(self, buses, priority = PiGoArbiter.PRIORITY_NORMAL):
+		return self.arbiter.transaction(buses, priority)
+
+	# ********************************************
+	# Deferred batch of pin updates
+	# ********************************************
+
+	# Get batch context
+	# setExtIO, setExtIOdir, setExtIOinterrupt, setIOdir, setIO and ModuleADDA.setDA calls inside
+	# "with board.batch(): ..." only update the shadow registers. When the outermost batch ends,
+	# the changed expander registers are written (A and B ports of an expander in a single transfer)
+	# and buffered outputs are set and cleared with one write per GPIO bank. Buses are locked for
+	# the whole batch.
+	# Every thread has its own batch: calls of other threads are not deferred. Their I2C, SPI, PWM and
+	# pin function (setIOdir, RaspSetIOdir) operations wait for the end of the batch. Their buffered output
+	# writes (setIO, setIOs, RaspSetOutput(s)) and pin reads take no lock and happen at once, in the middle
+	# of the batch. Expander and buffered IO chip selects of SPI transfers (ModuleADDA conversions,
+	# ADDAScanList, SPIstream()) cannot be asserted inside a batch, RuntimeError is raised.
+	# Arguments:
+	#   none
+	# Returns:
+	#   batch object (context manager)
+	def batch(self):
+		return self.batchObj
+
+	# Defer operation until the end of the batch
+	# Arguments:
+	#   key: operation key, a later operation with the same key replaces the earlier one
+	#   func: function to be called at the end of the batch
+	#   args: function arguments
+	# Returns:
+	#   True if the operation was deferred, False if no batch is active and it should be executed now
+	def batchDefer(self, key, func, *args):
+		state = self.batchState
+		if state.depth == 0:
+			return False
+		state.deferred.pop(key, None)
+		state.deferred[key] = (func, args)
+		return True
+
+	# Write all deferred changes
+	# Order of the writes keeps the buffers from driving against the Raspberry Pi outputs: pins turning
+	# into inputs are switched first, then buffer directions and output latches are written, then
+	# buffered outputs are set and only then the pins turning into outputs are switched
+	# Arguments:
+	#   none
+	# Returns:
+	#   none
+	def batchFlush(self):
+		state = self.batchState
+		fsel = state.fsel
+		state.fsel = {}
+		for pin in fsel:
+			if fsel[pin] == PiGoBoardData.BCM2835_GPIO_FSEL_INPT:
+				self.RaspSetIOdir(pin, 1)
+
+		# Latches first, so new outputs start with the requested values
+		self.refreshOstat()
+		self.refreshIOdir()
+		if state.interrupts:
+			state.interrupts = False
+			self.refreshInterrupts()
+
+		if state.setMask or state.clrMask:
+			setMask = state.setMask
+			clrMask = state.clrMask
+			state.setMask = 0
+			state.clrMask = 0
+			self.RaspSetOutputs(setMask, clrMask)
+
+		with self.GPIOlock:
+			for pin in fsel:
+				if fsel[pin] != PiGoBoardData.BCM2835_GPIO_FSEL_INPT:
+					start = timer()
+					self.BCMgpioFsel(pin, fsel[pin])
+					self.statsObj.gpio(start, True)
+
+		deferred = state.deferred
+		state.deferred = collections.OrderedDict()
+		for func, args in deferred.values():
+			func(*args)
+
+	# Record duration of a startup phase, only the first start of each subsystem is recorded
+	# Arguments:
+	#   name: startup phase
+	#   start: timer() value at the start of the phase
+	# Returns:
+	#   none
+	def startupRecord(self, name, start):
+		if name not in self.startupTimes:
+			self.startupTimes[name] = timer() - start
+
+	# Get startup timing report
+	# Arguments:
+	#   none
+	# Returns:
+	#   ordered dictionary of startup phase durations in seconds: library (loading libBCM.so and mapping
+	#   the peripherals), board (whole constructor, including library), expanders, spi, pwm and serial
+	#   (first start of each subsystem, missing if it was not started yet)
+	def startupReport(self):
+		return collections.OrderedDict(self.startupTimes)
+
+	# Bind the library functions used by the IO, PWM, SPI and I2C functions
+	# Function pointers are looked up once and kept as board attributes, so the hot paths call
+	# them directly. The prototypes of libBCM.so functions are declared by PiGoBCM.load().
+	# Arguments:
+	#   none
+	# Returns:
+	#   none
+	def bindLibrary(self):
+		libObj = self.libObj
+
+		self.BCMgpioFsel = libObj.bcm2835_gpio_fsel
+		self.BCMgpioSetPud = libObj.bcm2835_gpio_set_pud
+		self.BCMgpioWrite = libObj.bcm2835_gpio_write
+		self.BCMgpioLev = libObj.bcm2835_gpio_lev
+		self.BCMgpioSetMulti = getattr(libObj, 'bcm2835_gpio_set_multi', None)
+		self.BCMgpioClrMulti = getattr(libObj, 'bcm2835_gpio_clr_multi', None)
+		self.BCMgpioLevMulti = getattr(libObj, 'bcm2835_gpio_lev_multi', None)
+		self.BCMspiTransfern = libObj.bcm2835_spi_transfern
+		self.BCMspiTransfernPart = getattr(libObj, 'bcm2835_spi_transfernFIFO_part', None)
+		self.BCMpwmSetRange = libObj.bcm2835_pwm0_setRange
+		self.BCMpwmSetData = libObj.bcm2835_pwm0_setData
+		self.BCMi2cSetAddr = libObj.bcm2835_i2c_setAddr
+		self.BCMi2cWrite = libObj.bcm2835_i2c_write
+		self.BCMi2cRead = libObj.bcm2835_i2c_read
+		self.BCMdelay = libObj.bcm2835_delay
+
 	def delay(self, time_ms):
 		if self.libInitialized == False:
 			return 0
 
-		self.libObj.bcm2835_delay(time_ms);
+		self.BCMdelay(time_ms)
 		
 		
 	def TestSPI(self):
@@ -616,29 +2207,80 @@ class PiGoBoard:
 	# Initialize PiGo library class
 	# Arguments:
 	#   RPi_Rev: Raspberry Pi board revision
-	#		TestMode: If set to 1, the library is run in test mode and no hardware is accessed
+	#		TestMode: If set to 1, the library is run in test mode on the simulated hardware (PiGoSim) and no hardware is accessed
+	#   Backend: hardware backend object used instead of libBCM.so (default: None)
+	#       Backend implements bcm2835_* functions used by this library, openI2Cdevice(bus, addr)
+	#       returning an I2CDevice-like object, openSerial(port, baud, ...) returning a pySerial-like object
+	#       and openEdgeSource(pin, edge) returning a PiGoEvents.SysfsEdgeSource-like object
+	#   LibraryPath: path of libBCM.so (default: PIGO_LIBBCM environment variable or libBCM.so from the library search path)
+	#   WarmStart: expander start mode (see PiGoBoardData.START_*)
+	#       START_COLD (default): all external IOs are set to inputs and output latches are cleared
+	#       START_READBACK: IODIR and OLAT registers are read back from the expanders, so outputs already
+	#         driving hardware keep their state. If ShadowFile is given, its state is applied and only the
+	#         registers that differ from the read back values are written
+	#       START_SNAPSHOT: the state from ShadowFile is assumed to be in the expanders and nothing is written
+	#         (the expanders must not have been reset since the snapshot was saved), falls back to START_READBACK
+	#         if the snapshot cannot be loaded
+	#   ShadowFile: shadow snapshot file written by saveShadow() (default: None)
+	#   LazyInit: if True (default), expanders, SPI, PWM and serial port are started on first use,
+	#       if False, expanders are started by the constructor
+	#   CoreClock: core clock in Hz the SPI clock is divided from (default: None, the highest core clock of the
+	#       SoC found in the device tree, see PiGoMmap.coreClock). Set it when core_freq is raised in config.txt
 	# Returns:
 	#   none
-	def __init__(self, RPi_Rev = 1, TestMode = 0):
+	def __init__(self, RPi_Rev = 1, TestMode = 0, Backend = None, LibraryPath = None,
+							WarmStart = PiGoBoardData.START_COLD, ShadowFile = None, LazyInit = True,
+							CoreClock = None):
+		boardStart = timer()
 		self.libInitialized = False
-		
+
+		# Startup phase durations (see startupReport())
+		self.startupTimes = collections.OrderedDict()
+
+		# Bus statistics
+		self.statsObj = PiGoStats.BoardStats()
+		self.I2Caddr = None
+
+		# Per-bus locks
+		self.arbiter = PiGoArbiter.BusArbiter()
+		self.I2Clock = self.arbiter.transaction('i2c')
+		self.SPIlock = self.arbiter.transaction('spi')
+		self.GPIOlock = self.arbiter.transaction('gpio')
+
 		self.TEST_MODE = TestMode
+
+		if Backend is None and self.TEST_MODE == 1:
+			import PiGoSim
+			Backend = PiGoSim.SimBackend()
+
+		if Backend is not None:
+			self.libObj = Backend
+			self.I2CdeviceFactory = Backend.openI2Cdevice
+			self.serialFactory = Backend.openSerial
+			self.edgeSourceFactory = Backend.openEdgeSource
+		else:
+			self.I2CdeviceFactory = I2CDevice
+			self.serialFactory = openSerial
+			self.edgeSourceFactory = openEdgeSource
 				
-		if self.TEST_MODE == 0:
-			# Try and load the libBCM.so shared library for communication with the peripherals
-			try:
-				self.libObj = cdll.LoadLibrary("libBCM.so")
-				#print("PiGo library loaded succesfully!")
-			except OSError:
-				# The library was not found - raise an error
-				raise OSError("ERROR: PiExp library not found!\nHint: Please check that you have successfully installed the PiExp library!")
-				return
+		if self.TEST_MODE == 0 or Backend is not None:
+			start = timer()
+			if Backend is None:
+				# Try and load the libBCM.so shared library for communication with the peripherals
+				try:
+					self.libObj = PiGoBCM.load(LibraryPath)
+					#print("PiGo library loaded succesfully!")
+				except OSError:
+					# The library was not found - raise an error
+					raise OSError("ERROR: PiExp library not found!\nHint: Please check that you have successfully installed the PiExp library!")
+					return
 
 			# If library was found and loaded, continue and initialize the memory mapping
 			if RPi_Rev == 1:
 				i2cBus = 0
 			else:
 				i2cBus = 1
+			self.i2cBus = i2cBus
 				
 			if self.libObj.bcm2835_add_init(i2cBus) == 0:
 				# Memory mapping was not successfull - apparently user has no right to access the peripherals
@@ -646,18 +2288,80 @@ class PiGoBoard:
 				return
 			else:
 				self.libInitialized = True
+			self.startupRecord('library', start)
+
+			# GPIO bank functions are missing in libBCM.so builds older than this library
+			self.GPIOmulti = hasattr(self.libObj, 'bcm2835_gpio_set_multi')
+
+			self.bindLibrary()
 
 		# Serial connection (UART) has not yet been initialized
 		self.serObj = None
+		# Background serial reader (see serialStartReader())
+		self.serialReader = None
+		# Serial port frame decoder (see serialSetFraming())
+		self.frameDecoder = None
+
+		# Edge watcher thread is started on first onEdge() call
+		self.edgeWatcher = None
+
+		# External IO interrupt-on-change (GPINTEN, DEFVAL and INTCON shadow registers)
+		self.intEnable = [0, 0, 0, 0]
+		self.intDefval = [0, 0, 0, 0]
+		self.intControl = [0, 0, 0, 0]
+		self.intConfigPrev = [None, None]
+		self.extEdgeCallbacks = {}
+		# Events captured by reads of the GPIO registers, not returned by pollExtEvents() yet
+		self.extEventsPending = collections.deque(maxlen = 256)
+
+		# Preallocated SPI transfer buffer
+		self.SPIbuffer = bytearray(256)
+		self.SPIbufferC = (c_ubyte * len(self.SPIbuffer)).from_buffer(self.SPIbuffer)
+
+		# I2C connection pool: one device handle per slave address
+		self.I2Cdevices = {}
+		# Combined I2C_RDWR register reads: 2 - several devices per transfer, 1 - single device only, 0 - not supported
+		self.I2CcombinedReads = 2
+
+		# Memory-mapped GPIO and PWM registers (see enableDirectIO())
+		self.directIO = None
+
+		# Deferred batch of pin updates (see batch()), every thread has its own batch state
+		self.batchState = BoardBatchState()
+		self.batchObj = BoardBatch(self)
 		
 		# Initialize IO drivers
 		self.portDir = [ 0xFF, 0xFF, 0xFF, 0xFF]
 		self.portStat = [ 0, 0, 0, 0]
-
-		self.portDirPrev = [1, 1, 1, 1]
-		self.portStatPrev = [1, 1, 1, 1]
-		self.refreshIOdir()
-		self.refreshOstat()	
+		# Last GPIO register readings, kept apart from the output latch shadow registers (portStat)
+		self.portIn = [ 0, 0, 0, 0]
+
+		# Unknown expander state, all registers are written
+		self.portDirPrev = [None, None, None, None]
+		self.portStatPrev = [None, None, None, None]
+
+		# Expanders are started on first external IO access (see startExpanders()),
+		# SPI and PWM on first transfer or setting
+		self.expanderReady = False
+		self.warmStart = WarmStart
+		self.shadowFile = ShadowFile
+		# Core clock the SPI clock is divided from
+		if CoreClock is None:
+			import PiGoMmap
+			CoreClock = PiGoMmap.coreClock()
+		self.coreClock = CoreClock
+		self.SPIready = False
+		self.PWMready = False
+
+		# Selected SPI chip select, and the one used while modules drive their chip select themselves
+		# (native chip selects are disabled as soon as a module uses one, see NativeChipSelect)
+		self.SPIcs = PiGoBoardData.BCM2835_SPI_CS0
+		self.SPIidleCS = PiGoBoardData.BCM2835_SPI_CS0
+
+		# Registered SPI device profiles, active profile and live SPI settings (see SPIuseProfile())
+		self.SPIprofiles = {}
+		self.SPIprofile = None
+		self.SPIsettings = {'mode': None, 'divider': None, 'bitOrder': None}
 		
 		self.piRev = RPi_Rev		
 
@@ -665,7 +2369,124 @@ class PiGoBoard:
 			self.IOpins = [18, 23, 24, 25, 4, 17, 21, 22]
 		else:
 			self.IOpins = [18, 23, 24, 25, 4, 17, 27, 22]
+
+		# Precomputed GPIO bank masks of the buffered IOs: (IO bit, pin bit) pairs and
+		# pin bit masks of all 8-bit buffered IO words
+		self.IOpinMasks = [(1 << i, 1 << self.IOpins[i]) for i in range(0, 8)]
+		self.IObankMasks = [0] * 256
+		for word in range(0, 256):
+			for bit, pinMask in self.IOpinMasks:
+				if word & bit:
+					self.IObankMasks[word] |= pinMask
+
+		if LazyInit == False:
+			self.startExpanders()
+
+		self.startupRecord('board', boardStart)
 			
+# Chip select driven by an external IO pin of the expanders
+# While it is asserted, the native chip select is set to PiGoBoard.SPIidleCS, the chip select selected
+# before is restored when it is deasserted
+class ExpanderChipSelect:
+	kind = PiGoBoardData.CS_EXPANDER
+	# Buses used to assert the chip select
+	buses = ['i2c']
+
+	def __init__(self, host, pin):
+		self.host = host
+		self.pin = pin
+		self.key = (self.kind, pin)
+		self.previous = None
+
+	# Configure the pin as output, deasserted
+	def setup(self):
+		self.host.setExtIOdir(self.pin, 0)
+		self.host.setExtIO(self.pin, 1)
+
+	def select(self):
+		if self.host.batchState.depth > 0:
+			raise RuntimeError("Chip select cannot be asserted inside a batch")
+		self.previous = self.host.SPIcs
+		self.host.SPIselect(self.host.SPIidleCS)
+		self.host.setExtIO(self.pin, 0)
+
+	# Deassert chip select
+	# Arguments:
+	#   apply: 0 to only update the shadow register, it is written with the next expander write (default: 1)
+	def release(self, apply = 1):
+		self.host.setExtIO(self.pin, 1, apply)
+		self.host.SPIselect(self.previous)
+
+# Chip select CE0 or CE1 of the SPI block, asserted by the hardware for the duration of each transfer
+# Setting up a native chip select changes the whole board: PiGoBoard.SPIidleCS becomes BCM2835_SPI_CS_NONE, so
+# from then on modules with expander or GPIO chip selects transfer with both native chip selects deasserted.
+# The chip select selected before a transfer is restored after it, plain PiGoBoard.SPItransfer() calls keep it.
+class NativeChipSelect:
+	kind = PiGoBoardData.CS_NATIVE
+	buses = []
+
+	def __init__(self, host, pin):
+		if pin not in (PiGoBoardData.BCM2835_SPI_CS0, PiGoBoardData.BCM2835_SPI_CS1):
+			raise ValueError("Invalid native chip select: " + str(pin))
+		self.host = host
+		self.pin = pin
+		self.key = (self.kind, pin)
+		self.previous = None
+
+	# Native chip selects must stay deasserted during transfers to chips selected otherwise
+	def setup(self):
+		self.host.SPIidleCS = PiGoBoardData.BCM2835_SPI_CS_NONE
+
+	def select(self):
+		self.previous = self.host.SPIcs
+		self.host.SPIselect(self.pin)
+
+	def release(self, apply = 1):
+		self.host.SPIselect(self.previous)
+
+# Chip select driven by a buffered IO pin, the native chip select is handled like with ExpanderChipSelect
+class GPIOChipSelect:
+	kind = PiGoBoardData.CS_GPIO
+	buses = ['gpio']
+
+	def __init__(self, host, pin):
+		self.host = host
+		self.pin = pin
+		self.key = (self.kind, pin)
+		self.previous = None
+
+	def setup(self):
+		self.host.setIOdir(self.pin, 0)
+		self.host.setIO(self.pin, 1)
+
+	def select(self):
+		if self.host.batchState.depth > 0:
+			raise RuntimeError("Chip select cannot be asserted inside a batch")
+		self.previous = self.host.SPIcs
+		self.host.SPIselect(self.host.SPIidleCS)
+		self.host.setIO(self.pin, 0)
+
+	def release(self, apply = 1):
+		self.host.setIO(self.pin, 1)
+		self.host.SPIselect(self.previous)
+
+# Chip select of a module
+# Arguments:
+#   host: PiGoBoard object
+#   spec: (strategy, pin) tuple, strategy is PiGoBoardData.CS_EXPANDER (pin: external IO 0-15),
+#         CS_NATIVE (pin: BCM2835_SPI_CS0 or BCM2835_SPI_CS1) or CS_GPIO (pin: buffered IO 0-7)
+# Returns:
+#   chip select object
+def makeChipSelect(host, spec):
+	kind, pin = spec
+	if kind == PiGoBoardData.CS_EXPANDER:
+		return ExpanderChipSelect(host, pin)
+	if kind == PiGoBoardData.CS_NATIVE:
+		return NativeChipSelect(host, pin)
+	if kind == PiGoBoardData.CS_GPIO:
+		return GPIOChipSelect(host, pin)
+	raise ValueError("Unknown chip select strategy: " + str(kind))
+
 # A/D and D/A module class
 # For A/D MCP3002 is used with dual channels, configurable as single ended or differential
 class ModuleADDA:
@@ -673,9 +2494,16 @@ class ModuleADDA:
 	# Arguments:
 	#   PiGoBoardObject: reference to the PiGoBoard object for hardware access
 	#		SocketID: PiGo board physical socket, where ADDA module is attached to ('A','B','C', or 'D')
+	#   priority: bus priority of the conversions (default: PiGoArbiter.PRIORITY_NORMAL)
+	#   ADchipSelect, DAchipSelect: chip select wiring of the A/D and D/A converter as (strategy, pin) tuple (see
+	#                               makeChipSelect()), e.g. (PiGoBoardData.CS_NATIVE, PiGoBoardData.BCM2835_SPI_CS1)
+	#                               (default: expander pins of the socket)
+	#   SPIclock: maximal SPI clock in Hz, limited to the datasheet maximum of each converter, PiGoBoardData.SPI_CLOCK_MAX
+	#             for the datasheet maximum (default: None, divider 1024, 244 kHz with a 250 MHz core clock)
 	# Returns:
 	#   none
-	def __init__(self, PiGoBoardObject, SocketID):
+	def __init__(self, PiGoBoardObject, SocketID, priority = PiGoArbiter.PRIORITY_NORMAL, ADchipSelect = None, DAchipSelect = None,
+								SPIclock = None):
 		self.host = PiGoBoardObject
 		self.socket = SocketID
 
@@ -687,45 +2515,114 @@ class ModuleADDA:
 		}[SocketID]
 		self.CS_DA = self.CS_AD + 1
 
-		# Initialize CS (chip-select) pins
-		self.host.setExtIOdir(self.CS_AD, 0, 0)
-		self.host.setExtIOdir(self.CS_DA, 0, 1)
+		if ADchipSelect is None:
+			ADchipSelect = (PiGoBoardData.CS_EXPANDER, self.CS_AD)
+		if DAchipSelect is None:
+			DAchipSelect = (PiGoBoardData.CS_EXPANDER, self.CS_DA)
+		self.ADcs = makeChipSelect(self.host, ADchipSelect)
+		self.DAcs = makeChipSelect(self.host, DAchipSelect)
+
+		# Chip-select toggling and SPI transfer are executed as a single bus transaction,
+		# native chip selects need no bus besides SPI
+		self.ADtransaction = self.host.busTransaction(self.chipSelectBuses([self.ADcs]), priority)
+		self.DAtransaction = self.host.busTransaction(self.chipSelectBuses([self.DAcs]), priority)
+		self.transaction = self.host.busTransaction(self.chipSelectBuses([self.ADcs, self.DAcs]), priority)
+
+		# SPI settings of the converters, applied when the bus switches to them
+		self.ADprofile = self.host.SPIaddProfile('ADDA ' + SocketID + ' A/D', divider = self.clockDivider(SPIclock, PiGoBoardData.MCP3002_MAX_CLOCK))
+		self.DAprofile = self.host.SPIaddProfile('ADDA ' + SocketID + ' D/A', divider = self.clockDivider(SPIclock, PiGoBoardData.MCP4802_MAX_CLOCK))
 
-		self.host.setExtIO(self.CS_AD, 1, 0)
-		self.host.setExtIO(self.CS_DA, 1, 1)
+		# Conversion requests of channels 0 and 1: start bit, single ended mode, channel selection, MSB first
+		self.ADcommands = [[0x68, 0x00], [0x78, 0x00]]
+		self.acquisition = None
 
-		# Initialize SPI bus
-		self.host.SPIinit()
+		with self.host.batch():
+			# Initialize CS (chip-select) pins
+			self.ADcs.setup()
+			self.DAcs.setup()
+
+			# Initialize SPI bus
+			self.host.SPIinit()
 
 		#print("ADDA board initialized on module " + SocketID + " with AD_CS=" + str(self.CS_AD) + " and DA_CS=" + str(self.CS_DA))
 
+	# Clock divider of a converter
+	# Arguments:
+	#   clock: requested maximal SPI clock in Hz, SPI_CLOCK_MAX or None (see constructor)
+	#   maxClock: datasheet maximum of the converter
+	# Returns:
+	#   clock divider for the core clock of the board
+	def clockDivider(self, clock, maxClock):
+		if clock is None:
+			return PiGoBoardData.BCM2835_SPI_CLOCK_DIVIDER_1024
+		if clock == PiGoBoardData.SPI_CLOCK_MAX:
+			clock = maxClock
+		return SPIdivider(min(clock, maxClock), self.host.coreClock)
+
+	# Buses locked by transfers with the chip selects
+	def chipSelectBuses(self, chipSelects):
+		buses = set(['spi'])
+		for cs in chipSelects:
+			buses.update(cs.buses)
+		return [bus for bus in PiGoArbiter.BUS_ORDER if bus in buses]
+
 	# Read A/D
 	# Arguments:
 	#   channel: A/D channel (0-1)
 	# Returns:
 	#   10-bit analog input value
 	def getAD(self, channel):
+		with self.ADtransaction:
+			return self.convert(channel)
+
+	# A/D conversion, the caller must hold the A/D transaction (ADtransaction)
+	# Arguments:
+	#   channel: A/D channel (0-1)
+	# Returns:
+	#   10-bit analog input value
+	def convert(self, channel):
+		self.host.SPIuseProfile(self.ADprofile)
 
 		# Assert AD CS signal
-		self.host.setExtIO(self.CS_AD, 0)
-		
-		# Send conversion request
-		cmd = [0x00, 0x00]
-		cmd[0] |= (1 << 6) # Start bit
-		cmd[0] |= (1 << 5) # Single ended mode
-		if channel == 1:
-			cmd[0] |= (1 << 4) # Channel 1 selection
+		self.ADcs.select()
 
-		cmd[0] |= (1 << 3) # MSB data first, please
+		# Send conversion request
+		adData = self.host.SPItransfer(self.ADcommands[channel & 1])
 
-		adData = self.host.SPItransfer(cmd)
-	
 		# Deassert AD CS signal
-		self.host.setExtIO(self.CS_AD, 1)
-				
+		self.ADcs.release()
+
 		# Return A/D value
 		return ((adData[0] << 8) + adData[1]) & 0x3FF
 
+	# Start continuous A/D acquisition
+	# A sampler thread converts the channels at the given rate into a ring buffer (see PiGoAcquisition),
+	# a running acquisition of the module is stopped first
+	# Arguments:
+	#   channels: array of A/D channels (0-1) converted in every scan (default: [0, 1])
+	#   rate: scans per second, None for as fast as possible (default: 1000.0)
+	#   bufferLength: ring buffer size in scans (default: 65536)
+	#   blockSize: scans per timestamp and per bus transaction (default: 64)
+	# Returns:
+	#   PiGoAcquisition.Acquisition object, read samples with its read() method or by iterating over it
+	def startAcquisition(self, channels = [0, 1], rate = 1000.0, bufferLength = 65536, blockSize = 64):
+		import PiGoAcquisition
+		self.stopAcquisition()
+		scanList = ADDAScanList(self.host, [(self, channel) for channel in channels], self.ADtransaction)
+		self.acquisition = PiGoAcquisition.Acquisition(scanList, rate, bufferLength, blockSize)
+		return self.acquisition
+
+	# Stop continuous A/D acquisition
+	# Arguments:
+	#   none
+	# Returns:
+	#   acquisition report (see PiGoAcquisition.Acquisition.report()), None if no acquisition was started
+	def stopAcquisition(self):
+		if self.acquisition is None:
+			return None
+		self.acquisition.stop()
+		return self.acquisition.report()
+
 	# Set D/A
 	# Arguments:
 	#   channel: D/A channel (0 for channel 'A' or 1 for channel 'B')
@@ -733,9 +2630,9 @@ class ModuleADDA:
 	# Returns:
 	#   none
 	def setDA(self, channel, value):
-
-		# Assert DA CS signal
-		self.host.setExtIO(self.CS_DA, 0)
+		# Inside a batch only the last value of the channel is written, at the end of the batch
+		if self.host.batchDefer((self, channel), self.setDA, channel, value):
+			return
 
 		# Send conversion request
 		cmd = [0x0F & (value >> 6), (value << 2) & 0xFF]
@@ -745,13 +2642,124 @@ class ModuleADDA:
 		cmd[0] |= (1 << 5) # Set 1x gain (0-VREF)
 		cmd[0] |= (1 << 4) # Enable selected channel
 
-		self.host.SPItransfer(cmd)
+		with self.DAtransaction:
+			self.host.SPIuseProfile(self.DAprofile)
 
-		# Deassert DA CS signal
-		self.host.setExtIO(self.CS_DA, 1)
+			# Assert DA CS signal
+			self.DAcs.select()
+
+			self.host.SPItransfer(cmd)
+
+			# Deassert DA CS signal
+			self.DAcs.release()
 		return
 
 
+# A/D scan list over several ADDA modules
+# A sweep converts all entries in one bus transaction. The AD chip-selects of all sockets are on the
+# same expander port, so deasserting the chip-select of a conversion and asserting the next one is a
+# single OLAT write: a sweep of n conversions costs n + 1 writes instead of 2n. Conversions of the same
+# module need a chip-select edge in between (two writes), so entries are converted in an order that
+# avoids them where possible. Results are returned in the order of the entries.
+# Modules with native or GPIO chip selects (see ModuleADDA) can be mixed in, they need no expander writes.
+class ADDAScanList:
+	# ADDAScanList constructor
+	# Arguments:
+	#   PiGoBoardObject: reference to the PiGoBoard object for hardware access
+	#   entries: array of (ModuleADDA object, channel) tuples
+	#   transaction: bus transaction of the sweeps (default: I2C and SPI with normal priority)
+	# Returns:
+	#   none
+	def __init__(self, PiGoBoardObject, entries, transaction = None):
+		if len(entries) == 0:
+			raise ValueError("Empty scan list")
+		self.host = PiGoBoardObject
+		self.entries = list(entries)
+		if transaction is None:
+			module = self.entries[0][0]
+			transaction = self.host.busTransaction(module.chipSelectBuses([entry[0].ADcs for entry in self.entries]))
+		self.transaction = transaction
+
+		# Conversion order: (chip select, conversion command, result index, SPI profile)
+		pending = [(module.ADcs, module.ADcommands[channel & 1], index, module.ADprofile) for index, (module, channel) in enumerate(self.entries)]
+		self.sequence = []
+		previous = None
+		while pending:
+			step = pending[0]
+			for candidate in pending:
+				if candidate[0].key != previous:
+					step = candidate
+					break
+			pending.remove(step)
+			self.sequence.append(step)
+			previous = step[0].key
+
+		self.acquisition = None
+
+	# Number of conversions of a sweep
+	def __len__(self):
+		return len(self.entries)
+
+	# Convert all entries
+	# Arguments:
+	#   out: array to store the results in (default: new array('H'))
+	#   offset: index of the first result in out (default: 0)
+	# Returns:
+	#   out, 10-bit analog input values in the order of the entries
+	def sweep(self, out = None, offset = 0):
+		if out is None:
+			from array import array
+			out = array('H', [0]) * len(self.entries)
+		with self.transaction:
+			self.convert(out, offset)
+		return out
+
+	# Convert all entries, the caller must hold the scan list transaction
+	# Arguments:
+	#   out: array to store the results in
+	#   offset: index of the first result in out
+	# Returns:
+	#   none
+	def convert(self, out, offset):
+		host = self.host
+		previous = None
+		for cs, cmd, index, profile in self.sequence:
+			host.SPIuseProfile(profile)
+			if previous is not None:
+				# Deassert previous and assert next expander AD CS signal in one write
+				fold = previous.kind == PiGoBoardData.CS_EXPANDER and cs.kind == PiGoBoardData.CS_EXPANDER and previous.key != cs.key
+				previous.release(0 if fold else 1)
+			cs.select()
+			adData = host.SPItransfer(cmd)
+			out[offset + index] = ((adData[0] << 8) + adData[1]) & 0x3FF
+			previous = cs
+
+		# Deassert last AD CS signal
+		previous.release()
+
+	# Start continuous acquisition of sweeps (see ModuleADDA.startAcquisition(), a scan is one sweep)
+	# Arguments:
+	#   rate: sweeps per second, None for as fast as possible (default: 1000.0)
+	#   bufferLength: ring buffer size in sweeps (default: 65536)
+	#   blockSize: sweeps per timestamp and per bus transaction (default: 64)
+	# Returns:
+	#   PiGoAcquisition.Acquisition object
+	def startAcquisition(self, rate = 1000.0, bufferLength = 65536, blockSize = 64):
+		import PiGoAcquisition
+		self.stopAcquisition()
+		self.acquisition = PiGoAcquisition.Acquisition(self, rate, bufferLength, blockSize)
+		return self.acquisition
+
+	# Stop continuous acquisition
+	# Returns:
+	#   acquisition report, None if no acquisition was started
+	def stopAcquisition(self):
+		if self.acquisition is None:
+			return None
+		self.acquisition.stop()
+		return self.acquisition.report()
+
+
 # Motor module class
 class ModuleMotor:
 	# Motor module constructor
@@ -759,47 +2767,55 @@ class ModuleMotor:
 	#   PiGoBoardObject: reference to the PiGoBoard object for hardware access
 	#		SocketID: PiGo board physical socket, where the module is attached to ('A','B','C', or 'D')
 	#   Mode: 0 (digital mode) or 1 (PWM mode)
+	#   priority: bus priority of the setpoint changes (default: PiGoArbiter.PRIORITY_HIGH, ahead of A/D polling)
 	# Returns:
 	#   none
-	def __init__(self, PiGoBoardObject, SocketID, mode, PWMfreq = 1000.0):
+	def __init__(self, PiGoBoardObject, SocketID, mode, PWMfreq = 1000.0, priority = PiGoArbiter.PRIORITY_HIGH):
 		self.host = PiGoBoardObject
 		self.socket = SocketID
 		self.mode = mode
 
+		# Both control signals are changed in a single bus transaction
 		if self.mode == 0:
-			# user selected digital mode...
-			self.IN1 = {
-					'A': 0,
-					'B': 2,
-					'C': 4,
-					'D': 6
-			}[SocketID]
-			self.IN2 = self.IN1 + 1
+			self.transaction = self.host.busTransaction(['i2c'], priority)
+		else:
+			self.transaction = self.host.busTransaction(['gpio'], priority)
 
-			
-			# Initialize control pins
-			self.host.setExtIOdir(self.IN1, 0, 0)
-			self.host.setExtIOdir(self.IN2, 0, 1)
+		with self.host.batch():
+			if self.mode == 0:
+				# user selected digital mode...
+				self.IN1 = {
+						'A': 0,
+						'B': 2,
+						'C': 4,
+						'D': 6
+				}[SocketID]
+				self.IN2 = self.IN1 + 1
+
+
+				# Initialize control pins
+				self.host.setExtIOdir(self.IN1, 0, 0)
+				self.host.setExtIOdir(self.IN2, 0, 1)
+
+				self.host.setExtIO(self.IN1, 0, 0)
+				self.host.setExtIO(self.IN2, 0, 1)
+				print("Motor board initialized on module " + SocketID + " with IN1=" + str(self.IN1) + " and IN2=" + str(self.IN2))
+			else:
+				# user selected PWM mode
+
+				# Initialize PWM output
+				self.host.setIOdir(0, 0, 1)
+				self.host.PWMinit()
+				self.host.PWMsetPeriod(1.0/PWMfreq)
+				self.host.PWMsetDuty(0)
+
+
+				# Initialize the second control pin
+				self.host.setIOdir(1, 0, 1)
+				self.host.setIO(1, 0)
+
+				print("Motor board initialized on module " + SocketID + " in PWM mode on buffered pins 1 and 2")
 
-			self.host.setExtIO(self.IN1, 0, 0)
-			self.host.setExtIO(self.IN2, 0, 1)
-			print("Motor board initialized on module " + SocketID + " with IN1=" + str(self.IN1) + " and IN2=" + str(self.IN2))
-		else:
-			# user selected PWM mode
-			
-			# Initialize PWM output
-			self.host.setIOdir(0, 0, 1)
-			self.host.PWMinit()
-			self.host.PWMsetPeriod(1.0/PWMfreq)
-			self.host.PWMsetDuty(0)
-						
-						
-			# Initialize the second control pin
-			self.host.setIOdir(1, 0, 1)
-			self.host.setIO(1, 0)
-			
-			print("Motor board initialized on module " + SocketID + " in PWM mode on buffered pins 1 and 2")
-			
 		self.prevPower = 0
 
 	# Set motor power
@@ -810,37 +2826,37 @@ class ModuleMotor:
 	def setOutput(self, power):
 		if self.prevPower == power:
 			return
-						
-		if self.mode == 0:
-			if power < 0:
-				self.host.setExtIO(self.IN1, 0, 0)
-				self.host.setExtIO(self.IN2, 1, 1)
-			elif power > 0:
-				self.host.setExtIO(self.IN1, 1, 0)
-				self.host.setExtIO(self.IN2, 0, 1)
-			else:
-				self.host.setExtIO(self.IN1, 0, 0)
-				self.host.setExtIO(self.IN2, 0, 1)
-			
-		else:
-			if power > 1:
-				power = 1
-			if power < -1:
-				power = -1
-				
-			if power >= 0:
-				if self.prevPower < 0:
-					self.host.setIO(1, 0)
 
-				self.host.PWMsetDuty(power)
+		with self.transaction:
+			if self.mode == 0:
+				if power < 0:
+					self.host.setExtIO(self.IN1, 0, 0)
+					self.host.setExtIO(self.IN2, 1, 1)
+				elif power > 0:
+					self.host.setExtIO(self.IN1, 1, 0)
+					self.host.setExtIO(self.IN2, 0, 1)
+				else:
+					self.host.setExtIO(self.IN1, 0, 0)
+					self.host.setExtIO(self.IN2, 0, 1)
+
 			else:
-				if self.prevPower >= 0:
-					self.host.setIO(1, 1)
+				if power > 1:
+					power = 1
+				if power < -1:
+					power = -1
 
-				self.host.PWMsetDuty(1+power)
-			
-		
-		self.prevPower = power
+				if power >= 0:
+					if self.prevPower < 0:
+						self.host.setIO(1, 0)
+
+					self.host.PWMsetDuty(power)
+				else:
+					if self.prevPower >= 0:
+						self.host.setIO(1, 1)
+
+					self.host.PWMsetDuty(1+power)
+
+			self.prevPower = power
 		
 		
 def main():
@@ -866,22 +2882,20 @@ def main():
 	for a in range(0, 127):
 		lib.I2CsetTargetAddress(a)
 		if lib.I2CWrite([0]) == True:
-			print "Device found at address " + hex(a)
+			print("Device found at address " + hex(a))
 
 	# Test read the LM75 sensor
-	lib.I2CsetTargetAddress(0x48)
-	if lib.I2CWrite([0]) == True:
-		result = lib.I2CRead(2)
-	
-		# Second element holds the 0.5 deg. C
-		if (result[1] < 0):
+	result = lib.readRegisters(0x48, 0, 2)
+	if len(result) == 2:
+		# MSB of the second element holds the 0.5 deg. C
+		if result[1] & 0x80:
 			halfDegree = 5
 		else:
 			halfDegree = 0
 			
-		print "LM75: " + str(result[0]) + "." + str(halfDegree) + " deg. C"
+		print("LM75: " + str(result[0]) + "." + str(halfDegree) + " deg. C")
 	else:
-		print "LM75 was not found at the specified address!"
+		print("LM75 was not found at the specified address!")
 	
 	
 	return 0
@@ -0,0 +1,199 @@
+#       File: PiGoMmap.py
+#       Description: Memory-mapped GPIO and PWM register access for PiGo board
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+#  GPIO and PWM register blocks are mapped into the Python process, so GPLEV0, GPSET0/GPCLR0
+#  and PWM0 RNG/DAT are accessed as 32-bit words without calling into libBCM.so.
+#  /dev/gpiomem gives access to the GPIO block without root rights, the PWM block can only
+#  be mapped from /dev/mem. Any file can be mapped instead (e.g. a plain file for testing).
+#
+#  Unlike libBCM.so, accesses are not separated by memory barriers when switching between
+#  the GPIO and PWM peripherals.
+
+import mmap
+import os
+import struct
+
+import PiGoBoardData
+
+# Physical address of the peripherals
+# Arguments:
+#   rangesFile: device tree ranges of the SoC (default: /proc/device-tree/soc/ranges)
+# Returns:
+#   peripheral base address, BCM2835_PERI_BASE (Raspberry Pi 1) if it cannot be determined
+def peripheralBase(rangesFile = '/proc/device-tree/soc/ranges'):
+	try:
+		f = open(rangesFile, 'rb')
+		try:
+			data = f.read(12)
+		finally:
+			f.close()
+	except (IOError, OSError):
+		return PiGoBoardData.BCM2835_PERI_BASE
+
+	if len(data) < 8:
+		return PiGoBoardData.BCM2835_PERI_BASE
+	base = struct.unpack('>I', data[4:8])[0]
+	if base == 0 and len(data) >= 12:
+		# 64-bit parent address (Raspberry Pi 4)
+		base = struct.unpack('>I', data[8:12])[0]
+	return base
+
+# Core clock of the SoC the SPI clock is divided from
+# Arguments:
+#   compatibleFile: device tree compatible strings of the board (default: /proc/device-tree/compatible)
+# Returns:
+#   core clock in Hz (see PiGoBoardData.BCM2835_CORE_CLOCK), CORE_CLOCK_DEFAULT if the SoC cannot be determined
+def coreClock(compatibleFile = '/proc/device-tree/compatible'):
+	try:
+		f = open(compatibleFile, 'rb')
+		try:
+			data = f.read()
+		finally:
+			f.close()
+	except (IOError, OSError):
+		return PiGoBoardData.CORE_CLOCK_DEFAULT
+
+	compatible = data.decode('ascii', 'replace').split('\0')
+	if 'brcm,bcm2711' in compatible:
+		return PiGoBoardData.BCM2711_CORE_CLOCK
+	if 'brcm,bcm2837' in compatible:
+		return PiGoBoardData.BCM2837_CORE_CLOCK
+	if 'brcm,bcm2835' in compatible or 'brcm,bcm2836' in compatible:
+		return PiGoBoardData.BCM2835_CORE_CLOCK
+	return PiGoBoardData.CORE_CLOCK_DEFAULT
+
+# 32-bit word access to a mapping without memoryview.cast (Python 2)
+class StructWords:
+	def __init__(self, buf):
+		self.buf = buf
+
+	def __getitem__(self, index):
+		return struct.unpack_from('=I', self.buf, 4 * index)[0]
+
+	def __setitem__(self, index, value):
+		struct.pack_into('=I', self.buf, 4 * index, value)
+
+# Memory-mapped register block
+class RegisterBlock:
+	# RegisterBlock constructor
+	# Arguments:
+	#   fileName: file to map (/dev/gpiomem, /dev/mem or a plain file)
+	#   offset: offset of the block in the file, must be a multiple of the page size
+	#   size: size of the block in bytes (default: BCM2835_BLOCK_SIZE)
+	# Returns:
+	#   none
+	def __init__(self, fileName, offset = 0, size = PiGoBoardData.BCM2835_BLOCK_SIZE):
+		fd = os.open(fileName, os.O_RDWR | os.O_SYNC)
+		try:
+			self.map = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE, offset = offset)
+		finally:
+			os.close(fd)
+
+		self.view = None
+		try:
+			self.view = memoryview(self.map)
+		except TypeError:
+			pass
+		if self.view is not None and hasattr(self.view, 'cast'):
+			# Registers as a sequence of native 32-bit words
+			self.words = self.view.cast('I')
+		else:
+			self.words = StructWords(self.map)
+
+	def close(self):
+		if self.map is None:
+			return
+		if self.view is not None and hasattr(self.view, 'release'):
+			if self.words is not self.view and hasattr(self.words, 'release'):
+				self.words.release()
+			self.view.release()
+		self.words = None
+		self.view = None
+		self.map.close()
+		self.map = None
+
+# Direct GPIO and PWM register access
+class DirectIO:
+	# DirectIO constructor
+	# Arguments:
+	#   gpioFile: file mapped for the GPIO block (default: /dev/gpiomem)
+	#   pwmFile: file mapped for the PWM block, None to access PWM through libBCM.so (default: /dev/mem)
+	#   gpioOffset: offset of the GPIO block in gpioFile (default: 0 for /dev/gpiomem, physical address otherwise)
+	#   pwmOffset: offset of the PWM block in pwmFile (default: physical address)
+	# Returns:
+	#   none
+	# Raises IOError/OSError if the GPIO block cannot be mapped. If the PWM block cannot be mapped
+	# (no root rights), only GPIO is accessed directly.
+	def __init__(self, gpioFile = '/dev/gpiomem', pwmFile = '/dev/mem', gpioOffset = None, pwmOffset = None):
+		if gpioOffset is None:
+			if gpioFile == '/dev/gpiomem':
+				gpioOffset = 0
+			else:
+				gpioOffset = peripheralBase() + PiGoBoardData.BCM2835_GPIO_OFFSET
+		self.gpioBlock = RegisterBlock(gpioFile, gpioOffset)
+		self.gpio = self.gpioBlock.words
+
+		self.pwmBlock = None
+		self.pwm = None
+		if pwmFile is not None:
+			if pwmOffset is None:
+				pwmOffset = peripheralBase() + PiGoBoardData.BCM2835_PWM_OFFSET
+			try:
+				self.pwmBlock = RegisterBlock(pwmFile, pwmOffset)
+				self.pwm = self.pwmBlock.words
+			except (IOError, OSError):
+				pass
+
+	# Set or clear output pin (0-31)
+	def write(self, pin, value):
+		if value:
+			self.gpio[PiGoBoardData.BCM2835_GPSET0_WORD] = 1 << pin
+		else:
+			self.gpio[PiGoBoardData.BCM2835_GPCLR0_WORD] = 1 << pin
+
+	# Set output pins in the mask (GPSET0)
+	def setMulti(self, mask):
+		self.gpio[PiGoBoardData.BCM2835_GPSET0_WORD] = mask
+
+	# Clear output pins in the mask (GPCLR0)
+	def clrMulti(self, mask):
+		self.gpio[PiGoBoardData.BCM2835_GPCLR0_WORD] = mask
+
+	# Level of input pin (0-31)
+	def level(self, pin):
+		return (self.gpio[PiGoBoardData.BCM2835_GPLEV0_WORD] >> pin) & 1
+
+	# Levels of pins 0-31 (GPLEV0)
+	def levels(self):
+		return self.gpio[PiGoBoardData.BCM2835_GPLEV0_WORD]
+
+	# PWM channel 0 range (RNG1)
+	def pwmSetRange(self, value):
+		self.pwm[PiGoBoardData.BCM2835_PWM0_RANGE_WORD] = value
+
+	# PWM channel 0 data (DAT1)
+	def pwmSetData(self, value):
+		self.pwm[PiGoBoardData.BCM2835_PWM0_DATA_WORD] = value
+
+	# Unmap the register blocks
+	def close(self):
+		self.gpio = None
+		self.pwm = None
+		self.gpioBlock.close()
+		if self.pwmBlock is not None:
+			self.pwmBlock.close()
@@ -0,0 +1,481 @@
+#       File: PiGoRPC.py
+#       Description: Pipelined request/response RPC over PiGo board serial port
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+#  Talks to a coprocessor (e.g. Arduino) attached to the serial port. Every request carries
+#  a sequence number and the response carries it back, so several requests can be in flight
+#  and the link is not idle while a request waits for its response. Calls return futures
+#  resolved by a receiver thread.
+#
+#  Frames are sent with PiGoFraming (COBS or SLIP, CRC16), one frame holds one or more messages:
+#    request:  sequence (uint16), command (uint8), payload length (uint16), payload
+#    response: sequence (uint16), status (uint8), payload length (uint16), payload
+#  All values are big-endian. The peer answers the requests of a frame with a single frame.
+#
+#  Usage:
+#    client = PiGoRPC.RPCClient(board)
+#    print(client.callSync(PiGoRPC.CMD_ECHO, b'hello'))
+#    with client.batch():
+#        futures = [client.call(PiGoRPC.CMD_PING) for i in range(16)]
+#    results = [future.result() for future in futures]
+
+import os
+import struct
+import threading
+import time
+import traceback
+
+try:
+	from concurrent.futures import Future
+	from concurrent.futures import TimeoutError as FutureTimeout
+except ImportError:
+	Future = None
+try:
+	from concurrent.futures import InvalidStateError
+except ImportError:
+	# Resolving a cancelled future does not raise before Python 3.8
+	InvalidStateError = None
+
+import PiGoBoardData
+import PiGoFraming
+from PiGoStats import timer
+
+# Commands implemented by every peer
+CMD_PING = 0x00 # Empty response
+CMD_ECHO = 0x01 # Response payload is the request payload
+
+# Response status
+STATUS_OK = 0
+STATUS_UNKNOWN_COMMAND = 1
+STATUS_ERROR = 2 # Payload holds the error message
+
+# Message header: sequence, command or status, payload length
+HEADER = struct.Struct('>HBH')
+
+class RPCError(Exception):
+	def __init__(self, message, status = STATUS_ERROR):
+		Exception.__init__(self, message)
+		self.status = status
+
+class RPCTimeout(RPCError):
+	pass
+
+# Minimal future for Python versions without concurrent.futures
+class RPCFuture:
+	def __init__(self):
+		self.event = threading.Event()
+		self.value = None
+		self.error = None
+		self.callbacks = []
+
+	def done(self):
+		return self.event.is_set()
+
+	def set_result(self, value):
+		self.value = value
+		self.finish()
+
+	def set_exception(self, error):
+		self.error = error
+		self.finish()
+
+	def finish(self):
+		self.event.set()
+		for callback in self.callbacks:
+			callback(self)
+
+	def add_done_callback(self, callback):
+		if self.done():
+			callback(self)
+		else:
+			self.callbacks.append(callback)
+
+	def exception(self, timeout = None):
+		if not self.event.wait(timeout) and not self.done():
+			raise RPCTimeout("Future not done")
+		return self.error
+
+	def result(self, timeout = None):
+		error = self.exception(timeout)
+		if error is not None:
+			raise error
+		return self.value
+
+if Future is None:
+	Future = RPCFuture
+	FutureTimeout = RPCTimeout
+
+# Resolve future, futures cancelled by the caller are skipped
+# Arguments:
+#   future: future returned by RPCClient.call()
+#   result: response payload
+#   error: exception the future fails with, None to resolve it with result
+# Returns:
+#   none
+def resolveFuture(future, result = None, error = None):
+	if future.done():
+		return
+	try:
+		if error is None:
+			future.set_result(result)
+		else:
+			future.set_exception(error)
+	except Exception as e:
+		# Cancelled meanwhile
+		if InvalidStateError is None or not isinstance(e, InvalidStateError):
+			raise
+
+# Batch context returned by RPCClient.batch()
+class RPCBatch:
+	def __init__(self, client):
+		self.client = client
+
+	def __enter__(self):
+		with self.client.condition:
+			self.client.batchDepth += 1
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		with self.client.condition:
+			self.client.batchDepth -= 1
+			last = self.client.batchDepth == 0
+		if last:
+			self.client.flush()
+		return False
+
+# RPC client on PiGo board serial port
+class RPCClient:
+	# RPCClient constructor
+	# The serial port must be open. The background serial reader is started and frame encoding is
+	# set if it was not done before. The client reads all frames received on the port.
+	# Arguments:
+	#   board: PiGoBoard object
+	#   timeout: default response timeout in seconds (default: 1.0)
+	#   maxInFlight: maximal number of requests waiting for response, call() waits when it is reached,
+	#                limits the data the peer has to buffer (default: 16)
+	#   maxBatchSize: maximal payload size of a frame holding several requests (default: 240)
+	#   pollInterval: receiver thread read timeout, limits the close() delay and timeout accuracy (default: 0.01)
+	# Returns:
+	#   none
+	def __init__(self, board, timeout = 1.0, maxInFlight = 16, maxBatchSize = 240, pollInterval = 0.01):
+		self.board = board
+		self.timeout = timeout
+		self.maxInFlight = maxInFlight
+		self.maxBatchSize = maxBatchSize
+		self.pollInterval = pollInterval
+
+		if board.frameDecoder is None:
+			board.serialSetFraming()
+		board.serialStartReader()
+
+		self.condition = threading.Condition()
+		self.sequence = 0
+		# Requests waiting for response: sequence -> (future, deadline)
+		self.pending = {}
+		# Encoded requests not sent yet
+		self.queue = []
+		self.batchDepth = 0
+
+		self.requests = 0
+		self.responses = 0
+		self.timeouts = 0
+		self.errors = 0
+		self.frames = 0
+		self.stalls = 0
+
+		self.running = True
+		self.thread = threading.Thread(target = self.receiveLoop, name = 'PiGoRPCReceiver')
+		self.thread.daemon = True
+		self.thread.start()
+
+	# Send request
+	# Arguments:
+	#   command: command number (0-255)
+	#   payload: request data, bytes-like object (default: empty)
+	#   timeout: response timeout in seconds (default: client timeout)
+	# Returns:
+	#   future resolved with the response payload (bytes), or failed with RPCError or RPCTimeout
+	def call(self, command, payload = b'', timeout = None):
+		if timeout is None:
+			timeout = self.timeout
+		payload = bytes(payload)
+		future = Future()
+
+		with self.condition:
+			if not self.running:
+				raise RPCError("RPC client is closed")
+			if len(self.pending) >= self.maxInFlight:
+				self.stalls += 1
+				if self.queue:
+					# Queued requests have to be sent, or no response will ever come
+					self.sendQueue()
+				while len(self.pending) >= self.maxInFlight and self.running:
+					self.condition.wait(self.pollInterval)
+				if not self.running:
+					raise RPCError("RPC client is closed")
+
+			# Skip sequence numbers still in use after wrap-around
+			while self.sequence in self.pending:
+				self.sequence = (self.sequence + 1) & 0xFFFF
+			sequence = self.sequence
+			self.sequence = (self.sequence + 1) & 0xFFFF
+
+			self.pending[sequence] = (future, timer() + timeout)
+			self.queue.append(HEADER.pack(sequence, command, len(payload)) + payload)
+			self.requests += 1
+			if self.batchDepth == 0:
+				self.sendQueue()
+		return future
+
+	# Send request and wait for the response
+	# Arguments:
+	#   command: command number (0-255)
+	#   payload: request data (default: empty)
+	#   timeout: response timeout in seconds (default: client timeout)
+	# Returns:
+	#   response payload (bytes), raises RPCError or RPCTimeout
+	def callSync(self, command, payload = b'', timeout = None):
+		if timeout is None:
+			timeout = self.timeout
+		future = self.call(command, payload, timeout)
+		# The receiver thread fails the request at its deadline, the margin only covers a receiver that stopped
+		try:
+			return future.result(timeout + 1.0)
+		except FutureTimeout:
+			raise RPCTimeout("RPC response timeout")
+
+	# Batch of requests
+	# Requests issued inside the batch ("with client.batch(): ...") are sent at its end,
+	# packed into as few frames as possible. Batches can be nested.
+	# Arguments:
+	#   none
+	# Returns:
+	#   batch context
+	def batch(self):
+		return RPCBatch(self)
+
+	# Send queued requests
+	# Arguments:
+	#   none
+	# Returns:
+	#   none
+	def flush(self):
+		with self.condition:
+			self.sendQueue()
+
+	# Pack queued requests into frames and send them, condition must be held
+	def sendQueue(self):
+		frame = b''
+		for message in self.queue:
+			if frame and len(frame) + len(message) > self.maxBatchSize:
+				self.board.serialWriteFrame(frame)
+				self.frames += 1
+				frame = b''
+			frame += message
+		if frame:
+			self.board.serialWriteFrame(frame)
+			self.frames += 1
+		self.queue = []
+
+	# Number of requests waiting for response
+	def inFlight(self):
+		return len(self.pending)
+
+	# Client counters
+	# Returns:
+	#   dictionary of counters: requests, responses, timeouts, errors (error responses and unknown sequence
+	#   numbers), frames (sent), stalls (calls waiting for free in-flight slot), in_flight
+	def counters(self):
+		with self.condition:
+			return {
+				'requests': self.requests,
+				'responses': self.responses,
+				'timeouts': self.timeouts,
+				'errors': self.errors,
+				'frames': self.frames,
+				'stalls': self.stalls,
+				'in_flight': len(self.pending),
+			}
+
+	# Stop the receiver thread, requests waiting for response fail with RPCError
+	# The serial port and its background reader are left running
+	# Arguments:
+	#   none
+	# Returns:
+	#   none
+	def close(self):
+		with self.condition:
+			if not self.running:
+				return
+			self.running = False
+			self.condition.notify_all()
+		self.thread.join()
+		with self.condition:
+			pending = self.pending
+			self.pending = {}
+			self.queue = []
+		for future, deadline in pending.values():
+			resolveFuture(future, error = RPCError("RPC client is closed"))
+
+	def receiveLoop(self):
+		while self.running:
+			try:
+				self.receive()
+			except Exception:
+				traceback.print_exc()
+				time.sleep(self.pollInterval)
+
+	# Read responses and resolve their futures, expire requests without response
+	def receive(self):
+		frames = self.board.serialReadFrames(self.pollInterval)
+		done = []
+		with self.condition:
+			for frame in frames:
+				offset = 0
+				while offset + HEADER.size <= len(frame):
+					sequence, status, length = HEADER.unpack_from(frame, offset)
+					offset += HEADER.size
+					payload = frame[offset:offset + length]
+					offset += length
+					entry = self.pending.pop(sequence, None)
+					if entry is None:
+						# Late response of a request that timed out
+						self.errors += 1
+						continue
+					self.responses += 1
+					if status != STATUS_OK:
+						self.errors += 1
+					done.append((entry[0], status, payload))
+
+			# Expire requests without response
+			now = timer()
+			for sequence, entry in list(self.pending.items()):
+				if entry[1] <= now:
+					del self.pending[sequence]
+					self.timeouts += 1
+					done.append((entry[0], None, None))
+
+			if done:
+				self.condition.notify_all()
+
+		# Futures are resolved outside the lock, their callbacks may issue new calls
+		for future, status, payload in done:
+			try:
+				if status is None:
+					resolveFuture(future, error = RPCTimeout("RPC response timeout"))
+				elif status == STATUS_OK:
+					resolveFuture(future, payload)
+				else:
+					resolveFuture(future, error = RPCError(payload.decode('utf-8', 'replace'), status))
+			except Exception:
+				traceback.print_exc()
+
+# Stand-in for the coprocessor, answers requests with registered handlers
+class RPCPeer:
+	# RPCPeer constructor
+	# Arguments:
+	#   handlers: dictionary of command -> function(payload) returning the response payload (bytes),
+	#             CMD_PING and CMD_ECHO are always implemented
+	#   framing: PiGoBoardData.FRAMING_COBS (default) or FRAMING_SLIP
+	# Returns:
+	#   none
+	def __init__(self, handlers = None, framing = PiGoBoardData.FRAMING_COBS):
+		self.handlers = {CMD_PING: lambda payload: b'', CMD_ECHO: lambda payload: payload}
+		if handlers is not None:
+			self.handlers.update(handlers)
+		self.framing = framing
+		self.decoder = PiGoFraming.FrameDecoder(framing)
+		self.lock = threading.Lock()
+		self.requests = 0
+
+	# Process data received from the client
+	# Arguments:
+	#   data: bytes-like object
+	# Returns:
+	#   bytes to send back to the client (one response frame per complete request frame)
+	def receive(self, data):
+		with self.lock:
+			out = b''
+			for frame in self.decoder.feed(data):
+				response = b''
+				offset = 0
+				while offset + HEADER.size <= len(frame):
+					sequence, command, length = HEADER.unpack_from(frame, offset)
+					offset += HEADER.size
+					payload = frame[offset:offset + length]
+					offset += length
+					self.requests += 1
+					handler = self.handlers.get(command)
+					if handler is None:
+						status = STATUS_UNKNOWN_COMMAND
+						result = b'Unknown command'
+					else:
+						try:
+							result = bytes(handler(payload))
+							status = STATUS_OK
+						except Exception as e:
+							status = STATUS_ERROR
+							result = str(e).encode('utf-8')
+					response += HEADER.pack(sequence, status, len(result)) + result
+				out += PiGoFraming.encodeFrame(response, self.framing)
+			return out
+
+# RPCPeer on a pseudo terminal, for testing with a real serial port driver
+# Open the board serial port on peer.port ("board.serialOpen(port = peer.port)")
+class PtyPeer:
+	# PtyPeer constructor
+	# Arguments:
+	#   peer: RPCPeer object answering the requests (default: RPCPeer())
+	# Returns:
+	#   none
+	def __init__(self, peer = None):
+		import pty
+		import select
+		import tty
+		self.select = select
+		if peer is None:
+			peer = RPCPeer()
+		self.peer = peer
+		self.master, self.slave = pty.openpty()
+		tty.setraw(self.slave)
+		self.port = os.ttyname(self.slave)
+
+		self.running = True
+		self.thread = threading.Thread(target = self.run, name = 'PiGoPtyPeer')
+		self.thread.daemon = True
+		self.thread.start()
+
+	def run(self):
+		while self.running:
+			readable = self.select.select([self.master], [], [], 0.05)[0]
+			if not readable:
+				continue
+			try:
+				data = os.read(self.master, 4096)
+			except OSError:
+				break
+			response = self.peer.receive(data)
+			while response:
+				written = os.write(self.master, response)
+				response = response[written:]
+
+	# Stop the peer thread and close the pseudo terminal
+	def close(self):
+		self.running = False
+		self.thread.join()
+		os.close(self.master)
+		os.close(self.slave)
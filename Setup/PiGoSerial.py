@@ -0,0 +1,423 @@
+#       File: PiGoSerial.py
+#       Description: Background serial port reader and write queue for PiGo board
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+#  A reader thread drains the serial port into a bounded ring buffer, so received data is
+#  not lost while the application is busy and nobody has to poll inWaiting(). Reads only
+#  take data from the buffer. Bytes received while the buffer is full are dropped and
+#  counted, like a UART FIFO overrun.
+#
+#  Writes are queued and sent by a writer thread. Small writes issued shortly after each
+#  other are sent with a single write call.
+
+import threading
+import time
+import traceback
+
+from PiGoStats import timer
+
+# Bounded byte ring buffer, not thread safe
+class RingBuffer:
+	def __init__(self, size):
+		self.buffer = bytearray(size)
+		self.size = size
+		self.head = 0
+		self.count = 0
+
+	# Store data, returns number of bytes stored (the rest does not fit)
+	def write(self, data):
+		numBytes = min(len(data), self.size - self.count)
+		tail = (self.head + self.count) % self.size
+		first = min(numBytes, self.size - tail)
+		self.buffer[tail:tail + first] = data[0:first]
+		if numBytes > first:
+			self.buffer[0:numBytes - first] = data[first:numBytes]
+		self.count += numBytes
+		return numBytes
+
+	# Remove and return up to numBytes bytes
+	def read(self, numBytes):
+		numBytes = min(numBytes, self.count)
+		first = min(numBytes, self.size - self.head)
+		data = bytes(self.buffer[self.head:self.head + first])
+		if numBytes > first:
+			data += bytes(self.buffer[0:numBytes - first])
+		self.head = (self.head + numBytes) % self.size
+		self.count -= numBytes
+		if self.count == 0:
+			self.head = 0
+		return data
+
+	# Position of delimiter in the buffered data, searching from start, -1 if not found
+	def find(self, delimiter, start = 0):
+		if start >= self.count:
+			return -1
+		end = self.head + self.count
+		if end <= self.size:
+			index = self.buffer.find(delimiter, self.head + start, end)
+			if index < 0:
+				return -1
+			return index - self.head
+
+		# Data wraps around the end of the buffer
+		firstLength = self.size - self.head
+		if start < firstLength:
+			index = self.buffer.find(delimiter, self.head + start, self.size)
+			if index >= 0:
+				return index - self.head
+			# Delimiter split by the end of the buffer
+			overlap = len(delimiter) - 1
+			if overlap > 0:
+				begin = max(self.head + start, self.size - overlap)
+				joined = self.buffer[begin:self.size] + self.buffer[0:min(overlap, end - self.size)]
+				index = joined.find(delimiter)
+				if index >= 0:
+					return begin - self.head + index
+		index = self.buffer.find(delimiter, max(0, start - firstLength), end - self.size)
+		if index < 0:
+			return -1
+		return firstLength + index
+
+# State of a pySerial-like port
+# Arguments:
+#   serObj: pySerial-like object
+# Returns:
+#   False if the port is known to be closed, True otherwise
+def portOpen(serObj):
+	if hasattr(serObj, 'is_open'):
+		return serObj.is_open
+	if hasattr(serObj, 'isOpen'):
+		return serObj.isOpen()
+	return True
+
+# Serial port reader and writer threads
+class SerialReader:
+	# SerialReader constructor
+	# Arguments:
+	#   serObj: open pySerial-like object (read(), inWaiting(), write() and timeout attribute)
+	#   bufferSize: size of the receive ring buffer in bytes (default: 4096)
+	#   writeDelay: time in seconds queued writes are held back to be combined with following ones (default: 0.001)
+	#   writeChunk: queued data is written immediately when this many bytes are waiting (default: 256)
+	#   pollInterval: serial port read timeout used by the reader thread, limits the stop() delay (default: 0.05)
+	#   statsObj: PiGoStats.BoardStats object counting the serial traffic, or None
+	#   readRetries: failed reads of an open port are retried every pollInterval, the threads stop after
+	#                this many consecutive failures like on a closed port (default: 20)
+	# Returns:
+	#   none
+	def __init__(self, serObj, bufferSize = 4096, writeDelay = 0.001, writeChunk = 256, pollInterval = 0.05, statsObj = None,
+							readRetries = 20):
+		self.serObj = serObj
+		self.statsObj = statsObj
+		self.ring = RingBuffer(bufferSize)
+		self.condition = threading.Condition()
+
+		# Read timeout of the port, used for blocking reads from the buffer
+		self.timeout = serObj.timeout
+		self.pollInterval = pollInterval
+		self.readRetries = readRetries
+		serObj.timeout = pollInterval
+
+		# High watermark callback (see setWatermark)
+		self.highWatermark = None
+		self.lowWatermark = None
+		self.watermarkCallback = None
+		self.aboveWatermark = False
+
+		# Counters
+		self.bytesIn = 0
+		self.bytesOut = 0
+		self.reads = 0
+		self.writes = 0
+		self.readErrors = 0
+		self.writeErrors = 0
+		self.unsentBytes = 0
+		self.overflows = 0
+		self.droppedBytes = 0
+		self.watermarkHits = 0
+		self.maxLevel = 0
+
+		# Write queue
+		self.writeDelay = writeDelay
+		self.writeChunk = writeChunk
+		self.writeQueue = bytearray()
+		self.writeCondition = threading.Condition()
+		self.writing = False
+
+		self.running = True
+		self.readerThread = threading.Thread(target = self.readLoop, name = 'PiGoSerialReader')
+		self.readerThread.daemon = True
+		self.readerThread.start()
+		self.writerThread = threading.Thread(target = self.writeLoop, name = 'PiGoSerialWriter')
+		self.writerThread.daemon = True
+		self.writerThread.start()
+
+	# Stop the threads, queued data is written first
+	# The read timeout of the port is restored, data left in the buffer is discarded. Also needed after
+	# the threads stopped on a closed or failing port, to restore the read timeout
+	# Arguments:
+	#   none
+	# Returns:
+	#   none
+	def stop(self):
+		if self.running:
+			self.flush()
+			self.running = False
+			with self.writeCondition:
+				self.writeCondition.notify_all()
+			with self.condition:
+				self.condition.notify_all()
+		self.readerThread.join()
+		self.writerThread.join()
+		self.serObj.timeout = self.timeout
+
+	# Set high watermark callback
+	# Arguments:
+	#   high: buffer level in bytes that triggers the callback, None to remove the callback
+	#   callback: function called as callback(level) from the reader thread when the buffer level
+	#             reaches high, it is not called again until the level falls below low
+	#             Exceptions raised by the callback are printed, the reader keeps running
+	#   low: level re-arming the callback (default: high / 2)
+	# Returns:
+	#   none
+	def setWatermark(self, high, callback, low = None):
+		with self.condition:
+			if low is None and high is not None:
+				low = high // 2
+			self.highWatermark = high
+			self.lowWatermark = low
+			self.watermarkCallback = callback
+			self.aboveWatermark = False
+
+	# Number of bytes in the receive buffer
+	def available(self):
+		return self.ring.count
+
+	# Read data in the receive buffer
+	# Arguments:
+	#   maxBytes: maximal number of bytes to read (default: all)
+	#   timeout: time in seconds to wait for data if the buffer is empty (default: 0, no waiting)
+	# Returns:
+	#   bytes, empty if no data was received
+	def readAvailable(self, maxBytes = None, timeout = 0):
+		with self.condition:
+			if self.ring.count == 0 and timeout != 0:
+				self.waitFor(lambda: self.ring.count > 0, timeout)
+			if maxBytes is None:
+				maxBytes = self.ring.count
+			return self.take(maxBytes)
+
+	# Read numBytes bytes, waits until they are received or the port read timeout expires (like pySerial read())
+	# Arguments:
+	#   numBytes: number of bytes to read
+	# Returns:
+	#   bytes, fewer than numBytes on timeout
+	def read(self, numBytes):
+		with self.condition:
+			self.waitFor(lambda: self.ring.count >= numBytes, self.timeout)
+			return self.take(numBytes)
+
+	# Read data up to and including the delimiter
+	# Arguments:
+	#   delimiter: bytes ending the data (default: b'\n')
+	#   timeout: time in seconds to wait for the delimiter, None to wait forever (default: port read timeout)
+	#   maxBytes: data is returned without delimiter when this many bytes are received (default: buffer size)
+	# Returns:
+	#   bytes, empty on timeout (received data stays in the buffer)
+	def readUntil(self, delimiter = b'\n', timeout = -1, maxBytes = None):
+		if timeout == -1:
+			timeout = self.timeout
+		if maxBytes is None:
+			maxBytes = self.ring.size
+		if isinstance(delimiter, str) and not isinstance(delimiter, bytes):
+			delimiter = delimiter.encode('latin-1')
+		delimiter = bytes(delimiter)
+		search = [0, -1]
+
+		# Already searched data is not searched again
+		def found():
+			search[1] = self.ring.find(delimiter, search[0])
+			if search[1] < 0:
+				search[0] = max(0, self.ring.count - len(delimiter) + 1)
+			return search[1] >= 0 or self.ring.count >= maxBytes
+
+		with self.condition:
+			if not self.waitFor(found, timeout):
+				return b''
+			if search[1] >= 0:
+				return self.take(min(search[1] + len(delimiter), maxBytes))
+			return self.take(maxBytes)
+
+	# Queue data for writing
+	# Arguments:
+	#   data: bytes-like object
+	# Returns:
+	#   none, IOError is raised if the threads are stopped (port closed or failing, or stop() called)
+	def write(self, data):
+		if isinstance(data, str) and not isinstance(data, bytes):
+			data = data.encode('latin-1')
+		with self.writeCondition:
+			if not self.running:
+				raise IOError("Serial reader is stopped, data is not sent")
+			self.writeQueue += data
+			self.writeCondition.notify_all()
+
+	# Wait until queued data is written
+	# Arguments:
+	#   timeout: time in seconds, None to wait forever (default)
+	# Returns:
+	#   True if the queue is empty, False on timeout
+	def flush(self, timeout = None):
+		with self.writeCondition:
+			return self.waitFor(lambda: len(self.writeQueue) == 0 and not self.writing, timeout, self.writeCondition)
+
+	# Reader and writer counters
+	# Returns:
+	#   dictionary of counters: bytes_in, bytes_out, reads and writes (port accesses), overflows (reads that
+	#   did not fit in the buffer), dropped_bytes, read_errors (failed reads, retried), write_errors (failed
+	#   writes), unsent_bytes (data of the failed writes), watermark_hits, max_level (highest buffer level), level (current buffer level),
+	#   queued (bytes waiting in the write queue)
+	def counters(self):
+		with self.condition:
+			result = {
+				'bytes_in': self.bytesIn,
+				'bytes_out': self.bytesOut,
+				'reads': self.reads,
+				'writes': self.writes,
+				'read_errors': self.readErrors,
+				'overflows': self.overflows,
+				'dropped_bytes': self.droppedBytes,
+				'write_errors': self.writeErrors,
+				'unsent_bytes': self.unsentBytes,
+				'watermark_hits': self.watermarkHits,
+				'max_level': self.maxLevel,
+				'level': self.ring.count,
+			}
+		result['queued'] = len(self.writeQueue)
+		return result
+
+	# Remove data from the buffer and re-arm the watermark callback, condition must be held
+	def take(self, numBytes):
+		data = self.ring.read(numBytes)
+		if self.aboveWatermark and self.ring.count < self.lowWatermark:
+			self.aboveWatermark = False
+		return data
+
+	# Wait on condition until predicate is true, condition must be held
+	# Returns:
+	#   predicate value
+	def waitFor(self, predicate, timeout, condition = None):
+		if condition is None:
+			condition = self.condition
+		if timeout is None:
+			while not predicate() and self.running:
+				condition.wait()
+			return predicate()
+		end = timer() + timeout
+		while not predicate():
+			remaining = end - timer()
+			if remaining <= 0 or not self.running:
+				return predicate()
+			condition.wait(remaining)
+		return True
+
+	def readLoop(self):
+		serObj = self.serObj
+		failures = 0
+		while self.running:
+			try:
+				start = timer()
+				# Wait for the first byte (port read timeout is pollInterval), then take everything received
+				data = serObj.read(1)
+				failures = 0
+				if len(data) == 0:
+					continue
+				waiting = serObj.inWaiting()
+				if waiting > 0:
+					data += serObj.read(waiting)
+			except (IOError, OSError, ValueError, TypeError, AttributeError) as e:
+				if isinstance(e, (IOError, OSError)) and portOpen(serObj):
+					with self.condition:
+						self.readErrors += 1
+					failures += 1
+					if failures <= self.readRetries:
+						# Transient error of an open port, the read is retried
+						time.sleep(self.pollInterval)
+						continue
+				# Port was closed or keeps failing, wake up the readers waiting for data
+				self.running = False
+				with self.condition:
+					self.condition.notify_all()
+				with self.writeCondition:
+					self.writeCondition.notify_all()
+				break
+			if self.statsObj is not None:
+				self.statsObj.serial(start, 0, len(data))
+
+			callback = None
+			with self.condition:
+				stored = self.ring.write(data)
+				self.bytesIn += len(data)
+				self.reads += 1
+				if stored < len(data):
+					self.overflows += 1
+					self.droppedBytes += len(data) - stored
+				level = self.ring.count
+				if level > self.maxLevel:
+					self.maxLevel = level
+				if self.highWatermark is not None and not self.aboveWatermark and level >= self.highWatermark:
+					self.aboveWatermark = True
+					self.watermarkHits += 1
+					callback = self.watermarkCallback
+				self.condition.notify_all()
+			if callback is not None:
+				try:
+					callback(level)
+				except Exception:
+					traceback.print_exc()
+
+	def writeLoop(self):
+		while True:
+			with self.writeCondition:
+				while len(self.writeQueue) == 0 and self.running:
+					self.writeCondition.wait()
+				if len(self.writeQueue) == 0:
+					return
+				# Give small writes a chance to be combined
+				if len(self.writeQueue) < self.writeChunk and self.writeDelay > 0 and self.running:
+					self.waitFor(lambda: len(self.writeQueue) >= self.writeChunk, self.writeDelay, self.writeCondition)
+				data = bytes(self.writeQueue)
+				del self.writeQueue[:]
+				self.writing = True
+
+			written = True
+			try:
+				start = timer()
+				self.serObj.write(data)
+				if self.statsObj is not None:
+					self.statsObj.serial(start, len(data), 0)
+			except (IOError, OSError, ValueError, TypeError, AttributeError):
+				written = False
+
+			with self.writeCondition:
+				self.writing = False
+				if written:
+					self.bytesOut += len(data)
+					self.writes += 1
+				else:
+					self.writeErrors += 1
+					self.unsentBytes += len(data)
+				self.writeCondition.notify_all()
@@ -0,0 +1,678 @@
+#       File: PiGoSim.py
+#       Description: Simulated PiGo board hardware backend
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+#  The simulator stands in for libBCM.so behind PiGoBoard.libObj. It implements the
+#  bcm2835_* functions used by PiGoLib together with the devices found on the PiGo board:
+#    - two MCP23017 IO expanders at 0x20 and 0x24
+#    - MCP3002 A/D and MCP4802 D/A converters of the ADDA modules (sockets A to D),
+#      selected by the chip-select pins on port B of the expander at 0x20
+#    - Raspberry Pi GPIO levels and edges, PWM range and data registers
+#    - UART loopback (everything written to the serial port is read back)
+#
+#  Usage:
+#    board = PiGoBoard(TestMode = 1)                    # default simulator
+#    board = PiGoBoard(Backend = SimBackend(latency = {'i2c': 0.0002}))
+
+import errno
+import os
+import select
+import threading
+import time
+import PiGoBoardData
+
+# Wait for the simulated transaction time
+# Sleeping is too coarse for sub-millisecond latencies, those are busy-waited
+def simWait(seconds):
+	if seconds <= 0:
+		return
+	if seconds >= 0.001:
+		time.sleep(seconds)
+		return
+	deadline = time.time() + seconds
+	while time.time() < deadline:
+		pass
+
+# MCP23017 16-bit IO expander (IOCON.BANK = 0)
+class SimMCP23017:
+	def __init__(self):
+		# Register file, IODIR registers reset to inputs
+		self.registers = [0] * 0x16
+		self.registers[PiGoBoardData.MCP23017_IODIRA] = 0xFF
+		self.registers[PiGoBoardData.MCP23017_IODIRB] = 0xFF
+		self.pointer = 0
+
+		# Levels applied to the pins from the outside (port A, port B)
+		self.pinLevels = [0, 0]
+
+	# Value of the port pins: output latch on outputs, external level on inputs
+	def portValue(self, port):
+		iodir = self.registers[PiGoBoardData.MCP23017_IODIRA + port]
+		olat = self.registers[PiGoBoardData.MCP23017_OLATA + port]
+		ipol = self.registers[PiGoBoardData.MCP23017_IPOLA + port]
+		return (olat & ~iodir & 0xFF) | ((self.pinLevels[port] ^ ipol) & iodir)
+
+	# Set the levels applied to input pins of the port
+	def setPinLevels(self, port, value):
+		previous = self.portValue(port)
+		self.pinLevels[port] = value & 0xFF
+		self.checkInterrupt(port, previous)
+
+	# Interrupt-on-change: set INTF flags and capture the port value
+	def checkInterrupt(self, port, previous):
+		value = self.portValue(port)
+		enabled = self.registers[PiGoBoardData.MCP23017_GPINTENA + port] & self.registers[PiGoBoardData.MCP23017_IODIRA + port]
+		control = self.registers[PiGoBoardData.MCP23017_INTCONA + port]
+		defval = self.registers[PiGoBoardData.MCP23017_DEFVALA + port]
+		# Compare with DEFVAL where INTCON is set, with the previous value elsewhere
+		triggered = enabled & (((value ^ defval) & control) | ((value ^ previous) & ~control))
+		if triggered == 0:
+			return
+		if self.registers[PiGoBoardData.MCP23017_INTFA + port] == 0:
+			self.registers[PiGoBoardData.MCP23017_INTCAPA + port] = value
+		self.registers[PiGoBoardData.MCP23017_INTFA + port] |= triggered
+
+	# INT output state (active when any interrupt flag is set)
+	def interruptPending(self):
+		return (self.registers[PiGoBoardData.MCP23017_INTFA] | self.registers[PiGoBoardData.MCP23017_INTFB]) != 0
+
+	# Advance the register pointer (sequential mode wraps after OLATB)
+	def advance(self):
+		self.pointer += 1
+		if self.pointer >= len(self.registers):
+			self.pointer = 0
+
+	def writeRegister(self, reg, value):
+		# Writing GPIO register modifies the output latch
+		if reg == PiGoBoardData.MCP23017_GPIOA or reg == PiGoBoardData.MCP23017_GPIOB:
+			reg += PiGoBoardData.MCP23017_OLATA - PiGoBoardData.MCP23017_GPIOA
+		# Flags and captured values are read only
+		if reg >= PiGoBoardData.MCP23017_INTFA and reg <= PiGoBoardData.MCP23017_INTCAPB:
+			return
+		self.registers[reg] = value & 0xFF
+
+	def readRegister(self, reg):
+		# Reading GPIO or INTCAP register clears the interrupt of the port
+		if reg == PiGoBoardData.MCP23017_GPIOA or reg == PiGoBoardData.MCP23017_GPIOB:
+			self.registers[PiGoBoardData.MCP23017_INTFA + reg - PiGoBoardData.MCP23017_GPIOA] = 0
+			return self.portValue(reg - PiGoBoardData.MCP23017_GPIOA)
+		if reg == PiGoBoardData.MCP23017_INTCAPA or reg == PiGoBoardData.MCP23017_INTCAPB:
+			self.registers[PiGoBoardData.MCP23017_INTFA + reg - PiGoBoardData.MCP23017_INTCAPA] = 0
+		return self.registers[reg]
+
+	# I2C write: first byte is the register address, the rest is written sequentially
+	def write(self, data):
+		if len(data) == 0:
+			return
+		self.pointer = data[0] % len(self.registers)
+		for value in data[1:]:
+			self.writeRegister(self.pointer, value)
+			self.advance()
+
+	# I2C read: registers are read sequentially from the current pointer
+	def read(self, numBytes):
+		result = []
+		for i in range(0, numBytes):
+			result.append(self.readRegister(self.pointer))
+			self.advance()
+		return result
+
+# MCP3002 10-bit A/D converter
+class SimMCP3002:
+	def __init__(self):
+		# Analog inputs as 10-bit conversion results
+		self.inputs = [0, 0]
+
+	def transfer(self, data):
+		if len(data) < 2 or not (data[0] & (1 << 6)):
+			return [0] * len(data)
+		channel = (data[0] >> 4) & 0x01
+		value = self.inputs[channel] & 0x3FF
+		# Null bit and the 10 data bits follow the configuration bits
+		return [(value >> 8) & 0x03, value & 0xFF] + [0] * (len(data) - 2)
+
+# MCP4802 8-bit D/A converter
+class SimMCP4802:
+	def __init__(self):
+		# Output codes and raw command words of channels A and B
+		self.outputs = [0, 0]
+		self.words = [0, 0]
+
+	def transfer(self, data):
+		if len(data) >= 2:
+			word = (data[0] << 8) | data[1]
+			channel = (word >> 15) & 0x01
+			self.words[channel] = word
+			if word & (1 << 12):
+				self.outputs[channel] = (word >> 4) & 0xFF
+			else:
+				# Channel shut down
+				self.outputs[channel] = 0
+		return [0] * len(data)
+
+# I2C device handle, same interface as PiGoLib.I2CDevice
+class SimI2CDevice:
+	def __init__(self, sim, addr):
+		self.sim = sim
+		self.addr = addr
+
+	def write(self, data):
+		if isinstance(data, int):
+			data = [data]
+		return self.sim.i2cWrite(self.addr, list(data))
+
+	def read(self, numBytes):
+		return self.sim.i2cRead(self.addr, numBytes)
+
+	def transfer(self, segments):
+		return self.sim.i2cTransfer(segments)
+
+	def close(self):
+		pass
+
+# GPIO edge source, same interface as PiGoEvents.SysfsEdgeSource
+# Level changes are delivered through a pipe, one byte ('0' or '1') per change
+class SimEdgeSource:
+	def __init__(self, sim, pin, edge):
+		self.sim = sim
+		self.pin = pin
+		self.edge = edge
+		self.pollEvents = select.POLLIN
+		self.readFd, self.writeFd = os.pipe()
+		self.level = sim.pinLevel(pin)
+		sim.edgeSources.setdefault(pin, []).append(self)
+
+	def fileno(self):
+		return self.readFd
+
+	# Like the kernel, only the edges requested by the edge attribute are signalled
+	def notify(self, level):
+		if (self.edge == PiGoBoardData.EDGE_RISING and not level) or (self.edge == PiGoBoardData.EDGE_FALLING and level):
+			return
+		os.write(self.writeFd, b'1' if level else b'0')
+
+	def read(self):
+		try:
+			self.level = int(os.read(self.readFd, 1) == b'1')
+		except OSError:
+			pass
+		return self.level
+
+	def close(self):
+		sources = self.sim.edgeSources.get(self.pin, [])
+		if self in sources:
+			sources.remove(self)
+			os.close(self.readFd)
+			os.close(self.writeFd)
+
+# Serial port loopback or attached peer (see SimBackend.connectSerial()), implements the part of pySerial interface used by PiGoLib
+# Reads wait for data until the timeout expires, like on a real port
+class SimSerial:
+	def __init__(self, sim, port, baud, timeout = 1, **kwargs):
+		self.sim = sim
+		self.port = port
+		self.baudrate = baud
+		self.timeout = timeout
+		self.buffer = bytearray()
+		self.opened = True
+		self.condition = threading.Condition()
+
+	def isOpen(self):
+		return self.opened
+
+	def close(self):
+		with self.condition:
+			self.opened = False
+			self.condition.notify_all()
+
+	def flush(self):
+		pass
+
+	def write(self, data):
+		if not isinstance(data, (bytes, bytearray)):
+			data = data.encode('latin-1')
+		self.sim.transaction('serial', len(data))
+		received = data
+		if self.sim.serialPeer is not None:
+			received = self.sim.serialPeer.receive(data)
+		with self.condition:
+			self.buffer += received
+			self.condition.notify_all()
+		return len(data)
+
+	def inWaiting(self):
+		return len(self.buffer)
+
+	def read(self, size = 1):
+		with self.condition:
+			if self.timeout is None:
+				while len(self.buffer) < size and self.opened:
+					self.condition.wait()
+			else:
+				end = time.time() + self.timeout
+				while len(self.buffer) < size and self.opened:
+					remaining = end - time.time()
+					if remaining <= 0:
+						break
+					self.condition.wait(remaining)
+			if not self.opened:
+				raise ValueError("Attempting to use a port that is not open")
+			data = bytes(self.buffer[0:size])
+			del self.buffer[0:size]
+		self.sim.transaction('serial', len(data))
+		return data
+
+# Simulated backend, replaces libBCM.so
+class SimBackend:
+	# SimBackend constructor
+	# Arguments:
+	#   latency: dictionary of per-transaction latencies in seconds for 'i2c', 'spi', 'gpio', 'pwm'
+	#            and 'serial' buses (default: no latency)
+	#   modules: sockets with ADDA modules attached (default: 'ABCD')
+	#   intPin: Raspberry Pi GPIO the INT outputs of the expanders are connected to (default: not connected)
+	# Returns:
+	#   none
+	def __init__(self, latency = None, modules = 'ABCD', intPin = None):
+		self.latency = {'i2c': 0.0, 'spi': 0.0, 'gpio': 0.0, 'pwm': 0.0, 'serial': 0.0}
+		if latency is not None:
+			self.latency.update(latency)
+
+		# Transaction and byte counters per bus
+		self.transactions = dict((bus, 0) for bus in self.latency)
+		self.bytes = dict((bus, 0) for bus in self.latency)
+
+		# I2C bus
+		self.i2cBus = None
+		self.i2cAddr = 0
+		self.i2cDevices = {}
+		for addr in PiGoBoardData.PIGO_EXPANDER_ADDR:
+			self.i2cDevices[addr] = SimMCP23017()
+
+		# SPI bus
+		self.spiDataMode = PiGoBoardData.BCM2835_SPI_MODE0
+		self.spiClockDivider = PiGoBoardData.BCM2835_SPI_CLOCK_DIVIDER_65536
+		self.spiBitOrder = PiGoBoardData.BCM2835_SPI_BIT_ORDER_MSBFIRST
+		self.spiChipSelect = PiGoBoardData.BCM2835_SPI_CS0
+		self.spiChipSelectPolarity = [0, 0, 0]
+		self.spiEnabled = False
+		# Transfer active (TA) between the parts of a streamed transfer
+		self.spiActive = False
+
+		# ADDA modules per socket: (A/D, D/A)
+		self.modules = {}
+		for socket in modules:
+			self.modules[socket] = (SimMCP3002(), SimMCP4802())
+
+		# GPIO
+		self.gpioFsel = {}
+		self.gpioPud = {}
+		self.gpioOutputs = {}
+		self.gpioInputs = {}
+		self.edgeSources = {}
+		self.intPin = intPin
+
+		# PWM
+		self.pwmConfig = 0
+		self.pwmClockDivider = 0
+		self.pwmRange = 0
+		self.pwmData = 0
+
+		# ADDA converters wired to native or GPIO chip selects: (strategy, pin) -> (socket, chip)
+		self.chipSelects = {}
+
+		# Device attached to the serial port (default: loopback)
+		self.serialPeer = None
+
+	# Account one transaction on the bus and wait for its simulated duration
+	def transaction(self, bus, numBytes = 0):
+		self.transactions[bus] += 1
+		self.bytes[bus] += numBytes
+		simWait(self.latency[bus])
+
+	# Reset transaction and byte counters
+	def resetCounters(self):
+		for bus in self.transactions:
+			self.transactions[bus] = 0
+			self.bytes[bus] = 0
+
+	# *********************************
+	#       Simulated environment
+	# *********************************
+
+	# Set levels applied to external IO pins (port B of both expanders)
+	# Arguments:
+	#   ExtPinNr: External IO number (0-15)
+	#   PinValue: pin level
+	def setExtInput(self, ExtPinNr, PinValue):
+		expander = self.i2cDevices[PiGoBoardData.PIGO_EXPANDER_ADDR[int(ExtPinNr / 8)]]
+		levels = expander.pinLevels[1]
+		if PinValue:
+			levels |= (1 << int(ExtPinNr % 8))
+		else:
+			levels &= ~(1 << int(ExtPinNr % 8))
+		expander.setPinLevels(1, levels)
+		self.updateInterruptPin()
+
+	# Drive the INT line (active low, open-drain outputs of both expanders wired together)
+	def updateInterruptPin(self):
+		if self.intPin is None:
+			return
+		pending = False
+		for device in self.i2cDevices.values():
+			if isinstance(device, SimMCP23017) and device.interruptPending():
+				pending = True
+		if pending:
+			self.setPinLevel(self.intPin, 0)
+		else:
+			self.setPinLevel(self.intPin, None)
+
+	# Set analog input of the ADDA module
+	# Arguments:
+	#   SocketID: socket of the ADDA module ('A', 'B', 'C' or 'D')
+	#   channel: A/D channel (0-1)
+	#   value: 10-bit conversion result
+	def setAnalogInput(self, SocketID, channel, value):
+		self.modules[SocketID][0].inputs[channel] = value
+
+	# Get the output code of the ADDA module D/A channel
+	# Arguments:
+	#   SocketID: socket of the ADDA module ('A', 'B', 'C' or 'D')
+	#   channel: D/A channel (0-1)
+	# Returns:
+	#   8-bit D/A output code
+	def getAnalogOutput(self, SocketID, channel):
+		return self.modules[SocketID][1].outputs[channel]
+
+	# Drive Raspberry Pi GPIO input pin from the outside
+	# Arguments:
+	#   pin: Raspberry Pi GPIO number
+	#   level: pin level, None to release the pin
+	def setPinLevel(self, pin, level):
+		previous = self.pinLevel(pin)
+		if level is None:
+			self.gpioInputs.pop(pin, None)
+		else:
+			self.gpioInputs[pin] = int(bool(level))
+		self.pinChanged(pin, previous)
+
+	# Notify edge sources of the pin if its level has changed
+	def pinChanged(self, pin, previous):
+		level = self.pinLevel(pin)
+		if level != previous:
+			for source in self.edgeSources.get(pin, []):
+				source.notify(level)
+
+	# *********************************
+	#       libBCM functions
+	# *********************************
+
+	def bcm2835_init(self):
+		return 1
+
+	def bcm2835_close(self):
+		return 1
+
+	def bcm2835_add_init(self, i2cBus):
+		self.i2cBus = i2cBus
+		return 1
+
+	def bcm2835_add_close(self):
+		return 1
+
+	def bcm2835_delay(self, millis):
+		time.sleep(millis / 1000.0)
+
+	def bcm2835_delayMicroseconds(self, micros):
+		simWait(micros / 1000000.0)
+
+	# GPIO
+
+	def bcm2835_gpio_fsel(self, pin, mode):
+		self.transaction('gpio')
+		previous = self.pinLevel(pin)
+		self.gpioFsel[pin] = mode
+		self.pinChanged(pin, previous)
+
+	def bcm2835_gpio_set_pud(self, pin, pud):
+		self.transaction('gpio')
+		previous = self.pinLevel(pin)
+		self.gpioPud[pin] = pud
+		self.pinChanged(pin, previous)
+
+	def bcm2835_gpio_write(self, pin, on):
+		self.transaction('gpio')
+		previous = self.pinLevel(pin)
+		self.gpioOutputs[pin] = int(bool(on))
+		self.pinChanged(pin, previous)
+
+	def bcm2835_gpio_set(self, pin):
+		self.bcm2835_gpio_write(pin, 1)
+
+	def bcm2835_gpio_clr(self, pin):
+		self.bcm2835_gpio_write(pin, 0)
+
+	def bcm2835_gpio_lev(self, pin):
+		self.transaction('gpio')
+		return self.pinLevel(pin)
+
+	def bcm2835_gpio_set_multi(self, mask):
+		self.writeMulti(mask, 1)
+
+	def bcm2835_gpio_clr_multi(self, mask):
+		self.writeMulti(mask, 0)
+
+	def bcm2835_gpio_lev_multi(self):
+		self.transaction('gpio')
+		value = 0
+		for pin in range(0, 32):
+			if self.pinLevel(pin):
+				value |= 1 << pin
+		return value
+
+	# Single GPSET0/GPCLR0 register write
+	def writeMulti(self, mask, on):
+		self.transaction('gpio')
+		for pin in range(0, 32):
+			if mask & (1 << pin):
+				previous = self.pinLevel(pin)
+				self.gpioOutputs[pin] = on
+				self.pinChanged(pin, previous)
+
+	def pinLevel(self, pin):
+		if self.gpioFsel.get(pin, PiGoBoardData.BCM2835_GPIO_FSEL_INPT) == PiGoBoardData.BCM2835_GPIO_FSEL_OUTP:
+			return self.gpioOutputs.get(pin, 0)
+		if pin in self.gpioInputs:
+			return self.gpioInputs[pin]
+		if self.gpioPud.get(pin) == PiGoBoardData.BCM2835_GPIO_PUD_UP:
+			return 1
+		return 0
+
+	# PWM
+
+	def bcm2835_pwm_init(self, config, clockDiv):
+		self.transaction('pwm')
+		self.pwmConfig = config
+		self.pwmClockDivider = clockDiv
+
+	def bcm2835_pwm0_setRange(self, value):
+		self.transaction('pwm')
+		self.pwmRange = value
+
+	def bcm2835_pwm0_setData(self, value):
+		self.transaction('pwm')
+		self.pwmData = value
+
+	def bcm2835_pwm_getStatus(self):
+		return 0
+
+	# SPI
+
+	def bcm2835_spi_begin(self):
+		self.spiEnabled = True
+
+	def bcm2835_spi_end(self):
+		self.spiEnabled = False
+
+	def bcm2835_spi_setBitOrder(self, order):
+		self.spiBitOrder = order
+
+	def bcm2835_spi_setDataMode(self, mode):
+		self.spiDataMode = mode
+
+	def bcm2835_spi_setClockDivider(self, divider):
+		self.spiClockDivider = divider
+
+	def bcm2835_spi_chipSelect(self, cs):
+		self.spiChipSelect = cs
+
+	def bcm2835_spi_setChipSelectPolarity(self, cs, active):
+		self.spiChipSelectPolarity[cs] = active
+
+	def bcm2835_spi_transfer(self, value):
+		buf = [value]
+		self.bcm2835_spi_transfern(buf, 1)
+		return buf[0]
+
+	def bcm2835_spi_transfern(self, buf, numBytes):
+		self.transaction('spi', numBytes)
+		data = [buf[i] for i in range(0, numBytes)]
+		result = self.spiExchange(data)
+		for i in range(0, numBytes):
+			buf[i] = result[i]
+
+	def bcm2835_spi_transfernFIFO(self, buf, numBytes):
+		self.bcm2835_spi_transfern(buf, numBytes)
+
+	def bcm2835_spi_transfernFIFO_part(self, buf, numBytes, first, last):
+		if first:
+			self.spiActive = True
+		if numBytes > 0:
+			self.bcm2835_spi_transfern(buf, numBytes)
+		if last:
+			self.spiActive = False
+
+	# Wire ADDA converter to a native or GPIO chip select instead of the expander pin of its socket
+	# Arguments:
+	#   kind: PiGoBoardData.CS_NATIVE (pin: BCM2835_SPI_CS0 or BCM2835_SPI_CS1) or CS_GPIO (pin: Raspberry GPIO)
+	#   pin: chip select
+	#   socket: module socket ('A'-'D')
+	#   chip: 0 for the A/D, 1 for the D/A converter (default: 0)
+	# Returns:
+	#   none
+	def connectChipSelect(self, kind, pin, socket, chip = 0):
+		self.chipSelects[(kind, pin)] = (socket, chip)
+
+	# Exchange data with the devices selected on the SPI bus
+	# ADDA chip-selects are driven by port B of the expander at 0x20 (A/D on even, D/A on odd pins),
+	# or by native and GPIO chip selects (see connectChipSelect())
+	def spiExchange(self, data):
+		expander = self.i2cDevices[PiGoBoardData.PIGO_EXPANDER_ADDR[0]]
+		selected = ~expander.portValue(1) & ~expander.registers[PiGoBoardData.MCP23017_IODIRB] & 0xFF
+		chips = []
+		for i, socket in enumerate('ABCD'):
+			if selected & (1 << (2 * i)):
+				chips.append((socket, 0))
+			if selected & (1 << (2 * i + 1)):
+				chips.append((socket, 1))
+		for (kind, pin), chip in self.chipSelects.items():
+			if kind == PiGoBoardData.CS_NATIVE:
+				if self.spiChipSelect == pin:
+					chips.append(chip)
+			elif self.gpioFsel.get(pin) == PiGoBoardData.BCM2835_GPIO_FSEL_OUTP and self.pinLevel(pin) == 0:
+				chips.append(chip)
+
+		result = [0] * len(data)
+		for socket, chip in chips:
+			if socket not in self.modules:
+				continue
+			if chip == 0:
+				result = self.modules[socket][0].transfer(data)
+			else:
+				self.modules[socket][1].transfer(data)
+		return result
+
+	# I2C (legacy single descriptor interface)
+
+	def bcm2835_i2c_setAddr(self, addr):
+		self.i2cAddr = addr
+		return 1
+
+	def bcm2835_i2c_write(self, buf, numBytes):
+		if self.i2cWrite(self.i2cAddr, [buf[i] for i in range(0, numBytes)]):
+			return numBytes
+		return 0
+
+	def bcm2835_i2c_read(self, buf, numBytes):
+		data = self.i2cRead(self.i2cAddr, numBytes)
+		for i in range(0, len(data)):
+			buf[i] = data[i]
+		return len(data)
+
+	# I2C device interface (see PiGoLib.I2CDevice)
+
+	def openI2Cdevice(self, bus, addr):
+		return SimI2CDevice(self, addr)
+
+	def i2cWrite(self, addr, data):
+		self.transaction('i2c', len(data))
+		device = self.i2cDevices.get(addr)
+		if device is None:
+			return False
+		device.write(data)
+		return True
+
+	def i2cRead(self, addr, numBytes):
+		self.transaction('i2c', numBytes)
+		device = self.i2cDevices.get(addr)
+		if device is None:
+			return []
+		result = device.read(numBytes)
+		self.updateInterruptPin()
+		return result
+
+	def i2cTransfer(self, segments):
+		self.transaction('i2c', sum([len(w) + n for addr, w, n in segments]))
+		result = []
+		for addr, writeData, readLength in segments:
+			device = self.i2cDevices.get(addr)
+			if device is None:
+				# No acknowledge from the address, like the i2c-dev driver
+				raise IOError(errno.ENXIO, os.strerror(errno.ENXIO))
+			if len(writeData) > 0:
+				device.write(list(writeData))
+			result.append(device.read(readLength))
+		self.updateInterruptPin()
+		return result
+
+	# GPIO edge detection (see PiGoEvents.SysfsEdgeSource)
+
+	def openEdgeSource(self, pin, edge):
+		return SimEdgeSource(self, pin, edge)
+
+	# Serial port
+
+	def openSerial(self, port, baud, **kwargs):
+		return SimSerial(self, port, baud, **kwargs)
+
+	# Attach device to the serial port instead of the loopback
+	# Arguments:
+	#   peer: object with receive(data) method returning the bytes it sends back (e.g. PiGoRPC.RPCPeer),
+	#         None for loopback
+	# Returns:
+	#   none
+	def connectSerial(self, peer):
+		self.serialPeer = peer
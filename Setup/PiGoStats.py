@@ -0,0 +1,234 @@
+#       File: PiGoStats.py
+#       Description: Bus-level instrumentation counters and latency histograms for PiGo board
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+#  Counters are plain integers updated without locking, concurrent updates from several
+#  threads may occasionally lose a count.
+
+import copy
+import timeit
+
+timer = timeit.default_timer
+
+# Number of histogram buckets: bucket i counts latencies below 2^i microseconds,
+# the last bucket counts everything longer
+HISTOGRAM_BUCKETS = 24
+
+# Latency histogram with power-of-two microsecond buckets
+class LatencyHistogram:
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		self.buckets = [0] * HISTOGRAM_BUCKETS
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	# Add a latency sample
+	# Arguments:
+	#   seconds: latency in seconds
+	def add(self, seconds):
+		bucket = int(seconds * 1000000).bit_length()
+		if bucket >= HISTOGRAM_BUCKETS:
+			bucket = HISTOGRAM_BUCKETS - 1
+		self.buckets[bucket] += 1
+		self.count += 1
+		self.total += seconds
+		if seconds > self.max:
+			self.max = seconds
+
+	# Snapshot of the histogram
+	# Returns:
+	#   dictionary with count, total_s, max_s, p50_s, p99_s and buckets
+	def snapshot(self):
+		result = {
+			'count': self.count,
+			'total_s': self.total,
+			'max_s': self.max,
+			'buckets': list(self.buckets),
+		}
+		updatePercentiles(result)
+		return result
+
+# Upper bound of the histogram bucket containing the p-th percentile
+# Arguments:
+#   buckets: histogram buckets
+#   p: percentile (0-100)
+# Returns:
+#   latency in seconds
+def bucketPercentile(buckets, p):
+	count = sum(buckets)
+	if count == 0:
+		return 0.0
+	limit = p / 100.0 * count
+	total = 0
+	for i in range(0, len(buckets)):
+		total += buckets[i]
+		if total >= limit:
+			return (1 << i) / 1000000.0
+	return (1 << (len(buckets) - 1)) / 1000000.0
+
+# Recalculate percentiles of histogram snapshot from its buckets
+def updatePercentiles(histogram):
+	histogram['p50_s'] = bucketPercentile(histogram['buckets'], 50)
+	histogram['p99_s'] = bucketPercentile(histogram['buckets'], 99)
+
+# Difference of two statistics snapshots
+# Arguments:
+#   before: earlier snapshot (see BoardStats.snapshot)
+#   after: later snapshot
+# Returns:
+#   snapshot with counters counted from before to after
+def delta(before, after):
+	if isinstance(after, dict):
+		result = {}
+		for key in after:
+			if key in before:
+				result[key] = delta(before[key], after[key])
+			else:
+				result[key] = copy.deepcopy(after[key])
+		if 'buckets' in result:
+			# Maximum of the interval is unknown, keep the overall one
+			result['max_s'] = after['max_s']
+			updatePercentiles(result)
+		return result
+	if isinstance(after, list):
+		return [delta(b, a) for b, a in zip(before, after)]
+	return after - before
+
+# Bus statistics of a single PiGo board
+class BoardStats:
+	def __init__(self):
+		self.histograms = {}
+		for bus in ['i2c', 'spi', 'gpio', 'pwm', 'serial']:
+			self.histograms[bus] = LatencyHistogram()
+		self.reset()
+
+	# Reset all counters and histograms
+	def reset(self):
+		self.i2cTransactions = 0
+		self.i2cAddresses = {}
+		self.i2cAddressSwitches = 0
+		self.i2cBytesWritten = 0
+		self.i2cBytesRead = 0
+		self.i2cWriteErrors = 0
+		self.spiTransfers = 0
+		self.spiBytes = 0
+		self.gpioReads = 0
+		self.gpioWrites = 0
+		self.pwmWrites = 0
+		self.serialBytesOut = 0
+		self.serialBytesIn = 0
+		for histogram in self.histograms.values():
+			histogram.reset()
+
+	# Record I2C transaction
+	# Arguments:
+	#   addr: I2C device address, or list of the addresses of a combined transaction (counted once each)
+	#   start: timer value at the start of the transaction
+	#   written: number of bytes written
+	#   read: number of bytes read
+	#   ack: False if the write was not acknowledged
+	def i2c(self, addr, start, written, read, ack = True):
+		self.histograms['i2c'].add(timer() - start)
+		self.i2cTransactions += 1
+		if isinstance(addr, list):
+			for address in set(addr):
+				self.i2cAddresses[address] = self.i2cAddresses.get(address, 0) + 1
+		else:
+			self.i2cAddresses[addr] = self.i2cAddresses.get(addr, 0) + 1
+		self.i2cBytesWritten += written
+		self.i2cBytesRead += read
+		if not ack:
+			self.i2cWriteErrors += 1
+
+	# Record I2C target address switch (I2C_SLAVE ioctl)
+	def i2cAddressSwitch(self):
+		self.i2cAddressSwitches += 1
+
+	# Record SPI transfer
+	# Arguments:
+	#   start: timer value at the start of the transfer
+	#   numBytes: number of bytes transferred
+	def spi(self, start, numBytes):
+		self.histograms['spi'].add(timer() - start)
+		self.spiTransfers += 1
+		self.spiBytes += numBytes
+
+	# Record GPIO access
+	# Arguments:
+	#   start: timer value at the start of the access
+	#   write: True for register writes, False for reads
+	def gpio(self, start, write):
+		self.histograms['gpio'].add(timer() - start)
+		if write:
+			self.gpioWrites += 1
+		else:
+			self.gpioReads += 1
+
+	# Record PWM register write
+	# Arguments:
+	#   start: timer value at the start of the access
+	def pwm(self, start):
+		self.histograms['pwm'].add(timer() - start)
+		self.pwmWrites += 1
+
+	# Record serial port access
+	# Arguments:
+	#   start: timer value at the start of the access
+	#   bytesOut: number of bytes written
+	#   bytesIn: number of bytes read
+	def serial(self, start, bytesOut, bytesIn):
+		self.histograms['serial'].add(timer() - start)
+		self.serialBytesOut += bytesOut
+		self.serialBytesIn += bytesIn
+
+	# Snapshot of all counters
+	# Returns:
+	#   dictionary of per-bus dictionaries
+	def snapshot(self):
+		return {
+			'i2c': {
+				'transactions': self.i2cTransactions,
+				'addresses': dict(self.i2cAddresses),
+				'address_switches': self.i2cAddressSwitches,
+				'bytes_written': self.i2cBytesWritten,
+				'bytes_read': self.i2cBytesRead,
+				'write_errors': self.i2cWriteErrors,
+				'latency': self.histograms['i2c'].snapshot(),
+			},
+			'spi': {
+				'transfers': self.spiTransfers,
+				'bytes': self.spiBytes,
+				'latency': self.histograms['spi'].snapshot(),
+			},
+			'gpio': {
+				'reads': self.gpioReads,
+				'writes': self.gpioWrites,
+				'latency': self.histograms['gpio'].snapshot(),
+			},
+			'pwm': {
+				'writes': self.pwmWrites,
+				'latency': self.histograms['pwm'].snapshot(),
+			},
+			'serial': {
+				'bytes_out': self.serialBytesOut,
+				'bytes_in': self.serialBytesIn,
+				'latency': self.histograms['serial'].snapshot(),
+			},
+		}
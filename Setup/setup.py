@@ -4,5 +4,5 @@ setup(name='PiGoLib',
       description='Python library for PiGo board',
       author='Matevz Bosnak',
       author_email='matevz@poscope.com',      
-      py_modules=['PiGoLib', 'PiGoBoardData'],
+      py_modules=['PiGoLib', 'PiGoBoardData', 'PiGoSim', 'PiGoBench', 'PiGoCheck', 'PiGoStats', 'PiGoEvents', 'PiGoAsync', 'PiGoArbiter', 'PiGoMmap', 'PiGoBCM', 'PiGoSerial', 'PiGoFraming', 'PiGoRPC', 'PiGoAcquisition'],
       )